@@ -0,0 +1,213 @@
+"""
+生成任务的协作式取消。
+每个请求的生成在独立的任务中运行并按request_id登记；调用取消接口、客户端断开连接，
+或同一请求开始了新的生成（例如生成途中编辑了大纲）时取消该任务。
+取消沿await链传播到各章节节点和上游HTTP请求，限流许可、熔断器和请求合并在各自的上下文管理器中释放；
+已完成的章节由调用方保存。
+多进程部署时（STATE_BACKEND=sqlite）每个生成任务还在共享状态中登记所在的进程；
+取消请求落在其他进程时写入共享的取消请求，由运行该任务的进程轮询后取消。共享状态的读写都在线程中执行，不阻塞事件循环。
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Awaitable, AsyncIterator, TypeVar, MutableMapping
+
+from starlette.requests import Request
+
+from api.state import running_generations, cancel_requests, REMOVE
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 取消原因
+CANCELLED_BY_USER = "cancelled_by_user"      # 调用了取消接口
+CLIENT_DISCONNECTED = "client_disconnected"  # 客户端断开连接
+SUPERSEDED = "superseded"                    # 同一请求开始了新的生成
+OUTLINE_EDITED = "outline_edited"            # 生成途中编辑了标题或大纲
+
+class GenerationCancelled(Exception):
+    """生成任务被取消"""
+
+    def __init__(self, request_id: str, reason: str):
+        super().__init__(f"生成任务{request_id}已取消: {reason}")
+        self.request_id = request_id
+        self.reason = reason
+
+class _Generation:
+    """一个登记中的生成任务"""
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.reason: Optional[str] = None
+        # 在共享状态中标识本次生成（同一请求的新生成不会被针对旧生成的取消请求误取消）
+        self.token = uuid.uuid4().hex
+
+    def cancel(self, reason: str) -> bool:
+        if self.task.done():
+            return False
+        if self.reason is None:
+            self.reason = reason
+        return self.task.cancel()
+
+def process_alive(pid: int) -> bool:
+    """本机上的进程是否仍在运行（uvicorn的各个worker进程在同一台机器上）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class GenerationRegistry:
+    """按请求ID登记正在进行的生成任务，支持取消"""
+
+    def __init__(self, disconnect_poll: float = 1.0,
+                 shared_running: Optional[MutableMapping[str, Dict[str, Any]]] = None,
+                 shared_cancels: Optional[MutableMapping[str, Dict[str, Any]]] = None):
+        """
+        Args:
+            disconnect_poll: 检查客户端是否断开（以及其他进程发来的取消请求）的间隔（秒）
+            shared_running: 多进程共享的登记表（request_id -> 所在进程），单进程时为None
+            shared_cancels: 多进程共享的取消请求（request_id -> 目标生成和原因），单进程时为None；
+                两者需要提供SharedDict的异步接口（aget / aset / aupdate_item）
+        """
+        self.disconnect_poll = disconnect_poll
+        self.shared_running = shared_running
+        self.shared_cancels = shared_cancels
+        self._running: Dict[str, _Generation] = {}
+        self.cancelled: Dict[str, int] = {}
+
+    async def run(self, request_id: str, coro: Awaitable[T], request: Optional[Request] = None) -> T:
+        """在独立任务中运行一次生成，等待其结果
+
+        同一请求已有进行中的生成时先取消旧的。传入request时，客户端断开连接也会取消本次生成。
+
+        Raises:
+            GenerationCancelled: 生成被取消（已完成的部分由调用方保存）
+        """
+        await self.cancel(request_id, SUPERSEDED)
+        entry = _Generation(asyncio.ensure_future(coro))
+        await self._register(request_id, entry)
+        watcher = None
+        if request is not None or self.shared_cancels is not None:
+            watcher = asyncio.ensure_future(self._watch(request_id, entry, request))
+        try:
+            return await entry.task
+        except asyncio.CancelledError:
+            if entry.reason is None:
+                # 调用方自身被取消（例如服务关闭），继续向上传播
+                raise
+            raise GenerationCancelled(request_id, entry.reason) from None
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            await self._forget(request_id, entry)
+
+    @asynccontextmanager
+    async def track(self, request_id: str) -> AsyncIterator[_Generation]:
+        """登记当前任务（如SSE响应所在的任务），cancel()时直接取消它"""
+        await self.cancel(request_id, SUPERSEDED)
+        entry = _Generation(asyncio.current_task())
+        await self._register(request_id, entry)
+        watcher = asyncio.ensure_future(self._watch(request_id, entry)) if self.shared_cancels is not None else None
+        try:
+            yield entry
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            await self._forget(request_id, entry)
+
+    async def cancel(self, request_id: str, reason: str = CANCELLED_BY_USER) -> bool:
+        """取消请求正在进行的生成（可能在其他进程中），返回是否有任务被取消"""
+        entry = self._running.get(request_id)
+        if entry is not None:
+            if not entry.cancel(reason):
+                return False
+        else:
+            owner = await self._remote_owner(request_id)
+            if owner is None:
+                return False
+            # 由运行该生成的进程在下一次轮询时取消
+            await self.shared_cancels.aset(request_id, {"token": owner["token"], "reason": reason, "requested_at": time.time()})
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        logger.info(f"取消生成任务 {request_id}: {reason}")
+        return True
+
+    async def is_running(self, request_id: str) -> bool:
+        entry = self._running.get(request_id)
+        if entry is not None and not entry.task.done():
+            return True
+        return await self._remote_owner(request_id) is not None
+
+    async def claim(self, request_id: str) -> bool:
+        """多进程同时启动时只让一个进程恢复同一个中断的生成：没有其他存活的进程在运行它时登记为本进程
+
+        Returns:
+            是否由本进程负责（单进程时总是True）
+        """
+        if self.shared_running is None:
+            return True
+        pid = os.getpid()
+
+        def take(owner: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if owner is not None and owner["pid"] != pid and process_alive(owner["pid"]):
+                return None
+            return {"pid": pid, "token": None, "started_at": time.time()}
+
+        return (await self.shared_running.aupdate_item(request_id, take))["pid"] == pid
+
+    async def _register(self, request_id: str, entry: _Generation) -> None:
+        self._running[request_id] = entry
+        if self.shared_running is not None:
+            await self.shared_running.aset(request_id, {"pid": os.getpid(), "token": entry.token, "started_at": time.time()})
+
+    async def _remote_owner(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """在其他存活进程中运行的生成的登记信息"""
+        if self.shared_running is None:
+            return None
+        owner = await self.shared_running.aget(request_id)
+        if owner is None or owner["token"] is None or owner["pid"] == os.getpid() or not process_alive(owner["pid"]):
+            return None
+        return owner
+
+    async def _watch(self, request_id: str, entry: _Generation, request: Optional[Request] = None) -> None:
+        """客户端断开连接，或其他进程发来取消请求时取消生成"""
+        while not entry.task.done():
+            if request is not None and await request.is_disconnected():
+                entry.cancel(CLIENT_DISCONNECTED)
+                self.cancelled[CLIENT_DISCONNECTED] = self.cancelled.get(CLIENT_DISCONNECTED, 0) + 1
+                return
+            if self.shared_cancels is not None:
+                cancel = await self.shared_cancels.aget(request_id)
+                if cancel is not None and cancel["token"] == entry.token:
+                    await self.shared_cancels.aupdate_item(
+                        request_id, lambda current: REMOVE if current and current["token"] == entry.token else None
+                    )
+                    entry.cancel(cancel["reason"])
+                    return
+            await asyncio.sleep(self.disconnect_poll)
+
+    async def _forget(self, request_id: str, entry: _Generation) -> None:
+        if self._running.get(request_id) is entry:
+            del self._running[request_id]
+        if self.shared_running is not None:
+            # 在finally中执行：调用方正被取消时也要完成注销
+            await asyncio.shield(self.shared_running.aupdate_item(
+                request_id, lambda owner: REMOVE if owner and owner["token"] == entry.token else None
+            ))
+
+    def stats(self) -> Dict[str, Any]:
+        """本进程内正在进行的生成和各原因的取消次数"""
+        return {
+            "running": sorted(request_id for request_id, entry in self._running.items() if not entry.task.done()),
+            "cancelled": dict(self.cancelled)
+        }
+
+# 进程内共享的生成任务登记表（多进程部署时通过共享状态互相取消）
+generation_registry = GenerationRegistry(shared_running=running_generations, shared_cancels=cancel_requests)
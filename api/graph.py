@@ -187,8 +187,9 @@ async def generate_title(topic: str, document_type: str, page_limit: int = 10):
         }
 
 # 2. 大纲智能体包装器
-async def generate_outline(topic: str, title: str, page_limit: int, document_type: str):
-    """根据标题和页数限制生成大纲（LangGraph实现）"""
+async def generate_outline(topic: str, title: str, page_limit: int, document_type: str,
+                           hierarchical: Optional[bool] = None):
+    """根据标题和页数限制生成大纲（LangGraph实现）；分层生成时章节数随页数增长"""
     try:
         # 运行工作流，从标题开始，执行到大纲生成步骤
         initial_state: DocumentState = {
@@ -210,7 +211,8 @@ async def generate_outline(topic: str, title: str, page_limit: int, document_typ
             page_limit=page_limit,
             document_type=document_type,
             initial_state=initial_state,
-            stop_at="outline_generated"  # 在生成大纲后停止
+            stop_at="outline_generated",  # 在生成大纲后停止
+            hierarchical=hierarchical
         )
         
         success = result["current_step"] == "outline_generated"
@@ -243,6 +245,70 @@ async def generate_outline(topic: str, title: str, page_limit: int, document_typ
             "error": f"大纲生成过程中出错: {str(e)}"
         }
 
+# 2.1 规划智能体包装器：一次性得到标题和大纲
+async def generate_plan(topic: str, document_type: str, page_limit: int = 10, strategy: str = "plan",
+                        hierarchical: Optional[bool] = None):
+    """同时得到标题和大纲（LangGraph实现）
+    
+    strategy为"plan"时一次LLM调用生成两者，解析失败时内部回退到两步生成；
+    为"speculative"时用临时标题推测大纲，与标题生成并行执行；
+    为"streaming"时先生成标题，再流式生成大纲（只到大纲阶段，不提前生成内容）。
+    """
+    try:
+        initial_state: DocumentState = {
+            "topic": topic,
+            "document_type": document_type,
+            "page_limit": page_limit,
+            "current_step": "started",
+            "error_message": None,
+            "title": None,
+            "outline": None,
+            "content": None,
+            "user_edited_outline": False,
+            "user_edited_title": False,
+            "outline_strategy": strategy
+        }
+        
+        result = await run_document_workflow(
+            topic=topic,
+            page_limit=page_limit,
+            document_type=document_type,
+            initial_state=initial_state,
+            stop_at="outline_generated",
+            hierarchical=hierarchical
+        )
+        
+        success = result["current_step"] == "outline_generated"
+        title = result["title"] or f"{topic}研究分析"
+        outline = result["outline"]
+        
+        # 如果大纲为空，使用默认大纲
+        if not outline:
+            outline = generate_default_outline(topic, page_limit)["outline"]
+        
+        return {
+            "success": success,
+            "title": title,
+            "outline": outline,
+            "estimated_pages": 2 + len(outline),
+            "strategy": result.get("outline_strategy_used", strategy),
+            "error": result.get("error_message")
+        }
+    
+    except Exception as e:
+        print(f"规划智能体执行出错: {e}")
+        print(f"详细错误: {traceback.format_exc()}")
+        
+        default_data = generate_default_outline(topic, page_limit)
+        return {
+            "success": False,
+            "title": f"{topic}研究分析",
+            "outline": default_data["outline"],
+            "estimated_pages": default_data["estimated_pages"],
+            "strategy": strategy,
+            "error": f"规划过程中出错: {str(e)}"
+        }
+
 # 3. 内容智能体包装器
 async def generate_content(title: str, topic: str, outline: List[Dict[str, Any]], document_type: str = "ppt", page_limit: int = None):
     """根据标题和大纲生成每个章节的详细内容（LangGraph实现）"""
@@ -325,12 +391,12 @@ def create_document_workflow():
     
     注意：这个函数只是为了保持API兼容，实际实现已经移到langgraph_impl模块中
     """
-    # 直接导入langgraph_impl中的工作流创建函数
-    from api.langgraph_impl import create_complete_workflow
-    return create_complete_workflow()
+    # 直接复用langgraph_impl注册表中已编译的工作流
+    from api.langgraph_impl import get_workflow
+    return get_workflow()
 
 # 提供一个运行完整工作流的函数
-async def run_document_workflow(topic: str, page_limit: int, document_type: str, initial_state: Optional[DocumentState] = None, stop_at: Optional[str] = None) -> DocumentState:
+async def run_document_workflow(topic: str, page_limit: int, document_type: str, initial_state: Optional[DocumentState] = None, stop_at: Optional[str] = None, **options) -> DocumentState:
     """运行文档生成工作流，可以在指定步骤停止
     
     Args:
@@ -339,10 +405,11 @@ async def run_document_workflow(topic: str, page_limit: int, document_type: str,
         document_type: 文档类型 ("ppt" 或 "word")
         initial_state: 可选的初始状态，用于从特定阶段开始工作流
         stop_at: 可选，工作流执行到此步骤后停止，例如 "title_generated" 或 "outline_generated"
+        **options: 其他生成选项（如section_concurrency），原样传给langgraph_impl的实现
         
     Returns:
         完成的工作流状态
     """
     # 这里直接调用langgraph_impl中的实现，确保行为一致
     from api.langgraph_impl import run_document_workflow as run_workflow_impl
-    return await run_workflow_impl(topic, page_limit, document_type, initial_state, stop_at) 
\ No newline at end of file
+    return await run_workflow_impl(topic, page_limit, document_type, initial_state, stop_at, **options) 
\ No newline at end of file
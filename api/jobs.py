@@ -0,0 +1,331 @@
+"""
+后台生成任务。
+完整文档的生成往往需要数分钟，同步接口在此期间一直占用HTTP连接，容易被代理超时断开。
+提交任务后立即返回任务ID（202），由全局有界的工作协程池在后台运行工作流；
+客户端轮询任务状态或以SSE订阅状态变化。任务记录保存在document_jobs中，与document_requests一起持久化，
+进程重启时未完成的任务重新排队，已完成的节点和章节从检查点恢复。
+多进程部署时（STATE_BACKEND=sqlite）任务记录在各进程间共享：任意进程都能查询和取消任务，
+状态变化通过原子更新完成，同一个任务只会被一个进程认领执行。任务记录的读写通过存储的异步接口进行，
+共享存储（SQLite）的操作在线程中执行，不阻塞事件循环。
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Any, Optional, List, Callable, Awaitable, AsyncIterator, MutableMapping
+
+from api.state import document_jobs, REMOVE
+from api.cancellation import generation_registry, CANCELLED_BY_USER, process_alive
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# 任务处理函数: (request_id, 参数) -> 与同步接口相同的响应
+JobHandler = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+class JobQueueFull(Exception):
+    """排队的任务数已达上限"""
+
+class JobManager:
+    """后台任务的提交、排队、执行和取消
+
+    固定数量的工作协程从队列中取出任务执行，同时运行的工作流不超过workers个，
+    排队的任务不超过max_queued个，超出时拒绝提交（调用方返回503）。
+    """
+
+    def __init__(self, jobs: MutableMapping[str, Dict[str, Any]], workers: int = 4, max_queued: int = 100,
+                 ttl: float = 7 * 24 * 3600, watch_poll: float = 1.0):
+        """
+        Args:
+            jobs: 任务记录的存储（job_id -> 任务），需要提供StateDict / SharedDict的异步接口（aget、aupdate_item等）
+            workers: 同时执行的任务数上限
+            max_queued: 排队等待的任务数上限
+            ttl: 已结束的任务记录保留的秒数
+            watch_poll: 订阅任务状态时重新读取记录的间隔（秒），用于发现其他进程中的状态变化
+        """
+        self.jobs = jobs
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.ttl = ttl
+        self.watch_poll = watch_poll
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional["asyncio.Queue[str]"] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._cancel_requested: set = set()
+        # 未结束的任务（job_id -> 任务）：进程内存储时据此查询排队和执行中的任务，不扫描全部任务记录
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self.finished: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, jobs: MutableMapping[str, Dict[str, Any]]) -> "JobManager":
+        return cls(
+            jobs,
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", "100")),
+            ttl=float(os.getenv("JOB_TTL", str(7 * 24 * 3600)))
+        )
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """登记一种任务的处理函数"""
+        self._handlers[kind] = handler
+
+    async def start(self) -> int:
+        """启动工作协程，清理过期的任务记录，并让上次进程退出时未完成的任务重新排队
+
+        执行中的任务只有在执行它的进程已经退出时才重新排队；多个进程同时启动时都会把排队中的任务放入各自的队列，
+        由_run()中的原子认领保证只执行一次。
+
+        Returns:
+            重新排队的任务数
+        """
+        self._queue = asyncio.Queue()
+        await self.prune()
+        pending = []
+        for job in sorted((job for _, job in await self.jobs.aitems()), key=lambda job: job["created_at"]):
+            if job["status"] == RUNNING:
+                job = await self._transition(job["job_id"], self._orphaned, status=QUEUED, started_at=None) or job
+            self._index(job)
+            if job["status"] == QUEUED:
+                pending.append(job)
+                self._queue.put_nowait(job["job_id"])
+        if pending:
+            logger.info(f"{len(pending)}个未完成的后台任务重新排队")
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return len(pending)
+
+    async def stop(self) -> None:
+        """停止工作协程；正在执行的任务保持running状态，下次启动时重新排队"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, kind: str, request_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """提交一个任务，返回任务记录
+
+        Raises:
+            JobQueueFull: 排队的任务数已达上限
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        if self._queue is None:
+            raise RuntimeError("任务管理器尚未启动")
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"排队的任务已达上限（{self.max_queued}）")
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "kind": kind,
+            "request_id": request_id,
+            "params": params,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+        await self._save(job)
+        self._queue.put_nowait(job["job_id"])
+        logger.info(f"后台任务已提交: {job['job_id']}（{kind}，请求ID: {request_id}）")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务记录；排队中的任务附带queue_position（前面还有几个任务）"""
+        job = await self.jobs.aget(job_id)
+        if job is None:
+            return None
+        job = dict(job)
+        if job["status"] == QUEUED:
+            job["queue_position"] = sum(1 for other in await self._unfinished(QUEUED) if other["created_at"] < job["created_at"])
+        return job
+
+    async def is_pending(self, request_id: str) -> bool:
+        """请求是否有排队中或执行中的任务"""
+        if getattr(self.jobs, "shared", False):
+            jobs = await self.jobs.afind("request_id", request_id)
+        else:
+            jobs = [job for job in self._active.values() if job["request_id"] == request_id]
+        return any(job["status"] not in FINISHED_STATES for job in jobs)
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消任务：排队中的直接标记为已取消，执行中的取消其生成（已完成的章节保留）
+
+        Returns:
+            任务是否尚未结束（已结束的任务无法取消）
+        """
+        job = await self.jobs.aget(job_id)
+        if job is None or job["status"] in FINISHED_STATES:
+            return False
+        if job["status"] == QUEUED:
+            cancelled = await self._transition(job_id, lambda job: job["status"] == QUEUED, status=CANCELLED,
+                                         finished_at=time.time(), error="任务在排队时被取消")
+            if cancelled is not None:
+                self.finished[CANCELLED] = self.finished.get(CANCELLED, 0) + 1
+                logger.info(f"后台任务{job_id}结束: {CANCELLED}")
+                return True
+            # 已被某个进程认领，按执行中的任务取消
+            job = await self.jobs.aget(job_id)
+            if job is None or job["status"] in FINISHED_STATES:
+                return False
+        self._cancel_requested.add(job_id)
+        await generation_registry.cancel(job["request_id"], CANCELLED_BY_USER)
+        return True
+
+    async def watch(self, job_id: str, keepalive: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """先产出任务的当前记录，之后每次状态变化产出一次，任务结束后停止
+
+        设置keepalive时，超过该秒数没有变化就产出None（用于SSE心跳）。
+        本进程中的变化立即产出，其他进程中的变化在watch_poll秒内发现。
+        """
+        last = None
+        idle = 0.0
+        while True:
+            event = self._changed.setdefault(job_id, asyncio.Event())
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if job != last:
+                yield job
+                last, idle = job, 0.0
+                if job["status"] in FINISHED_STATES:
+                    return
+            timeout = self.watch_poll if keepalive is None else max(0.0, min(self.watch_poll, keepalive - idle))
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                idle += timeout
+                if keepalive is not None and idle >= keepalive:
+                    yield None
+                    idle = 0.0
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        # 原子认领：任务仍在排队时才改为执行中，已被其他进程认领或已取消时放弃
+        job = await self._transition(job_id, lambda job: job["status"] == QUEUED, status=RUNNING,
+                                     started_at=time.time(), worker=os.getpid())
+        if job is None:
+            return
+        logger.info(f"开始执行后台任务: {job['job_id']}（{job['kind']}，请求ID: {job['request_id']}）")
+        try:
+            if job["job_id"] in self._cancel_requested:
+                await self._finish(job, CANCELLED, error="任务在开始执行前被取消")
+                return
+            result = await self._handlers[job["kind"]](job["request_id"], job["params"])
+        except asyncio.CancelledError:
+            # 服务关闭：保持running状态，下次启动时重新排队
+            raise
+        except Exception as e:
+            logger.error(f"后台任务{job['job_id']}执行失败: {e}")
+            await self._finish(job, FAILED, error=str(e))
+            return
+        finally:
+            self._cancel_requested.discard(job["job_id"])
+
+        if result.get("cancel_reason"):
+            status = CANCELLED
+        else:
+            status = SUCCEEDED if result.get("success") else FAILED
+        await self._finish(job, status, result=result, error=None if status == SUCCEEDED else result.get("message"))
+
+    async def _finish(self, job: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None) -> None:
+        job = {**job, "status": status, "finished_at": time.time(), "result": result, "error": error}
+        await self._save(job)
+        self.finished[status] = self.finished.get(status, 0) + 1
+        logger.info(f"后台任务{job['job_id']}结束: {status}")
+
+    async def _save(self, job: Dict[str, Any]) -> None:
+        """写回任务记录并唤醒订阅者"""
+        await self.jobs.aset(job["job_id"], job)
+        self._index(job)
+        self._notify(job["job_id"])
+
+    def _index(self, job: Dict[str, Any]) -> None:
+        """按任务的最新状态维护未结束任务的索引（共享存储按索引列查询，不需要）"""
+        if getattr(self.jobs, "shared", False):
+            return
+        if job["status"] in FINISHED_STATES:
+            self._active.pop(job["job_id"], None)
+        else:
+            self._active[job["job_id"]] = job
+
+    async def _unfinished(self, status: str) -> List[Dict[str, Any]]:
+        """处于status（排队中或执行中）的任务
+
+        多进程共享的存储按索引列查询（其他进程提交的任务也在其中），进程内存储使用未结束任务的索引，
+        两者都不扫描已结束的任务记录。
+        """
+        if getattr(self.jobs, "shared", False):
+            return await self.jobs.afind("status", status)
+        return [job for job in self._active.values() if job["status"] == status]
+
+    async def _transition(self, job_id: str, condition: Callable[[Dict[str, Any]], bool],
+                          **fields: Any) -> Optional[Dict[str, Any]]:
+        """满足condition时原子地更新任务记录，返回更新后的记录；不满足时返回None"""
+        changed = []
+
+        def update(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if job is None or not condition(job):
+                return None
+            changed.append(True)
+            return {**job, **fields}
+
+        job = await self.jobs.aupdate_item(job_id, update)
+        if not changed:
+            return None
+        self._index(job)
+        self._notify(job_id)
+        return job
+
+    @staticmethod
+    def _orphaned(job: Dict[str, Any]) -> bool:
+        """执行中的任务所在的进程已经退出（或就是本进程的上一次运行）"""
+        worker = job.get("worker")
+        return job["status"] == RUNNING and (worker is None or worker == os.getpid() or not process_alive(worker))
+
+    def _notify(self, job_id: str) -> None:
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def prune(self) -> int:
+        """删除已结束超过ttl的任务记录，返回删除的数量"""
+        if self.ttl <= 0:
+            return 0
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in await self.jobs.aitems()
+                   if job["status"] in FINISHED_STATES and (job.get("finished_at") or 0) < cutoff]
+        for job_id in expired:
+            # 多个进程同时启动时都会清理，已被删除的记录跳过
+            await self.jobs.aupdate_item(job_id, lambda job: REMOVE if job is not None else None)
+        return len(expired)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "queued": len(await self._unfinished(QUEUED)),
+            "running": len(await self._unfinished(RUNNING)),
+            "finished": dict(self.finished)
+        }
+
+# 进程内共享的后台任务管理器（任务记录保存在document_jobs中）
+job_manager = JobManager.from_env(document_jobs)
@@ -3,26 +3,62 @@
 这个文件包含了使用LangGraph构建的完整文档生成流程。
 """
 
-from typing import TypedDict, List, Dict, Any, Optional, Literal, Union, Annotated
+from typing import TypedDict, List, Dict, Any, Optional, Literal, Union, Annotated, AsyncIterator, Callable
 import json
+import time
+import hashlib
 import traceback
 import re
 import os
+import math
 import asyncio
+import contextvars
+from contextlib import contextmanager, aclosing
+from difflib import SequenceMatcher
 
 # LangChain和LangGraph导入
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, Runnable
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnablePassthrough, Runnable, RunnableConfig
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 from pydantic import BaseModel, Field
 
 # 导入实用工具
-from utils.deepseek_client import DeepSeekClient, LangChainClient
+from utils.deepseek_client import DeepSeekClient, LangChainClient, convert_messages, usage_scope
+from utils.json_stream import StreamingArrayParser
+from utils.deadline import (
+    deadline_scope, resolve_deadline, current_deadline, current_strategy, mark_degraded,
+    FULL, NO_EXPANSION, SHORT_OUTPUT, OFFLINE, TIMED_OUT, DEADLINE_SHORT_MAX_TOKENS
+)
 
-# 进度跟踪变量 - 从state.py导入
-from api.state import generation_progress
+# 进度事件总线
+from api.progress import progress_bus, STAGE, SECTION_STARTED, SECTION_COMPLETED, SECTION_FAILED, COMPLETED, ERROR
+
+# 持久化检查点
+from api.state import checkpoint_store
+
+# 单个文档同时生成的章节数上限（可被请求中的section_concurrency覆盖）
+SECTION_CONCURRENCY = int(os.getenv("SECTION_CONCURRENCY", "4"))
+
+# 章节长度控制："continue"时内容不足则续写补足，"rewrite"时要求模型整体扩写（原有方式）
+SECTION_LENGTH_STRATEGY = os.getenv("SECTION_LENGTH_STRATEGY", "continue")
+SECTION_MAX_CONTINUATIONS = int(os.getenv("SECTION_MAX_CONTINUATIONS", "2"))
+# 估算max_tokens用的每token字符数，以及相对目标长度预留的余量倍数
+LLM_CHARS_PER_TOKEN = float(os.getenv("LLM_CHARS_PER_TOKEN", "1.5"))
+SECTION_LENGTH_HEADROOM = float(os.getenv("SECTION_LENGTH_HEADROOM", "2.0"))
+
+# 分层生成（章节 → 小节 → 段落）：未明确指定时，页数达到该值的文档使用分层生成
+HIERARCHICAL_PAGE_THRESHOLD = int(os.getenv("HIERARCHICAL_PAGE_THRESHOLD", "30"))
+# 每个段落（叶子）调用的目标字数
+HIERARCHICAL_LEAF_CHARS = int(os.getenv("HIERARCHICAL_LEAF_CHARS", "500"))
+# 分层生成时同时执行的节点数上限（未指定section_concurrency时）
+HIERARCHICAL_CONCURRENCY = int(os.getenv("HIERARCHICAL_CONCURRENCY", "16"))
+
+# 推测大纲：最终标题与临时标题的相似度达到该值时直接采用推测的大纲
+SPECULATIVE_TITLE_SIMILARITY = float(os.getenv("SPECULATIVE_TITLE_SIMILARITY", "0.6"))
 
 # 初始化AI客户端
 deepseek_client = DeepSeekClient()
@@ -31,14 +67,73 @@ langchain_client = None  # 不再初始化LangChain客户端
 
 def get_llm():
     """获取活跃的LLM"""
-    print("使用DeepSeek LLM")
     # 返回llm属性，而不是deepseek_client本身
     return deepseek_client.llm
 
+# ===============================
+# 组件注册表
+# ===============================
+
+class ComponentRegistry:
+    """构建一次、重复使用的组件注册表
+    
+    编译后的工作流、提示链和输出解析器都是无状态的，首次使用（或启动预热）时构建，
+    之后所有请求共享同一个实例。
+    """
+    
+    def __init__(self):
+        self._builders: Dict[str, Callable[[], Any]] = {}
+        self._components: Dict[str, Any] = {}
+        self.build_times: Dict[str, float] = {}
+        self.hits = 0
+    
+    def register(self, name: str, builder: Callable[[], Any]) -> None:
+        """注册组件的构建函数"""
+        self._builders[name] = builder
+        self._components.pop(name, None)
+    
+    def get(self, name: str) -> Any:
+        """获取组件，尚未构建时立即构建"""
+        component = self._components.get(name)
+        if component is not None:
+            self.hits += 1
+            return component
+        started = time.perf_counter()
+        component = self._builders[name]()
+        self.build_times[name] = time.perf_counter() - started
+        self._components[name] = component
+        return component
+    
+    def warm_up(self) -> Dict[str, float]:
+        """构建全部已注册的组件，返回各组件的构建耗时（秒）"""
+        for name in self._builders:
+            self.get(name)
+        return dict(self.build_times)
+    
+    def clear(self) -> None:
+        """丢弃已构建的组件（下次使用时重新构建）"""
+        self._components.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "built": sorted(self._components),
+            "hits": self.hits,
+            "build_times_ms": {name: round(seconds * 1000, 3) for name, seconds in self.build_times.items()}
+        }
+
+registry = ComponentRegistry()
+
 # ===============================
 # 状态和模型定义
 # ===============================
 
+def merge_section_results(
+    left: Optional[Dict[int, Dict[str, Any]]],
+    right: Optional[Dict[int, Dict[str, Any]]]
+) -> Dict[int, Dict[str, Any]]:
+    """章节结果的归并函数：并行的章节节点各自返回{大纲序号: 结果}，按序号合并"""
+    return {**(left or {}), **(right or {})}
+
 class DocumentState(TypedDict):
     """文档生成工作流的状态"""
     # 用户输入
@@ -58,6 +153,31 @@ class DocumentState(TypedDict):
     # 用户编辑标志
     user_edited_outline: Optional[bool]
     user_edited_title: Optional[bool]
+    
+    # 请求ID，用于进度推送和检查点
+    request_id: Optional[str]
+    
+    # 生成选项
+    section_concurrency: Optional[int]  # 同时生成的章节数上限
+    outline_strategy: Optional[str]     # 标题和大纲的生成方式: "sequential"（两步）、"plan"（一次生成）或 "speculative"（与标题并行推测大纲）或 "streaming"（流式大纲，章节到达即生成内容）
+    outline_strategy_used: Optional[str]  # 实际采用的方式，如"plan_fallback"、"speculative_hit"、"speculative_miss"
+    hierarchical: Optional[bool]        # 是否分层生成（章节 → 小节 → 段落）
+    
+    # 章节并行生成（fan-out/fan-in）
+    section_fingerprints: Optional[List[str]]  # 按大纲顺序的章节指纹
+    section_results: Annotated[Dict[int, Dict[str, Any]], merge_section_results]  # 各章节节点的结果，按大纲序号归并
+    
+    # 分层生成：各章节的小节规划和各段落的结果
+    chapter_plans: Annotated[Dict[int, Dict[str, Any]], merge_section_results]    # 大纲序号 -> 小节和段落要点
+    paragraph_results: Annotated[Dict[str, Dict[str, Any]], merge_section_results]  # "章.小节.段" -> 段落内容
+    
+    # 增量生成
+    incremental: Optional[bool]                 # 是否复用已有内容；为False时不读取之前运行留下的章节检查点
+    resumed: Optional[bool]                     # 是否为进程重启后恢复的中断运行（总是复用本次运行已完成的章节）
+    section_contents: Optional[Dict[str, str]]  # 按章节指纹保存的已生成内容，指纹未变的章节直接复用
+    reused_sections: Optional[List[str]]        # 本次复用的章节
+    regenerated_sections: Optional[List[str]]   # 本次调用模型生成的章节
+    degraded_sections: Optional[List[Dict[str, str]]]  # 因截止时间降级的章节及所用策略
 
 # ===============================
 # 标题生成组件
@@ -69,14 +189,8 @@ class TitleResponse(BaseModel):
 
 def create_title_chain() -> Runnable:
     """创建标题生成链"""
-    # 系统提示
-    system_prompt = """你是一个专业的标题生成专家。你能根据用户提供的主题，生成简洁、专业且吸引人的标题。"""
-    
-    # 用户提示模板
-    user_template = """
-    请为以下主题生成一个简洁、吸引人且专业的{document_type}文档标题:
-    
-    主题: {topic}
+    # 系统提示：固定不变的角色和要求放在前面，作为可被服务端缓存的稳定前缀
+    system_prompt = """你是一个专业的标题生成专家。你能根据用户提供的主题，生成简洁、专业且吸引人的标题。
     
     要求:
     1. 标题应该简洁明了，不超过20个字
@@ -85,6 +199,13 @@ def create_title_chain() -> Runnable:
     4. 只需要返回标题文本，不需要其他说明
     """
     
+    # 用户提示模板：只包含随请求变化的部分
+    user_template = """
+    请为以下主题生成一个简洁、吸引人且专业的{document_type}文档标题:
+    
+    主题: {topic}
+    """
+    
     # 创建提示
     prompt = ChatPromptTemplate.from_messages([
         ("system", system_prompt),
@@ -103,8 +224,8 @@ def create_title_chain() -> Runnable:
 async def generate_title_node(state: DocumentState) -> Dict[str, Any]:
     """标题生成节点"""
     try:
-        # 创建标题生成链
-        title_chain = create_title_chain()
+        # 获取标题生成链（全局复用）
+        title_chain = get_title_chain()
         
         # 准备参数
         params = {
@@ -184,8 +305,13 @@ def get_topic_specific_prompt(topic: str) -> str:
         使用与主题相关的具体专业术语和概念。每个章节有3-5个具体内容要点。
         """
 
-def determine_section_count(document_type: str, page_limit: int) -> Dict[str, Any]:
+def determine_section_count(document_type: str, page_limit: int, hierarchical: bool = False) -> Dict[str, Any]:
     """根据文档类型和页数确定章节数和指南"""
+    if hierarchical:
+        # 分层生成：章节数随页数增长，每个要点展开为一个小节
+        pages_per_chapter = 8 if document_type.lower() == "ppt" else 6
+        count = max(3, min(20, math.ceil(page_limit / pages_per_chapter)))
+        return {"count": count, "guide": f"创建{count}个章节，每章节4-6个要点，每个要点将展开为一个独立的小节"}
     if document_type.lower() == "ppt":
         if page_limit <= 5:
             return {"count": 2, "guide": "只创建2个核心章节，每章节2-3个要点"}
@@ -205,12 +331,21 @@ def determine_section_count(document_type: str, page_limit: int) -> Dict[str, An
         else:
             return {"count": 5, "guide": "创建5个或更多详细章节"}
 
-def create_outline_chain() -> Runnable:
-    """创建大纲生成链"""
-    # 系统提示
-    system_prompt = """你是一个专业的文档大纲设计专家。你能根据用户提供的主题和标题，生成结构清晰、内容全面的文档大纲。"""
+def create_outline_prompt() -> ChatPromptTemplate:
+    """创建大纲生成提示（已填入JSON格式说明）"""
+    # 系统提示：固定的角色、通用要求和JSON格式说明构成稳定前缀
+    system_prompt = """你是一个专业的文档大纲设计专家。你能根据用户提供的主题和标题，生成结构清晰、内容全面的文档大纲。
     
-    # 用户提示模板
+    通用要求:
+    1. 标题页和目录页将占用2页
+    2. 每个章节标题必须与主题紧密相关
+    3. 章节标题应该简洁明了，反映该部分的核心内容
+    4. 章节要点应该具体、专业，不要使用通用占位符
+    
+    {format_instructions}
+    """
+    
+    # 用户提示模板：随请求变化的部分放在最后
     user_template = """
     请为以下标题生成一个{document_type}文档的详细大纲，页数限制为{page_limit}页:
     
@@ -220,14 +355,8 @@ def create_outline_chain() -> Runnable:
     {topic_specific}
     
     大纲结构要求:
-    1. 标题页和目录页将占用2页
-    2. 根据{page_limit}页的限制，应该生成约{section_count}个章节
-    3. {section_guide}
-    4. 每个章节标题必须与主题紧密相关
-    5. 章节标题应该简洁明了，反映该部分的核心内容
-    6. 章节要点应该具体、专业，不要使用通用占位符
-    
-    {format_instructions}
+    1. 根据{page_limit}页的限制，应该生成约{section_count}个章节
+    2. {section_guide}
     """
     
     # 创建提示
@@ -236,17 +365,35 @@ def create_outline_chain() -> Runnable:
         ("human", user_template)
     ])
     
+    # 格式说明在构建时填入提示
+    return prompt.partial(format_instructions=get_outline_format_instructions())
+
+def create_outline_chain() -> Runnable:
+    """创建大纲生成链"""
     # 获取模型
     llm = get_llm()
     
     # 创建解析器
-    parser = JsonOutputParser(pydantic_object=OutlineResponse)
+    parser = get_outline_parser()
     
     # 创建链
-    chain = prompt | llm | parser
+    chain = create_outline_prompt() | llm | parser
     
     return chain
 
+def outline_prompt_params(state: DocumentState) -> Dict[str, Any]:
+    """大纲提示的参数"""
+    section_info = determine_section_count(state["document_type"], state["page_limit"], bool(state.get("hierarchical")))
+    return {
+        "topic": state["topic"],
+        "title": state["title"],
+        "document_type": state["document_type"].upper(),
+        "page_limit": state["page_limit"],
+        "topic_specific": get_topic_specific_prompt(state["topic"]),
+        "section_count": section_info["count"],
+        "section_guide": section_info["guide"]
+    }
+
 def validate_outline(outline: Union[List[OutlineSection], List[Dict[str, Any]], Any], topic: str) -> List[Dict[str, Any]]:
     """验证和规范化大纲"""
     validated_outline = []
@@ -343,29 +490,11 @@ def validate_outline(outline: Union[List[OutlineSection], List[Dict[str, Any]],
 async def generate_outline_node(state: DocumentState) -> Dict[str, Any]:
     """大纲生成节点"""
     try:
-        # 创建大纲生成链
-        outline_chain = create_outline_chain()
-        
-        # 获取章节信息
-        section_info = determine_section_count(state["document_type"], state["page_limit"])
-        
-        # 创建解析器
-        parser = JsonOutputParser(pydantic_object=OutlineResponse)
-        
-        # 准备参数
-        params = {
-            "topic": state["topic"],
-            "title": state["title"],
-            "document_type": state["document_type"].upper(),
-            "page_limit": state["page_limit"],
-            "topic_specific": get_topic_specific_prompt(state["topic"]),
-            "section_count": section_info["count"],
-            "section_guide": section_info["guide"],
-            "format_instructions": parser.get_format_instructions()
-        }
+        # 获取大纲生成链（全局复用）
+        outline_chain = get_outline_chain()
         
         # 调用链生成大纲
-        outline_result = await outline_chain.ainvoke(params)
+        outline_result = await outline_chain.ainvoke(outline_prompt_params(state))
         
         # 处理结果，可能是字典或OutlineResponse对象
         if isinstance(outline_result, dict):
@@ -411,390 +540,1417 @@ async def generate_outline_node(state: DocumentState) -> Dict[str, Any]:
             "current_step": "outline_generated_with_error"
         }
 
+# ===============================
+# 规划组件（一次调用生成标题和大纲）
+# ===============================
+
+class PlanResponse(BaseModel):
+    """规划响应：标题和大纲"""
+    title: str = Field(description="文档标题，不超过20个字")
+    outline: List[OutlineSection] = Field(description="文档大纲")
+    estimated_pages: int = Field(description="估计总页数")
+
+def create_plan_chain() -> Runnable:
+    """创建规划链：以JSON模式一次返回标题和大纲"""
+    # 系统提示：合并标题和大纲的固定要求，格式说明在构建时填入
+    system_prompt = """你是一个专业的文档策划专家。你能根据用户提供的主题，同时确定文档标题并设计结构清晰、内容全面的大纲。
+    
+    标题要求:
+    1. 标题应该简洁明了，不超过20个字
+    2. 标题应该能准确反映主题的核心内容
+    3. 标题应该吸引读者的兴趣
+    
+    大纲要求:
+    1. 标题页和目录页将占用2页
+    2. 每个章节标题必须与主题紧密相关
+    3. 章节标题应该简洁明了，反映该部分的核心内容
+    4. 章节要点应该具体、专业，不要使用通用占位符
+    
+    只返回一个JSON对象，不要包含其他说明。
+    {format_instructions}
+    """
+    
+    # 用户提示模板：随请求变化的部分放在最后
+    user_template = """
+    请为以下主题策划一个{document_type}文档，页数限制为{page_limit}页，给出标题和详细大纲:
+    
+    主题: {topic}
+    
+    {topic_specific}
+    
+    大纲结构要求:
+    1. 根据{page_limit}页的限制，应该生成约{section_count}个章节
+    2. {section_guide}
+    """
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("human", user_template)
+    ])
+    prompt = prompt.partial(format_instructions=get_plan_parser().get_format_instructions())
+    
+    # 使用JSON模式，保证模型输出合法的JSON对象
+    llm = get_llm().bind(response_format={"type": "json_object"})
+    
+    return prompt | llm | get_plan_parser()
+
+async def generate_plan_node(state: DocumentState) -> Dict[str, Any]:
+    """规划节点：一次调用生成标题和大纲，解析失败时回退到标题、大纲两步生成"""
+    try:
+        plan_chain = get_plan_chain()
+        section_info = determine_section_count(state["document_type"], state["page_limit"], bool(state.get("hierarchical")))
+        
+        params = {
+            "topic": state["topic"],
+            "document_type": state["document_type"].upper(),
+            "page_limit": state["page_limit"],
+            "topic_specific": get_topic_specific_prompt(state["topic"]),
+            "section_count": section_info["count"],
+            "section_guide": section_info["guide"]
+        }
+        
+        plan_result = await plan_chain.ainvoke(params)
+        if not isinstance(plan_result, dict):
+            raise OutputParserException(f"规划结果不是JSON对象: {plan_result!r}")
+        
+        title = str(plan_result.get("title") or "").strip().strip('"').strip("'").strip()
+        outline_data = plan_result.get("outline")
+        if not title or not isinstance(outline_data, list) or not outline_data:
+            raise OutputParserException("规划结果缺少标题或大纲")
+        
+        validated_outline = validate_outline(outline_data, state["topic"])
+        print(f"规划成功: 标题'{title}'，{len(validated_outline)}个章节")
+        
+        return {
+            "title": title,
+            "outline": validated_outline,
+            "current_step": "outline_generated",
+            "outline_strategy_used": "plan"
+        }
+        
+    except OutputParserException as e:
+        print(f"规划结果解析失败，回退到两步生成: {e}")
+        
+        title_result = await generate_title_node(state)
+        outline_result = await generate_outline_node({**state, **title_result})
+        
+        result = {**title_result, **outline_result, "outline_strategy_used": "plan_fallback"}
+        if title_result.get("error_message") and not outline_result.get("error_message"):
+            result["error_message"] = title_result["error_message"]
+        return result
+
+# ===============================
+# 推测大纲组件（与标题生成并行）
+# ===============================
+
+class SpeculationStats:
+    """推测大纲的命中统计，用于判断推测执行是否划算"""
+
+    def __init__(self):
+        self.hits = 0           # 标题足够接近，直接采用
+        self.patched = 0        # 标题不同但主题一致，替换标题文字后采用
+        self.misses = 0         # 标题差异过大，按最终标题重新生成大纲
+        self.saved_seconds = 0.0  # 相对依次生成节省的时间（未命中时为负）
+
+    def record(self, outcome: str, saved_seconds: float) -> None:
+        if outcome == "hit":
+            self.hits += 1
+        elif outcome == "patched":
+            self.patched += 1
+        else:
+            self.misses += 1
+        self.saved_seconds += saved_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.patched + self.misses
+        return {
+            "total": total,
+            "hits": self.hits,
+            "patched": self.patched,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.patched) / total, 3) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "avg_saved_seconds": round(self.saved_seconds / total, 3) if total else 0.0,
+            "similarity_threshold": SPECULATIVE_TITLE_SIMILARITY
+        }
+
+speculation_stats = SpeculationStats()
+
+def provisional_title(topic: str) -> str:
+    """推测大纲使用的临时标题（与标题生成失败时的默认标题一致）"""
+    return f"{topic}研究分析"
+
+def title_similarity(first: str, second: str) -> float:
+    """忽略标点和空白后的标题相似度（0~1）"""
+    def normalize(text: str) -> str:
+        return re.sub(r"[\s\W_]+", "", text or "").lower()
+    return SequenceMatcher(None, normalize(first), normalize(second)).ratio()
+
+def patch_outline_title(outline: List[Dict[str, Any]], old_title: str, new_title: str) -> List[Dict[str, Any]]:
+    """将大纲中引用的临时标题替换为最终标题"""
+    return [
+        {
+            "title": section["title"].replace(old_title, new_title),
+            "content": [point.replace(old_title, new_title) for point in section["content"]]
+        }
+        for section in outline
+    ]
+
+async def _timed(node: Callable, state: Dict[str, Any]) -> tuple:
+    started = time.perf_counter()
+    result = await node(state)
+    return result, time.perf_counter() - started
+
+async def generate_speculative_outline_node(state: DocumentState) -> Dict[str, Any]:
+    """推测节点：用临时标题生成大纲，与标题生成同时进行
+
+    最终标题与临时标题足够接近时直接采用推测的大纲；标题不同但仍围绕同一主题时，
+    只替换大纲中出现的临时标题文字；否则按最终标题重新生成大纲。
+    """
+    topic = state["topic"]
+    draft_title = provisional_title(topic)
+    started = time.perf_counter()
+    
+    (title_result, title_seconds), (outline_result, outline_seconds) = await asyncio.gather(
+        _timed(generate_title_node, state),
+        _timed(generate_outline_node, {**state, "title": draft_title})
+    )
+    title = title_result["title"]
+    similarity = title_similarity(title, draft_title)
+    
+    if similarity >= SPECULATIVE_TITLE_SIMILARITY:
+        outcome = "hit"
+    elif topic in title:
+        outcome = "patched"
+        outline_result = {
+            **outline_result,
+            "outline": patch_outline_title(outline_result["outline"], draft_title, title)
+        }
+    else:
+        outcome = "miss"
+        outline_result, outline_seconds = await _timed(generate_outline_node, {**state, **title_result})
+    
+    # 与依次生成（标题 + 按最终标题生成的大纲）相比节省的时间
+    saved = title_seconds + outline_seconds - (time.perf_counter() - started)
+    speculation_stats.record(outcome, saved)
+    print(f"推测大纲{outcome}: 标题'{title}'与临时标题相似度{similarity:.2f}，节省{saved:.2f}s")
+    
+    result = {**title_result, **outline_result, "outline_strategy_used": f"speculative_{outcome}"}
+    if title_result.get("error_message") and not outline_result.get("error_message"):
+        result["error_message"] = title_result["error_message"]
+    return result
+
 # ===============================
 # 内容生成组件
 # ===============================
 
-async def generate_section_content(
+# 章节内容生成的系统提示，对所有文档保持不变
+SECTION_SYSTEM_PROMPT = """你是一位专业的写作助手，擅长为PPT和Word文档撰写专业、清晰、连贯的章节内容。
+
+内容要求:
+1. 内容必须高度相关，准确解释章节标题下的每个要点
+2. 使用专业、清晰的语言，引用相关概念和术语
+3. 内容应该连贯、有逻辑性，避免重复
+4. 确保内容具有教育价值和信息量
+5. 不要添加额外的引言或总结，直接开始核心内容
+6. 请直接返回生成的内容，不要包含额外的说明或标记"""
+
+def section_words_per_page_limit(document_type: str, page_limit: Optional[int]) -> Optional[int]:
+    """根据页数限制估算每个章节的字数"""
+    if not page_limit:
+        return None
+    if document_type.lower() == "ppt":
+        # 简单估算，假设每页PPT约200-300字
+        return (page_limit - 2) * 250 // 5  # 减去标题页和目录页
+    # Word文档每页约500字
+    return (page_limit - 2) * 500 // 5
+
+def token_budget(chars: int) -> int:
+    """按目标字符数估算max_tokens（预留SECTION_LENGTH_HEADROOM倍余量），限制在256~4000之间"""
+    return max(256, min(4000, math.ceil(chars * SECTION_LENGTH_HEADROOM / LLM_CHARS_PER_TOKEN)))
+
+def build_document_context(
     title: str,
     topic: str,
-    section_title: str,
-    section_points: List[str],
     document_type: str,
+    outline: Optional[List[Dict[str, Any]]] = None,
     page_limit: Optional[int] = None
 ) -> str:
-    """为单个章节生成内容"""
-    try:
-        # 构建内容生成提示
-        points_text = "\n".join([f"- {point}" for point in section_points])
-        
-        # 构建章节特定提示
-        section_guide = f"""
-        本章节'{section_title}'是关于'{title}'和'{topic}'的重要组成部分。
-        请确保内容紧密围绕章节标题'{section_title}'和以下具体要点展开，不要偏离主题：
-        {points_text}
-        
-        每个要点都应得到充分解释，并且内容必须与总主题'{title}'保持一致。
-        """
-        
-        # 设置内容格式要求
+    """构建同一文档所有章节共享的上下文（标题、主题、大纲、格式要求）
+    
+    这部分内容在同一文档的各章节请求间逐字节一致，放在用户消息开头，
+    可以命中服务端的前缀缓存。
+    """
+    # 设置内容格式要求
+    if document_type.lower() == "ppt":
+        format_guide = """PPT内容格式要求:
+1. 内容精炼，适合双栏布局展示
+2. 使用要点式表达，每行控制在50-60个字符
+3. 每个要点用完整的句子表达关键信息
+4. 使用破折号(-)或短横线开始每个要点
+5. 重要概念使用单独的行展示
+6. 段落之间用空行分隔，改善PPT排版"""
+    else:
+        format_guide = """Word文档格式要求:
+1. 内容应详细、全面，使用完整段落
+2. 每个要点展开为2-3个段落
+3. 可以使用小标题来区分不同部分
+4. 段落之间用空行分隔，便于排版"""
+    
+    # 页数限制指南
+    page_limit_guide = ""
+    words_per_section = section_words_per_page_limit(document_type, page_limit)
+    if words_per_section:
         if document_type.lower() == "ppt":
-            min_length = 300
-            format_guide = """
-            PPT内容格式要求:
-            1. 内容精炼，适合双栏布局展示
-            2. 使用要点式表达，每行控制在50-60个字符
-            3. 每个要点用完整的句子表达关键信息
-            4. 使用破折号(-)或短横线开始每个要点
-            5. 重要概念使用单独的行展示
-            6. 段落之间用空行分隔，改善PPT排版
-            """
+            page_limit_guide = f"每个章节的内容长度控制在约{words_per_section}字左右，适合PPT展示"
         else:
-            min_length = 600
-            format_guide = """
-            Word文档格式要求:
-            1. 内容应详细、全面，使用完整段落
-            2. 每个要点展开为2-3个段落
-            3. 可以使用小标题来区分不同部分
-            4. 段落之间用空行分隔，便于排版
-            """
-        
-        # 页数限制指南
-        page_limit_guide = ""
-        if page_limit:
-            if document_type.lower() == "ppt":
-                # 简单估算，假设每页PPT约200-300字
-                words_per_section = (page_limit - 2) * 250 // 5  # 减去标题页和目录页
-                page_limit_guide = f"内容长度控制在约{words_per_section}字左右，适合PPT展示"
-            else:
-                # Word文档每页约500字
-                words_per_section = (page_limit - 2) * 500 // 5
-                page_limit_guide = f"内容长度控制在约{words_per_section}字左右"
-        
-        # 构建完整提示
-        prompt = f"""
-        请为以下文档章节生成专业的内容，适用于{document_type.upper()}:
-        
-        文档标题: {title}
-        文档主题: {topic}
-        章节标题: {section_title}
-        
-        章节要点:
-        {points_text}
-        
-        {section_guide}
-        
-        {format_guide}
-        
-        {page_limit_guide}
-        
-        内容要求:
-        1. 内容必须高度相关，准确解释章节标题下的每个要点
-        2. 使用专业、清晰的语言，引用相关概念和术语
-        3. 内容应该连贯、有逻辑性，避免重复
-        4. 确保内容具有教育价值和信息量
-        5. 生成至少{min_length}字符的内容
-        6. 不要添加额外的引言或总结，直接开始核心内容
-        
-        请直接返回生成的内容，不要包含额外的说明或标记。
-        """
-        
-        # 调用LLM生成内容
-        content = await get_llm().ainvoke([HumanMessage(content=prompt)])
-        
-        # 提取生成的文本
-        generated_text = content.content.strip()
-        
-        # 内容质量检查
+            page_limit_guide = f"每个章节的内容长度控制在约{words_per_section}字左右"
+    
+    # 文档大纲（不使用"- "前缀，避免与当前章节的要点混淆）
+    outline_text = ""
+    if outline:
+        outline_text = "\n".join(
+            f"第{index}章 {section['title']}：{'；'.join(section.get('content', []))}"
+            for index, section in enumerate(outline, 1)
+        )
+    
+    return f"""文档类型: {document_type.upper()}
+文档标题: {title}
+文档主题: {topic}
+
+文档大纲:
+{outline_text or '（未提供）'}
+
+{format_guide}
+
+{page_limit_guide}"""
+
+def build_section_prompt(
+    title: str,
+    topic: str,
+    section_title: str,
+    section_points: List[str],
+    document_type: str,
+    page_limit: Optional[int] = None,
+    outline: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """构建章节内容生成的消息，返回消息列表、最小长度要求和按目标长度估算的max_tokens
+    
+    消息结构: 固定的系统提示 → 文档共享上下文 → 当前章节的标题和要点。
+    变化最多的章节部分放在最后，使前缀在同一文档的所有章节请求间保持稳定。
+    """
+    min_length = 300 if document_type.lower() == "ppt" else 600
+    target_length = max(min_length, section_words_per_page_limit(document_type, page_limit) or 0)
+    points_text = "\n".join([f"- {point}" for point in section_points])
+    
+    document_context = build_document_context(title, topic, document_type, outline, page_limit)
+    section_request = f"""请为以下章节生成专业的内容，适用于{document_type.upper()}:
+
+章节标题: {section_title}
+
+章节要点:
+{points_text}
+
+本章节'{section_title}'是关于'{title}'和'{topic}'的重要组成部分。
+请确保内容紧密围绕章节标题'{section_title}'和上述要点展开，不要偏离主题。
+每个要点都应得到充分解释，并且内容必须与总主题'{title}'保持一致。
+生成至少{min_length}字符的内容。"""
+    
+    messages = [
+        SystemMessage(content=SECTION_SYSTEM_PROMPT),
+        HumanMessage(content=f"{document_context}\n\n{section_request}")
+    ]
+    return {"messages": messages, "min_length": min_length, "max_tokens": token_budget(target_length)}
+
+def build_expand_messages(section_messages: List[Any], generated_text: str, min_length: int) -> List[Any]:
+    """构建内容过短时的扩展消息（在原对话后追加，复用已缓存的前缀）"""
+    expand_request = f"""你生成的内容太简短。请扩展并丰富上面的内容，使其更加详细和专业。
+
+请确保扩展后的内容:
+1. 详细解释每个要点
+2. 使用专业术语和概念
+3. 提供具体的例子或应用场景
+4. 长度至少{min_length}字符"""
+    return list(section_messages) + [AIMessage(content=generated_text), HumanMessage(content=expand_request)]
+
+def build_continue_messages(section_messages: List[Any], generated_text: str, missing_length: int) -> List[Any]:
+    """构建续写消息：在原对话后追加，只要求模型输出接在已有内容后面的新内容"""
+    continue_request = f"""内容还不够详细。请紧接着上面的内容继续写，补充约{missing_length}字符的新内容。
+
+要求:
+1. 不要重复或改写已有内容，只输出新增的部分
+2. 保持与上文相同的格式和语气
+3. 针对尚未充分展开的要点补充解释、例子或应用场景"""
+    return list(section_messages) + [AIMessage(content=generated_text), HumanMessage(content=continue_request)]
+
+class LengthControlStats:
+    """章节长度控制统计：多少章节首次生成过短，以及补足长度花费的token"""
+
+    def __init__(self):
+        self.sections = 0
+        self.expanded_sections = 0     # 需要补足长度的章节
+        self.expansion_requests = 0    # 补足长度的调用次数（续写可能多轮）
+        self.still_short = 0           # 补足后仍不足最小长度的章节
+        self.section_tokens = 0        # 首次生成的token（prompt + completion）
+        self.expansion_prompt_tokens = 0
+        self.expansion_completion_tokens = 0
+
+    def record(self, first_usage: Dict[str, int], expansion_usage: Dict[str, int], rounds: int, short: bool) -> None:
+        self.sections += 1
+        self.section_tokens += first_usage["prompt_tokens"] + first_usage["completion_tokens"]
+        if rounds:
+            self.expanded_sections += 1
+            self.expansion_requests += rounds
+            self.expansion_prompt_tokens += expansion_usage["prompt_tokens"]
+            self.expansion_completion_tokens += expansion_usage["completion_tokens"]
+        if short:
+            self.still_short += 1
+
+    def stats(self) -> Dict[str, Any]:
+        expansion_tokens = self.expansion_prompt_tokens + self.expansion_completion_tokens
+        total_tokens = self.section_tokens + expansion_tokens
+        return {
+            "strategy": SECTION_LENGTH_STRATEGY,
+            "sections": self.sections,
+            "expanded_sections": self.expanded_sections,
+            "expansion_rate": round(self.expanded_sections / self.sections, 3) if self.sections else 0.0,
+            "expansion_requests": self.expansion_requests,
+            "still_short": self.still_short,
+            "section_tokens": self.section_tokens,
+            "expansion_prompt_tokens": self.expansion_prompt_tokens,
+            "expansion_completion_tokens": self.expansion_completion_tokens,
+            "expansion_token_share": round(expansion_tokens / total_tokens, 3) if total_tokens else 0.0
+        }
+
+length_stats = LengthControlStats()
+
+async def ensure_min_length(section_messages: List[Any], generated_text: str, min_length: int) -> tuple:
+    """内容短于min_length时补足长度，返回（补足后的内容，补足调用次数）
+    
+    "continue"策略只请求缺少的部分并追加到已有内容后，max_tokens按缺少的长度估算；
+    "rewrite"策略要求模型整体扩写一次。
+    """
+    rounds = 0
+    if SECTION_LENGTH_STRATEGY == "rewrite":
         if len(generated_text) < min_length:
-            # 如果内容太短，尝试扩展
-            expand_prompt = f"""
-            你生成的内容太简短。请扩展并丰富以下内容，使其更加详细和专业：
-            
-            {generated_text}
-            
-            请确保扩展后的内容:
-            1. 详细解释每个要点
-            2. 使用专业术语和概念
-            3. 提供具体的例子或应用场景
-            4. 长度至少{min_length}字符
-            """
-            
-            expanded_content = await get_llm().ainvoke([HumanMessage(content=expand_prompt)])
+            rounds = 1
+            expand_messages = build_expand_messages(section_messages, generated_text, min_length)
+            expanded_content = await get_llm().ainvoke(expand_messages)
             generated_text = expanded_content.content.strip()
-        
-        # 内容格式优化
-        if document_type.lower() == "ppt":
-            # 对PPT内容进行格式优化
-            lines = generated_text.split('\n')
-            formatted_lines = []
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    formatted_lines.append("")  # 保留空行
-                    continue
-                
-                # 处理过长的行
-                if len(line) > 60:
-                    parts = re.split(r'([。；，！？\.;,!?])', line)
-                    current_part = ""
-                    for i in range(0, len(parts)-1, 2):
-                        part = parts[i] + (parts[i+1] if i+1 < len(parts) else "")
-                        if len(current_part) + len(part) < 60:
-                            current_part += part
-                        else:
-                            if current_part:
-                                formatted_lines.append(current_part)
-                            current_part = part
+        return generated_text, rounds
+    
+    while len(generated_text) < min_length and rounds < SECTION_MAX_CONTINUATIONS:
+        rounds += 1
+        missing_length = max(100, min_length - len(generated_text))
+        continue_messages = build_continue_messages(section_messages, generated_text, missing_length)
+        continuation = await get_llm().ainvoke(continue_messages, max_tokens=token_budget(missing_length))
+        addition = continuation.content.strip()
+        if not addition:
+            break
+        generated_text = f"{generated_text}\n\n{addition}"
+    return generated_text, rounds
+
+def format_section_text(generated_text: str, document_type: str) -> str:
+    """对生成的章节内容进行格式优化"""
+    if document_type.lower() != "ppt":
+        return generated_text
+    
+    # 对PPT内容进行格式优化
+    lines = generated_text.split('\n')
+    formatted_lines = []
+    
+    for line in lines:
+        line = line.strip()
+        if not line:
+            formatted_lines.append("")  # 保留空行
+            continue
+        
+        # 处理过长的行
+        if len(line) > 60:
+            parts = re.split(r'([。；，！？\.;,!?])', line)
+            current_part = ""
+            for i in range(0, len(parts)-1, 2):
+                part = parts[i] + (parts[i+1] if i+1 < len(parts) else "")
+                if len(current_part) + len(part) < 60:
+                    current_part += part
+                else:
                     if current_part:
                         formatted_lines.append(current_part)
-                else:
-                    formatted_lines.append(line)
+                    current_part = part
+            if current_part:
+                formatted_lines.append(current_part)
+        else:
+            formatted_lines.append(line)
+    
+    # 重新组合内容
+    return '\n'.join(formatted_lines)
+
+def section_fingerprint(
+    title: str,
+    topic: str,
+    section_title: str,
+    section_points: List[str],
+    document_type: str
+) -> str:
+    """章节内容的指纹：标题、主题、章节标题、要点和文档类型都不变时，已生成的内容可以复用"""
+    payload = json.dumps(
+        [title, topic, section_title, list(section_points), document_type.lower()],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def default_section_content(section_title: str, section_points: List[str]) -> str:
+    """生成章节的默认内容（生成失败时使用）"""
+    default_content = f"本章节主要介绍{section_title}的核心内容。\n\n"
+    for point in section_points:
+        default_content += f"- {point}：此部分将详细阐述相关内容。\n"
+    return default_content
+
+def section_budget(section_key: str, max_tokens: int) -> Optional[int]:
+    """按请求剩余时间确定章节（按指纹）调用的max_tokens；返回None表示时间不足以调用模型，应直接使用离线模板"""
+    strategy = current_strategy()
+    if strategy == OFFLINE:
+        mark_degraded(section_key, OFFLINE)
+        return None
+    if strategy == SHORT_OUTPUT:
+        mark_degraded(section_key, SHORT_OUTPUT)
+        return min(max_tokens, DEADLINE_SHORT_MAX_TOKENS)
+    return max_tokens
+
+def can_expand(section_key: str, first_usage: Dict[str, int], too_short: bool) -> bool:
+    """首次生成后是否还能补足长度：调用已因截止时间回退或剩余时间不足时跳过补足"""
+    if first_usage["deadline_fallbacks"]:
+        mark_degraded(section_key, TIMED_OUT)
+        return False
+    if too_short and current_strategy() != FULL:
+        mark_degraded(section_key, NO_EXPANSION)
+        return False
+    return too_short
+
+def section_degradation(section_key: str) -> Optional[str]:
+    """章节（按指纹）在本次请求中使用的降级策略，未降级时为None"""
+    deadline = current_deadline()
+    return deadline.degraded.get(section_key) if deadline is not None else None
+
+class SectionFallback(Exception):
+    """章节因模型不可用（无API密钥、熔断器打开、请求失败）使用了离线备用内容
+    
+    content为离线生成的内容，可以展示，但不能作为成功的章节按指纹保存。
+    """
+    
+    def __init__(self, section_title: str, content: str):
+        super().__init__(f"章节'{section_title}'使用了离线备用内容")
+        self.content = content
+
+def used_offline_fallback(*usages: Dict[str, int]) -> bool:
+    """调用是否因模型不可用回退到了离线生成器（因截止时间回退的调用按降级处理，不计入）"""
+    return any(usage["offline_fallbacks"] > usage["deadline_fallbacks"] for usage in usages)
+
+async def generate_section_content(
+    title: str,
+    topic: str,
+    section_title: str,
+    section_points: List[str],
+    document_type: str,
+    page_limit: Optional[int] = None,
+    outline: Optional[List[Dict[str, Any]]] = None
+) -> str:
+    """为单个章节生成内容；请求设置了截止时间时按剩余时间降级，降级的策略按章节指纹记录在截止时间上
+    
+    Raises:
+        SectionFallback: 模型不可用，内容来自离线生成器
+        Exception: 生成失败，由调用方使用默认内容
+    """
+    section_prompt = build_section_prompt(title, topic, section_title, section_points, document_type, page_limit, outline)
+    min_length = section_prompt["min_length"]
+    section_key = section_fingerprint(title, topic, section_title, section_points, document_type)
+    max_tokens = section_budget(section_key, section_prompt["max_tokens"])
+    if max_tokens is None:
+        return format_section_text(deepseek_client.offline_chat(convert_messages(section_prompt["messages"])), document_type)
+    
+    # 调用LLM生成内容，max_tokens按目标长度估算
+    with usage_scope() as first_usage:
+        content = await get_llm().ainvoke(section_prompt["messages"], max_tokens=max_tokens)
+    
+    # 提取生成的文本
+    generated_text = content.content.strip()
+    
+    # 内容质量检查：太短时补足长度（剩余时间不足时跳过）
+    rounds = 0
+    with usage_scope() as expansion_usage:
+        if can_expand(section_key, first_usage, len(generated_text) < min_length):
+            generated_text, rounds = await ensure_min_length(section_prompt["messages"], generated_text, min_length)
+    length_stats.record(first_usage, expansion_usage, rounds, len(generated_text) < min_length)
+    
+    # 内容格式优化
+    generated_text = format_section_text(generated_text, document_type)
+    if used_offline_fallback(first_usage, expansion_usage):
+        raise SectionFallback(section_title, generated_text)
+    return generated_text
+
+async def stream_section_content(
+    title: str,
+    topic: str,
+    section_title: str,
+    section_points: List[str],
+    document_type: str,
+    page_limit: Optional[int] = None,
+    use_cache: bool = True,
+    outline: Optional[List[Dict[str, Any]]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """以流式方式为单个章节生成内容
+    
+    产出的事件:
+        {"type": "delta", "text": ...}   新到达的文本片段
+        {"type": "reset"}                内容过短且使用rewrite策略，后续增量为扩展后的完整内容
+        {"type": "done", "content": ...} 格式化后的最终章节内容
+    """
+    try:
+        section_prompt = build_section_prompt(title, topic, section_title, section_points, document_type, page_limit, outline)
+        min_length = section_prompt["min_length"]
+        section_key = section_fingerprint(title, topic, section_title, section_points, document_type)
+        max_tokens = section_budget(section_key, section_prompt["max_tokens"])
+        if max_tokens is None:
+            content = deepseek_client.offline_chat(convert_messages(section_prompt["messages"]))
+            yield {"type": "delta", "text": content}
+            yield {"type": "done", "content": format_section_text(content, document_type)}
+            return
+        
+        parts = []
+        # aclosing: 本生成器被提前关闭（客户端断开或取消）时立即关闭上游流
+        with usage_scope() as first_usage:
+            async with aclosing(deepseek_client.stream_chat(convert_messages(section_prompt["messages"]),
+                                                            max_tokens=max_tokens, use_cache=use_cache)) as stream:
+                async for delta in stream:
+                    parts.append(delta)
+                    yield {"type": "delta", "text": delta}
+        generated_text = "".join(parts).strip()
+        
+        rounds = 0
+        expand = can_expand(section_key, first_usage, len(generated_text) < min_length)
+        with usage_scope() as expansion_usage:
+            if expand and SECTION_LENGTH_STRATEGY == "rewrite":
+                # 整体扩写：流式输出扩展后的完整内容
+                rounds = 1
+                yield {"type": "reset"}
+                parts = []
+                expand_messages = build_expand_messages(section_prompt["messages"], generated_text, min_length)
+                async with aclosing(deepseek_client.stream_chat(convert_messages(expand_messages), use_cache=use_cache)) as stream:
+                    async for delta in stream:
+                        parts.append(delta)
+                        yield {"type": "delta", "text": delta}
+                generated_text = "".join(parts).strip()
             
-            # 重新组合内容
-            generated_text = '\n'.join(formatted_lines)
-        
-        return generated_text
+            # 续写：新内容直接接在已推送的内容后面
+            while (expand and SECTION_LENGTH_STRATEGY != "rewrite" and len(generated_text) < min_length
+                   and rounds < SECTION_MAX_CONTINUATIONS):
+                rounds += 1
+                missing_length = max(100, min_length - len(generated_text))
+                continue_messages = build_continue_messages(section_prompt["messages"], generated_text, missing_length)
+                parts = []
+                yield {"type": "delta", "text": "\n\n"}
+                async with aclosing(deepseek_client.stream_chat(convert_messages(continue_messages),
+                                                                max_tokens=token_budget(missing_length), use_cache=use_cache)) as stream:
+                    async for delta in stream:
+                        parts.append(delta)
+                        yield {"type": "delta", "text": delta}
+                addition = "".join(parts).strip()
+                if not addition:
+                    break
+                generated_text = f"{generated_text}\n\n{addition}"
+        length_stats.record(first_usage, expansion_usage, rounds, len(generated_text) < min_length)
+        
+        # 离线备用内容只用于展示，调用方不应按指纹保存
+        done = {"type": "done", "content": format_section_text(generated_text, document_type)}
+        if used_offline_fallback(first_usage, expansion_usage):
+            done["fallback"] = True
+        yield done
         
     except Exception as e:
-        print(f"生成章节'{section_title}'内容时出错: {e}")
+        print(f"流式生成章节'{section_title}'内容时出错: {e}")
         traceback.print_exc()
         
-        # 返回默认内容
-        default_content = f"本章节主要介绍{section_title}的核心内容。\n\n"
-        for point in section_points:
-            default_content += f"- {point}：此部分将详细阐述相关内容。\n"
-        
-        return default_content
+        yield {"type": "done", "content": default_section_content(section_title, section_points), "fallback": True}
+
+class SectionTask(TypedDict):
+    """单个章节节点的输入（由Send分发）"""
+    index: int
+    total: int
+    fingerprint: str
+    section: Dict[str, Any]
+    title: str
+    topic: str
+    document_type: str
+    page_limit: int
+    outline: List[Dict[str, Any]]
+    request_id: Optional[str]
+
+def publish_section_event(
+    request_id: Optional[str],
+    event_type: str,
+    section_title: str,
+    total_sections: int,
+    message: Optional[str] = None
+) -> None:
+    """发布章节开始/完成事件；正在生成的章节和完成数取自进度快照，各章节节点无需共享状态"""
+    snapshot = progress_bus.snapshot(request_id) or {}
+    in_flight = [title for title in snapshot.get("in_flight_sections", []) if title != section_title]
+    completed = len(snapshot.get("completed_sections", []))
+    if event_type == SECTION_STARTED:
+        in_flight.append(section_title)
+    else:
+        completed += 1
+    if message is None:
+        message = f"正在生成章节: {'、'.join(in_flight)}" if in_flight else "正在生成章节内容..."
+    progress_bus.publish(
+        request_id,
+        event_type,
+        progress=10 + int(80 * completed / max(1, total_sections)),
+        stage="generating",
+        message=message,
+        section=section_title
+    )
 
-async def generate_content_node(state: DocumentState) -> Dict[str, Any]:
-    """内容生成节点"""
+class RunRecord:
+    """一次工作流运行的记录：最新的图状态和已完成的章节（指纹 -> 内容）
+    
+    运行被取消时图内尚未归并的结果会丢失，调用方据此保留已完成的部分。
+    """
+    
+    def __init__(self):
+        self.state: Optional[Dict[str, Any]] = None
+        self.sections: Dict[str, str] = {}
+
+# 当前上下文的运行记录（由record_run设置，图节点所在的任务继承）
+_run_record: contextvars.ContextVar[Optional[RunRecord]] = contextvars.ContextVar("workflow_run_record", default=None)
+
+@contextmanager
+def record_run():
+    """记录代码块内（包括其中创建的任务）工作流运行的最新状态和已完成的章节
+    
+    用法:
+        with record_run() as record:
+            await run_document_workflow(...)
+        print(record.sections)
+    """
+    record = RunRecord()
+    token = _run_record.set(record)
     try:
-        print(f"内容智能体：正在为'{state['title']}'生成详细内容...")
-        request_id = state.get("request_id")
-        
-        # 初始化进度信息
-        if request_id:
-            generation_progress[request_id] = {
-                "progress": 5,
-                "current_stage": "preparing",
-                "message": "正在准备生成详细内容...",
-                "current_section": None,
-                "completed_sections": []
-            }
-            # 给客户端时间获取初始状态
-            await asyncio.sleep(0.5)
-        
-        outline = state["outline"]
-        content_dict = {}
-        success_count = 0
-        error_count = 0
-        total_sections = len(outline)
-        
-        # 更新进度 - 分析阶段
-        if request_id:
-            generation_progress[request_id].update({
-                "progress": 15,
-                "current_stage": "analyzing",
-                "message": "正在分析大纲内容..."
-            })
-            await asyncio.sleep(0.5)
-            
-        # 更新进度 - 研究阶段
-        if request_id:
-            generation_progress[request_id].update({
-                "progress": 30,
-                "current_stage": "researching",
-                "message": "正在收集相关信息..."
-            })
-            await asyncio.sleep(1.0)
-        
-        # 为每个章节生成内容
-        for index, section in enumerate(outline):
-            section_title = section["title"]
-            section_points = section["content"]
-            
-            # 更新当前正在处理的章节
-            if request_id:
-                current_progress = 30 + int(50 * (index / total_sections))
-                generation_progress[request_id].update({
-                    "progress": current_progress,
-                    "current_stage": "generating",
-                    "message": f"正在生成章节: {section_title}",
-                    "current_section": section_title
-                })
-                # 重要：确保请求在更新进度状态后能获取到最新的状态
-                await asyncio.sleep(0.1)
-            
+        yield record
+    finally:
+        _run_record.reset(token)
+
+async def save_finished_section(request_id: Optional[str], fingerprint: str, section_title: str, content: str) -> None:
+    """保存一个已完成的章节：写入当前的运行记录和检查点（SQLite写入在线程中执行，不阻塞事件循环）"""
+    record = _run_record.get()
+    if record is not None:
+        record.sections[fingerprint] = content
+    await asyncio.to_thread(checkpoint_store.save_section, request_id, fingerprint, section_title, content)
+
+def reusable_sections(state: DocumentState) -> Dict[str, str]:
+    """可以直接复用的已生成内容（指纹 -> 内容）
+    
+    包括state中的section_contents，以及增量生成或恢复中断的运行时检查点中已完成的章节。
+    """
+    checkpointed = {}
+    if state.get("incremental") is not False or state.get("resumed"):
+        checkpointed = checkpoint_store.load_sections(state.get("request_id"))
+    return {**checkpointed, **(state.get("section_contents") or {})}
+
+async def prepare_content_node(state: DocumentState) -> Dict[str, Any]:
+    """内容生成准备节点：计算章节指纹，指纹未变的章节直接复用已有内容"""
+    print(f"内容智能体：正在为'{state['title']}'生成详细内容...")
+    request_id = state.get("request_id")
+    outline = state["outline"]
+    total_sections = len(outline)
+    
+    # 初始化进度信息（订阅者通过事件总线获取，无需等待客户端轮询）
+    if request_id:
+        await progress_bus.start(request_id, progress=5, message="正在准备生成详细内容...")
+    
+    # 指纹未变的章节（未修改或仅调整顺序）直接复用之前生成的内容，
+    # 包括流式大纲阶段提前生成的章节，以及进程重启前已完成并写入检查点的章节
+    previous_contents = await asyncio.to_thread(reusable_sections, state)
+    fingerprints = [
+        section_fingerprint(state["title"], state["topic"], section["title"], section["content"], state["document_type"])
+        for section in outline
+    ]
+    reused = {
+        index: {"content": previous_contents[fingerprint], "ok": True, "reused": True}
+        for index, fingerprint in enumerate(fingerprints)
+        if fingerprint in previous_contents
+    }
+    
+    concurrency = max(1, state.get("section_concurrency") or SECTION_CONCURRENCY)
+    print(f"并发生成{total_sections - len(reused)}个章节（复用{len(reused)}个），并发上限: {concurrency}")
+    stage_message = f"正在生成{total_sections}个章节的内容..."
+    if reused:
+        stage_message = f"正在生成{total_sections - len(reused)}个章节的内容（{len(reused)}个章节已有内容，直接复用）..."
+    progress_bus.publish(request_id, STAGE, progress=10, stage="generating", message=stage_message)
+    for index in reused:
+        section_title = outline[index]["title"]
+        publish_section_event(request_id, SECTION_COMPLETED, section_title, total_sections,
+                              message=f"章节'{section_title}'已有内容，直接复用")
+    
+    return {
+        "section_fingerprints": fingerprints,
+        "section_results": reused
+    }
+
+def fan_out_sections(state: DocumentState) -> Union[str, List[Send]]:
+    """为每个需要生成的章节分发一个章节节点（map），全部复用时直接汇总；分层生成时先分发章节规划节点"""
+    done = state.get("section_results") or {}
+    outline = state["outline"]
+    node = "plan_chapter" if state.get("hierarchical") else "generate_section"
+    tasks = [
+        Send(node, {
+            "index": index,
+            "total": len(outline),
+            "fingerprint": state["section_fingerprints"][index],
+            "section": section,
+            "title": state["title"],
+            "topic": state["topic"],
+            "document_type": state["document_type"],
+            "page_limit": state["page_limit"],
+            "outline": outline,
+            "request_id": state.get("request_id")
+        })
+        for index, section in enumerate(outline)
+        if index not in done
+    ]
+    return tasks or "collect_content"
+
+async def generate_section_node(task: SectionTask) -> Dict[str, Any]:
+    """章节节点：生成单个章节，失败时使用默认内容"""
+    request_id = task["request_id"]
+    section_title = task["section"]["title"]
+    section_points = task["section"]["content"]
+    
+    publish_section_event(request_id, SECTION_STARTED, section_title, task["total"])
+    try:
+        print(f"正在生成章节'{section_title}'的内容...")
+        
+        # 生成章节内容
+        content = await generate_section_content(
+            title=task["title"],
+            topic=task["topic"],
+            section_title=section_title,
+            section_points=section_points,
+            document_type=task["document_type"],
+            page_limit=task["page_limit"],
+            outline=task["outline"]
+        )
+        print(f"成功生成章节'{section_title}'的内容")
+        # 因截止时间降级的内容不保存，下次生成时重新生成
+        degraded = section_degradation(task["fingerprint"])
+        if not degraded:
+            await save_finished_section(request_id, task["fingerprint"], section_title, content)
+        publish_section_event(request_id, SECTION_COMPLETED, section_title, task["total"])
+        return {"section_results": {task["index"]: {"content": content, "ok": True, "reused": False, "degraded": degraded}}}
+    
+    except SectionFallback as fallback:
+        # 离线备用内容仍然展示，但不保存，下次生成时重新生成
+        print(f"章节'{section_title}'使用了离线备用内容，不保存")
+        publish_section_event(request_id, SECTION_FAILED, section_title, task["total"])
+        return {"section_results": {task["index"]: {"content": fallback.content, "ok": False, "reused": False}}}
+        
+    except Exception as section_error:
+        print(f"生成章节'{section_title}'内容时出错: {section_error}")
+        traceback.print_exc()
+        publish_section_event(request_id, SECTION_FAILED, section_title, task["total"])
+        return {"section_results": {task["index"]: {
+            "content": default_section_content(section_title, section_points),
+            "ok": False,
+            "reused": False
+        }}}
+
+async def collect_content_node(state: DocumentState) -> Dict[str, Any]:
+    """汇总节点（reduce）：按大纲顺序组装内容，成功的章节按指纹保存以便下次复用"""
+    outline = state["outline"]
+    results = state.get("section_results") or {}
+    fingerprints = state["section_fingerprints"]
+    
+    content_dict = {}
+    section_contents = {}
+    reused_sections = []
+    regenerated_sections = []
+    degraded_sections = []
+    error_count = 0
+    for index, section in enumerate(outline):
+        result = results.get(index) or {
+            "content": default_section_content(section["title"], section["content"]),
+            "ok": False,
+            "reused": False
+        }
+        content_dict[section["title"]] = result["content"]
+        if result.get("degraded"):
+            degraded_sections.append({"section": section["title"], "strategy": result["degraded"]})
+        elif result["ok"]:
+            section_contents[fingerprints[index]] = result["content"]
+        if not result["ok"]:
+            error_count += 1
+        (reused_sections if result["reused"] else regenerated_sections).append(section["title"])
+    
+    # 更新进度 - 完成阶段
+    progress_bus.publish(state.get("request_id"), COMPLETED, progress=100, stage="completed", message="内容生成完成！")
+    
+    status_update = {
+        "content": content_dict,
+        "current_step": "content_generated",
+        "section_contents": section_contents,
+        "reused_sections": reused_sections,
+        "regenerated_sections": regenerated_sections,
+        "degraded_sections": degraded_sections
+    }
+    if error_count:
+        status_update["error_message"] = f"{error_count}个章节内容生成失败"
+    return status_update
+
+# ===============================
+# 分层生成组件（章节 → 小节 → 段落）
+# ===============================
+
+CHAPTER_PLAN_SYSTEM_PROMPT = """你是一位专业的文档结构设计专家，负责把文档的一个章节展开为若干小节，并为每个小节规划段落的写作要点。
+只输出JSON，格式为: {"subsections": [{"title": "小节标题", "paragraphs": ["段落写作要点", "..."]}]}"""
+
+class SubsectionPlan(BaseModel):
+    """小节规划"""
+    title: str = Field(description="小节标题")
+    paragraphs: List[str] = Field(description="各段落的写作要点，每段一条")
+
+class ChapterPlanResponse(BaseModel):
+    """章节规划响应"""
+    subsections: List[SubsectionPlan] = Field(description="章节下的小节")
+
+class ParagraphTask(TypedDict):
+    """单个段落节点的输入（由Send分发）"""
+    key: str
+    title: str
+    topic: str
+    document_type: str
+    outline: List[Dict[str, Any]]
+    fingerprint: str
+    section_title: str
+    subsection_title: str
+    brief: str
+    leaf_chars: int
+
+def use_hierarchical(page_limit: Optional[int], hierarchical: Optional[bool] = None) -> bool:
+    """是否使用分层生成：未明确指定时，页数达到HIERARCHICAL_PAGE_THRESHOLD的文档使用分层生成"""
+    if hierarchical is not None:
+        return hierarchical
+    return bool(page_limit) and page_limit >= HIERARCHICAL_PAGE_THRESHOLD
+
+def chapter_char_budget(document_type: str, page_limit: int, chapter_count: int) -> int:
+    """按页数估算单个章节的总字数（PPT每页约250字，Word每页约500字，减去标题页和目录页）"""
+    chars_per_page = 250 if document_type.lower() == "ppt" else 500
+    return max(HIERARCHICAL_LEAF_CHARS, (page_limit - 2) * chars_per_page // max(1, chapter_count))
+
+def create_chapter_plan_chain() -> Runnable:
+    """创建章节规划链（JSON模式）"""
+    return get_llm().bind(response_format={"type": "json_object"}) | get_chapter_plan_parser()
+
+def build_chapter_plan_messages(task: SectionTask, paragraphs_per_subsection: int) -> List[Any]:
+    """构建章节规划的消息，文档共享上下文与章节内容生成一致"""
+    points_text = "\n".join(f"- {point}" for point in task["section"]["content"])
+    document_context = build_document_context(task["title"], task["topic"], task["document_type"], task["outline"])
+    request = f"""请为第{task['index'] + 1}章'{task['section']['title']}'设计小节结构。
+
+章节要点:
+{points_text}
+
+要求:
+1. 每个要点展开为一个小节，小节标题简洁具体
+2. 每个小节规划{paragraphs_per_subsection}个段落，每个段落给出一句话的写作要点
+3. 段落之间层层递进，不要重复"""
+    return [
+        SystemMessage(content=CHAPTER_PLAN_SYSTEM_PROMPT),
+        HumanMessage(content=f"{document_context}\n\n{request}")
+    ]
+
+def default_chapter_plan(section_points: List[str], paragraphs_per_subsection: int) -> List[Dict[str, Any]]:
+    """章节规划失败时的默认结构：每个要点一个小节，段落按固定角度展开"""
+    angles = ["概念与背景", "关键分析", "实践与应用", "问题与展望", "案例说明", "小结"]
+    return [
+        {
+            "title": point,
+            "paragraphs": [point] if paragraphs_per_subsection == 1 else
+                          [f"{point}：{angles[i % len(angles)]}" for i in range(paragraphs_per_subsection)]
+        }
+        for point in section_points
+    ]
+
+def validate_chapter_plan(plan: Any, section_points: List[str], paragraphs_per_subsection: int) -> List[Dict[str, Any]]:
+    """规范化章节规划，限制小节和段落数量，使叶子调用的数量有界"""
+    subsections = plan.get("subsections") if isinstance(plan, dict) else None
+    validated = []
+    for subsection in subsections or []:
+        if not isinstance(subsection, dict) or not subsection.get("title"):
+            continue
+        paragraphs = [str(item) for item in subsection.get("paragraphs") or [] if str(item).strip()]
+        validated.append({
+            "title": str(subsection["title"]),
+            "paragraphs": (paragraphs or [str(subsection["title"])])[:max(paragraphs_per_subsection, 1) * 2]
+        })
+    return validated[:max(len(section_points), 1) * 2] or default_chapter_plan(section_points, paragraphs_per_subsection)
+
+def build_paragraph_messages(task: ParagraphTask) -> List[Any]:
+    """构建单个段落的消息：共享上下文之后是章节、小节和段落要点"""
+    document_context = build_document_context(task["title"], task["topic"], task["document_type"], task["outline"])
+    request = f"""请为以下段落撰写内容，适用于{task['document_type'].upper()}:
+
+所在章节: {task['section_title']}
+所在小节: {task['subsection_title']}
+段落要点: {task['brief']}
+
+只撰写这一个段落，生成约{task['leaf_chars']}字符的内容，不要重复章节或小节标题。"""
+    return [
+        SystemMessage(content=SECTION_SYSTEM_PROMPT),
+        HumanMessage(content=f"{document_context}\n\n{request}")
+    ]
+
+def assemble_chapter(subsections: List[Dict[str, Any]], paragraphs: List[List[str]], document_type: str) -> str:
+    """按小节顺序组装章节内容
+
+    Word中小节标题单独成段，各段落用空行分隔；PPT中一个小节的段落合为一块（一页），小节之间用空行分隔。
+    """
+    blocks = []
+    for subsection, texts in zip(subsections, paragraphs):
+        if document_type.lower() == "ppt":
+            blocks.append("\n".join([subsection["title"]] + [format_section_text(text, document_type) for text in texts]))
+        else:
+            blocks.append("\n\n".join([f"### {subsection['title']}"] + texts))
+    return "\n\n".join(blocks)
+
+async def plan_chapter_node(task: SectionTask) -> Dict[str, Any]:
+    """章节规划节点：把章节展开为小节和各段落的写作要点（一次JSON调用）"""
+    request_id = task["request_id"]
+    section = task["section"]
+    publish_section_event(request_id, SECTION_STARTED, section["title"], task["total"])
+    
+    budget = chapter_char_budget(task["document_type"], task["page_limit"], task["total"])
+    subsection_count = max(1, len(section["content"]))
+    paragraphs_per_subsection = max(1, min(6, round(budget / subsection_count / HIERARCHICAL_LEAF_CHARS)))
+    strategy = current_strategy()
+    if strategy in (SHORT_OUTPUT, OFFLINE):
+        # 请求剩余时间不足：跳过规划调用，按章节要点直接划分小节，记录实际采用的策略
+        mark_degraded(task["fingerprint"], strategy)
+        subsections = default_chapter_plan(section["content"], paragraphs_per_subsection)
+    else:
+        try:
+            plan = await get_chapter_plan_chain().ainvoke(build_chapter_plan_messages(task, paragraphs_per_subsection))
+            subsections = validate_chapter_plan(plan, section["content"], paragraphs_per_subsection)
+        except Exception as e:
+            print(f"规划章节'{section['title']}'时出错: {e}，使用默认结构")
+            subsections = default_chapter_plan(section["content"], paragraphs_per_subsection)
+    
+    paragraph_count = sum(len(subsection["paragraphs"]) for subsection in subsections)
+    leaf_chars = max(100, budget // max(1, paragraph_count))
+    print(f"章节'{section['title']}'规划完成: {len(subsections)}个小节, {paragraph_count}个段落, 每段约{leaf_chars}字")
+    return {"chapter_plans": {task["index"]: {
+        "fingerprint": task["fingerprint"],
+        "subsections": subsections,
+        "leaf_chars": leaf_chars
+    }}}
+
+async def schedule_paragraphs_node(state: DocumentState) -> Dict[str, Any]:
+    """全部章节规划完成后的汇合点：发布进度，随后按段落fan-out"""
+    plans = state.get("chapter_plans") or {}
+    paragraph_count = sum(len(sub["paragraphs"]) for plan in plans.values() for sub in plan["subsections"])
+    progress_bus.publish(state.get("request_id"), STAGE, stage="generating",
+                         message=f"已规划{len(plans)}个章节共{paragraph_count}个段落，正在并行生成...")
+    return {}
+
+def fan_out_paragraphs(state: DocumentState) -> Union[str, List[Send]]:
+    """为每个段落分发一个段落节点（叶子），叶子彼此独立，总耗时取决于层数而不是总长度"""
+    outline = state["outline"]
+    tasks = []
+    for index, plan in sorted((state.get("chapter_plans") or {}).items()):
+        for sub_index, subsection in enumerate(plan["subsections"]):
+            for paragraph_index, brief in enumerate(subsection["paragraphs"]):
+                tasks.append(Send("generate_paragraph", {
+                    "key": f"{index}.{sub_index}.{paragraph_index}",
+                    "title": state["title"],
+                    "topic": state["topic"],
+                    "document_type": state["document_type"],
+                    "outline": outline,
+                    "fingerprint": plan["fingerprint"],
+                    "section_title": outline[index]["title"],
+                    "subsection_title": subsection["title"],
+                    "brief": brief,
+                    "leaf_chars": plan["leaf_chars"]
+                }))
+    return tasks or "assemble_chapters"
+
+async def generate_paragraph_node(task: ParagraphTask) -> Dict[str, Any]:
+    """段落节点：一次有界长度的调用生成一个段落，失败时使用段落要点占位；剩余时间不足时按截止时间降级"""
+    try:
+        messages = build_paragraph_messages(task)
+        max_tokens = section_budget(task["fingerprint"], token_budget(task["leaf_chars"]))
+        if max_tokens is None:
+            return {"paragraph_results": {task["key"]: {"text": f"{task['brief']}。", "ok": True}}}
+        with usage_scope() as usage:
+            content = await get_llm().ainvoke(messages, max_tokens=max_tokens)
+        if usage["deadline_fallbacks"]:
+            # 离线生成器只适用于整章，段落回退时使用段落要点
+            mark_degraded(task["fingerprint"], TIMED_OUT)
+            return {"paragraph_results": {task["key"]: {"text": f"{task['brief']}。", "ok": True}}}
+        if used_offline_fallback(usage):
+            # 模型不可用：使用段落要点，整章不保存
+            return {"paragraph_results": {task["key"]: {"text": f"{task['brief']}。", "ok": False}}}
+        text = content.content.strip()
+        if not text:
+            raise ValueError("模型返回了空段落")
+        return {"paragraph_results": {task["key"]: {"text": text, "ok": True}}}
+    except Exception as e:
+        print(f"生成段落'{task['subsection_title']}/{task['brief']}'时出错: {e}")
+        return {"paragraph_results": {task["key"]: {"text": f"{task['brief']}。", "ok": False}}}
+
+async def assemble_chapters_node(state: DocumentState) -> Dict[str, Any]:
+    """章节组装节点：按小节和段落顺序组装各章节，全部段落成功的章节写入检查点"""
+    request_id = state.get("request_id")
+    outline = state["outline"]
+    results = state.get("paragraph_results") or {}
+    section_results = {}
+    for index, plan in sorted((state.get("chapter_plans") or {}).items()):
+        paragraphs = []
+        ok = True
+        for sub_index, subsection in enumerate(plan["subsections"]):
+            texts = []
+            for paragraph_index, brief in enumerate(subsection["paragraphs"]):
+                result = results.get(f"{index}.{sub_index}.{paragraph_index}") or {"text": f"{brief}。", "ok": False}
+                ok = ok and result["ok"]
+                texts.append(result["text"])
+            paragraphs.append(texts)
+        
+        section_title = outline[index]["title"]
+        content = assemble_chapter(plan["subsections"], paragraphs, state["document_type"])
+        degraded = section_degradation(plan["fingerprint"])
+        if ok and not degraded:
+            await save_finished_section(request_id, plan["fingerprint"], section_title, content)
+        publish_section_event(request_id, SECTION_COMPLETED if ok else SECTION_FAILED, section_title, len(outline))
+        section_results[index] = {"content": content, "ok": ok, "reused": False, "degraded": degraded}
+    return {"section_results": section_results}
+
+# ===============================
+# 流式大纲组件（章节逐个到达，提前生成内容）
+# ===============================
+
+async def stream_outline_sections(state: DocumentState, use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+    """流式生成大纲，每个章节对象的右花括号一到达就产出该章节（已规范化）
+    
+    整段输出中没有解析出任何章节时（例如模型未按格式输出），回退为对完整文本整体解析；
+    仍然无法解析时抛出OutputParserException。
+    """
+    messages = await get_outline_prompt().aformat_messages(**outline_prompt_params(state))
+    parser = StreamingArrayParser("outline")
+    async with aclosing(deepseek_client.stream_chat(convert_messages(messages), use_cache=use_cache)) as stream:
+        async for delta in stream:
+            for section in parser.feed(delta):
+                yield validate_outline([section], state["topic"])[0]
+    
+    if not parser.emitted:
+        outline_result = get_outline_parser().parse(parser.text)
+        outline_data = outline_result.get("outline", []) if isinstance(outline_result, dict) else outline_result
+        if not isinstance(outline_data, list) or not outline_data:
+            raise OutputParserException("流式大纲中没有可解析的章节")
+        for section in validate_outline(outline_data, state["topic"]):
+            yield section
+
+class EarlySectionGenerator:
+    """在大纲流式到达期间提前生成章节内容
+    
+    每个章节的大纲一到达就提交生成（受并发上限约束），此时使用已到达的部分大纲作为上下文。
+    结果按章节指纹保存并写入检查点，之后的内容阶段通过指纹直接复用；
+    已有内容的章节不会重复提交。
+    """
+    
+    def __init__(self, state: DocumentState, concurrency: Optional[int] = None):
+        self.state = state
+        self.request_id = state.get("request_id")
+        self._semaphore = asyncio.Semaphore(max(1, concurrency or state.get("section_concurrency") or SECTION_CONCURRENCY))
+        self._known = reusable_sections(state)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.contents: Dict[str, str] = {}
+    
+    def fingerprint(self, section: Dict[str, Any]) -> str:
+        return section_fingerprint(self.state["title"], self.state["topic"], section["title"], section["content"],
+                                   self.state["document_type"])
+    
+    def submit(self, section: Dict[str, Any], outline: List[Dict[str, Any]]) -> bool:
+        """提交一个章节，返回是否新建了生成任务"""
+        fingerprint = self.fingerprint(section)
+        if fingerprint in self._known or fingerprint in self._tasks:
+            return False
+        self._tasks[fingerprint] = asyncio.create_task(self._generate(fingerprint, section, list(outline)))
+        return True
+    
+    async def _generate(self, fingerprint: str, section: Dict[str, Any], outline: List[Dict[str, Any]]) -> tuple:
+        async with self._semaphore:
+            progress_bus.publish(self.request_id, SECTION_STARTED, stage="generating",
+                                 message=f"提前生成章节: {section['title']}", section=section["title"])
             try:
-                print(f"正在生成章节'{section_title}'的内容...")
-                
-                # 生成章节内容
-                section_content = await generate_section_content(
-                    title=state["title"],
-                    topic=state["topic"],
-                    section_title=section_title,
-                    section_points=section_points,
-                    document_type=state["document_type"],
-                    page_limit=state["page_limit"]
+                content = await generate_section_content(
+                    title=self.state["title"],
+                    topic=self.state["topic"],
+                    section_title=section["title"],
+                    section_points=section["content"],
+                    document_type=self.state["document_type"],
+                    page_limit=self.state["page_limit"],
+                    outline=outline
                 )
-                
-                # 保存内容
-                content_dict[section_title] = section_content
-                success_count += 1
-                print(f"成功生成章节'{section_title}'的内容")
-                
-                # 更新已完成的章节
-                if request_id:
-                    completed_sections = generation_progress[request_id].get("completed_sections", [])
-                    completed_sections.append(section_title)
-                    generation_progress[request_id]["completed_sections"] = completed_sections
-                    
-                    # 更新进度消息
-                    next_section = outline[index + 1]["title"] if index + 1 < len(outline) else None
-                    if next_section:
-                        generation_progress[request_id].update({
-                            "message": f"正在生成章节: {next_section}",
-                            "current_section": next_section,
-                        })
-                    
-                    # 确保客户端能及时获取更新状态
-                    await asyncio.sleep(0.1)
-                    
-            except Exception as section_error:
-                print(f"生成章节'{section_title}'内容时出错: {section_error}")
-                
-                # 创建默认内容
-                default_content = f"本章节主要介绍{section_title}的核心内容。\n\n"
-                for point in section_points:
-                    default_content += f"- {point}：此部分将详细阐述相关内容。\n"
-                
-                content_dict[section_title] = default_content
-                error_count += 1
-        
-        # 更新进度 - 优化阶段
-        if request_id:
-            generation_progress[request_id].update({
-                "progress": 80,
-                "current_stage": "reviewing",
-                "message": "正在优化内容质量...",
-                "current_section": None
-            })
-            await asyncio.sleep(1.0)
-        
-        # 确定成功状态
-        overall_success = error_count == 0
-        
-        # 更新进度 - 完成阶段
-        if request_id:
-            generation_progress[request_id].update({
-                "progress": 100,
-                "current_stage": "completed",
-                "message": "内容生成完成！",
-                "current_section": None,
-                "completed_sections": [section["title"] for section in outline]
-            })
-        
-        # 创建状态更新
-        status_update = {
-            "content": content_dict,
-            "current_step": "content_generated",
-        }
-        
-        if not overall_success:
-            status_update["error_message"] = f"{error_count}个章节内容生成失败"
-        
-        return status_update
-        
+                ok = True
+            except SectionFallback as fallback:
+                content, ok = fallback.content, False
+            except Exception as e:
+                print(f"提前生成章节'{section['title']}'内容时出错: {e}")
+                content, ok = default_section_content(section["title"], section["content"]), False
+        # 默认内容、离线备用内容和因截止时间降级的内容不保存，内容阶段会重新生成
+        ok = ok and not section_degradation(fingerprint)
+        if ok:
+            self.contents[fingerprint] = content
+            await save_finished_section(self.request_id, fingerprint, section["title"], content)
+        progress_bus.publish(self.request_id, SECTION_COMPLETED if ok else SECTION_FAILED, stage="generating",
+                             section=section["title"])
+        return section, content, ok
+    
+    async def completed(self) -> AsyncIterator[tuple]:
+        """按完成顺序产出 (章节, 内容, 是否成功)"""
+        for future in asyncio.as_completed(list(self._tasks.values())):
+            yield await future
+    
+    async def wait(self) -> Dict[str, str]:
+        """等待全部任务结束，返回 指纹 -> 内容"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        return dict(self.contents)
+    
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+
+async def generate_streaming_outline_node(state: DocumentState, config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+    """流式大纲节点：逐个解析到达的章节；工作流还要继续生成内容时，
+    每个章节的大纲一到达就开始生成该章节的内容，不必等整个大纲完成"""
+    early = None
+    if route_after_outline(state, config) == "prepare_content" and not state.get("hierarchical"):
+        early = EarlySectionGenerator(state)
+        await progress_bus.start(state.get("request_id"), progress=5, stage="outlining",
+                                 message="正在流式生成大纲，已到达的章节同步生成内容...")
+    
+    outline = []
+    try:
+        async with aclosing(stream_outline_sections(state)) as sections:
+            async for section in sections:
+                outline.append(section)
+                if early and early.submit(section, outline):
+                    print(f"章节'{section['title']}'的大纲已到达，开始生成内容")
+    except asyncio.CancelledError:
+        # 生成被取消：已提交的章节任务一并取消（已完成的章节已写入检查点和运行记录）
+        if early:
+            early.cancel()
+        raise
     except Exception as e:
-        print(f"内容生成节点错误: {e}")
-        traceback.print_exc()
-        
-        # 更新进度 - 错误状态
-        if request_id:
-            generation_progress[request_id].update({
-                "progress": 0,
-                "current_stage": "error",
-                "message": f"生成内容时出错: {str(e)}",
-            })
-        
-        # 创建所有章节的默认内容
-        content_dict = {}
-        for section in state["outline"]:
-            section_title = section["title"]
-            section_points = section["content"]
-            
-            default_content = f"本章节主要介绍{section_title}的核心内容。\n\n"
-            for point in section_points:
-                default_content += f"- {point}：此部分将详细阐述相关内容。\n"
-            
-            content_dict[section_title] = default_content
-        
-        # 返回默认内容和错误信息
-        return {
-            "content": content_dict,
-            "error_message": f"内容生成时出错: {str(e)}",
-            "current_step": "content_generated_with_error"
-        }
+        print(f"流式生成大纲时出错: {e}，改为一次性生成")
+        if early:
+            early.cancel()
+        return {**await generate_outline_node(state), "outline_strategy_used": "streaming_fallback"}
+    
+    print(f"流式生成大纲成功: {len(outline)}个章节")
+    update = {
+        "outline": outline,
+        "current_step": "outline_generated",
+        "outline_strategy_used": "streaming"
+    }
+    if early:
+        contents = await early.wait()
+        print(f"提前生成了{len(contents)}个章节的内容")
+        update["section_contents"] = {**(state.get("section_contents") or {}), **contents}
+    return update
 
 # ===============================
 # 主工作流
 # ===============================
 
+# 标题和大纲生成方式对应的入口节点
+ENTRY_NODES = {
+    "plan": "generate_plan",
+    "speculative": "generate_speculative"
+}
+
+# start_at配置对应的起始节点（"title"时按outline_strategy选择）
+START_NODES = {
+    "outline": "generate_outline",
+    "content": "prepare_content"
+}
+
+# 已完成的步骤对应的起始阶段，用于未指定start_at时从当前状态继续
+RESUME_PHASES = {
+    "title_generated": "outline",
+    "outline_generated": "content",
+    "content_generated": "done"
+}
+
+def _run_options(config: Optional[RunnableConfig]) -> Dict[str, Any]:
+    return (config or {}).get("configurable") or {}
+
+def route_entry(state: DocumentState, config: Optional[RunnableConfig] = None) -> str:
+    """根据start_at配置（未配置时根据current_step）和outline_strategy选择工作流入口节点"""
+    options = _run_options(config)
+    current_step = state.get("current_step") or "started"
+    if options.get("stop_at") and options["stop_at"] == current_step:
+        return END
+    
+    phase = options.get("start_at") or RESUME_PHASES.get(current_step, "title")
+    if phase == "done":
+        return END
+    if phase == "outline" and state.get("outline_strategy") == "streaming":
+        return "stream_outline"
+    if phase in START_NODES:
+        return START_NODES[phase]
+    return ENTRY_NODES.get(state.get("outline_strategy") or "", "generate_title")
+
+def route_after_title(state: DocumentState, config: Optional[RunnableConfig] = None) -> str:
+    """标题生成后：stop_at为title_generated时结束，否则生成大纲（标题出错时使用默认标题继续）"""
+    if _run_options(config).get("stop_at") == "title_generated":
+        return END
+    return "stream_outline" if state.get("outline_strategy") == "streaming" else "generate_outline"
+
+def route_after_outline(state: DocumentState, config: Optional[RunnableConfig] = None) -> str:
+    """大纲（或标题和大纲）生成后：stop_at为标题或大纲阶段时结束，否则生成内容"""
+    if _run_options(config).get("stop_at") in ("title_generated", "outline_generated"):
+        return END
+    return "prepare_content"
+
 def create_complete_workflow() -> Runnable:
-    """创建完整的文档生成工作流"""
+    """创建完整的文档生成工作流
+    
+    标题和大纲阶段按outline_strategy选择入口；内容阶段为map-reduce：prepare_content计算需要生成的章节，
+    通过Send为每个章节分发一个generate_section节点并行执行（并发上限由运行配置的max_concurrency控制），
+    各章节结果经merge_section_results归并后由collect_content按大纲顺序组装。
+    分层生成时每个章节先由plan_chapter展开为小节和段落要点，全部规划完成后按段落分发generate_paragraph
+    叶子节点，最后由assemble_chapters按顺序组装各章节，耗时随层数而不是文档总长度增长。
+    start_at / stop_at 通过运行配置的configurable传入。
+    """
     # 创建工作流图
     workflow = StateGraph(DocumentState)
     
     # 添加节点
     workflow.add_node("generate_title", generate_title_node)
     workflow.add_node("generate_outline", generate_outline_node)
-    workflow.add_node("generate_content", generate_content_node)
-    
-    # 添加边
-    workflow.add_edge("generate_title", "generate_outline")
-    workflow.add_edge("generate_outline", "generate_content")
-    workflow.add_edge("generate_content", END)
-    
-    # 当标题或大纲生成失败时的路由
-    def route_on_error(state: DocumentState):
-        if state.get("error_message"):
-            # 即使有错误也继续到下一步
-            return True
-        return True
+    workflow.add_node("generate_plan", generate_plan_node)
+    workflow.add_node("generate_speculative", generate_speculative_outline_node)
+    workflow.add_node("stream_outline", generate_streaming_outline_node)
+    workflow.add_node("prepare_content", prepare_content_node)
+    workflow.add_node("generate_section", generate_section_node)
+    workflow.add_node("collect_content", collect_content_node)
+    workflow.add_node("plan_chapter", plan_chapter_node)
+    workflow.add_node("schedule_paragraphs", schedule_paragraphs_node)
+    workflow.add_node("generate_paragraph", generate_paragraph_node)
+    workflow.add_node("assemble_chapters", assemble_chapters_node)
     
-    # 添加条件边
-    workflow.add_conditional_edges(
-        "generate_title",
-        route_on_error,
-        {
-            True: "generate_outline",
-        }
+    # 设置入口点
+    workflow.set_conditional_entry_point(
+        route_entry,
+        ["generate_title", "generate_plan", "generate_speculative", "generate_outline", "stream_outline",
+         "prepare_content", END]
     )
     
-    workflow.add_conditional_edges(
-        "generate_outline",
-        route_on_error,
-        {
-            True: "generate_content",
-        }
-    )
+    # 标题和大纲阶段：即使有错误也使用默认值继续到下一步
+    workflow.add_conditional_edges("generate_title", route_after_title, ["generate_outline", "stream_outline", END])
+    for node in ("generate_outline", "generate_plan", "generate_speculative", "stream_outline"):
+        workflow.add_conditional_edges(node, route_after_outline, ["prepare_content", END])
     
-    # 设置入口点
-    workflow.set_entry_point("generate_title")
+    # 内容阶段：按章节fan-out，再fan-in汇总
+    workflow.add_conditional_edges("prepare_content", fan_out_sections,
+                                   ["generate_section", "plan_chapter", "collect_content"])
+    workflow.add_edge("generate_section", "collect_content")
+    
+    # 分层生成：章节规划 → 汇合 → 按段落fan-out → 按章节组装
+    workflow.add_edge("plan_chapter", "schedule_paragraphs")
+    workflow.add_conditional_edges("schedule_paragraphs", fan_out_paragraphs, ["generate_paragraph", "assemble_chapters"])
+    workflow.add_edge("generate_paragraph", "assemble_chapters")
+    workflow.add_edge("assemble_chapters", "collect_content")
+    workflow.add_edge("collect_content", END)
     
     # 编译工作流 - 更新为适配LangGraph 0.3.0+版本
     return workflow.compile()
 
+# ===============================
+# 注册表访问函数
+# ===============================
+
+def get_title_chain() -> Runnable:
+    """获取标题生成链"""
+    return registry.get("title_chain")
+
+def get_outline_parser() -> JsonOutputParser:
+    """获取大纲JSON解析器"""
+    return registry.get("outline_parser")
+
+def get_outline_format_instructions() -> str:
+    """获取大纲的JSON格式说明"""
+    return registry.get("outline_format_instructions")
+
+def get_outline_prompt() -> ChatPromptTemplate:
+    """获取大纲生成提示"""
+    return registry.get("outline_prompt")
+
+def get_outline_chain() -> Runnable:
+    """获取大纲生成链"""
+    return registry.get("outline_chain")
+
+def get_plan_parser() -> JsonOutputParser:
+    """获取规划JSON解析器"""
+    return registry.get("plan_parser")
+
+def get_plan_chain() -> Runnable:
+    """获取规划链"""
+    return registry.get("plan_chain")
+
+def get_chapter_plan_parser() -> JsonOutputParser:
+    """获取章节规划JSON解析器"""
+    return registry.get("chapter_plan_parser")
+
+def get_chapter_plan_chain() -> Runnable:
+    """获取章节规划链"""
+    return registry.get("chapter_plan_chain")
+
+def get_workflow() -> Runnable:
+    """获取编译后的完整工作流"""
+    return registry.get("workflow")
+
+registry.register("title_chain", create_title_chain)
+registry.register("outline_parser", lambda: JsonOutputParser(pydantic_object=OutlineResponse))
+registry.register("outline_format_instructions", lambda: get_outline_parser().get_format_instructions())
+registry.register("outline_prompt", create_outline_prompt)
+registry.register("outline_chain", create_outline_chain)
+registry.register("plan_parser", lambda: JsonOutputParser(pydantic_object=PlanResponse))
+registry.register("plan_chain", create_plan_chain)
+registry.register("chapter_plan_parser", lambda: JsonOutputParser(pydantic_object=ChapterPlanResponse))
+registry.register("chapter_plan_chain", create_chapter_plan_chain)
+registry.register("workflow", create_complete_workflow)
+
+def warm_up() -> Dict[str, float]:
+    """预先构建工作流、提示链和解析器（在FastAPI启动时调用）"""
+    build_times = registry.warm_up()
+    print(f"工作流组件预热完成: {', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in build_times.items())}")
+    return build_times
+
 async def run_document_workflow(
     topic: str,
     page_limit: int,
     document_type: str,
     initial_state: Optional[DocumentState] = None,
-    stop_at: Optional[str] = None  # 添加stop_at参数
+    stop_at: Optional[str] = None,  # 添加stop_at参数
+    section_concurrency: Optional[int] = None,
+    outline_strategy: Optional[str] = None,
+    request_id: Optional[str] = None,
+    start_at: Optional[str] = None,
+    hierarchical: Optional[bool] = None,
+    deadline: Optional[float] = None
 ) -> DocumentState:
-    """运行文档生成工作流，可以在指定步骤停止
+    """运行文档生成工作流，可以从指定阶段开始、在指定步骤停止
     
     Args:
         topic: 文档主题
@@ -802,12 +1958,21 @@ async def run_document_workflow(
         document_type: 文档类型 ("ppt" 或 "word")
         initial_state: 可选的初始状态，用于从特定阶段开始工作流
         stop_at: 可选，工作流执行到此步骤后停止，例如 "title_generated" 或 "outline_generated"
+        start_at: 可选，起始阶段 "title" / "outline" / "content"，默认根据initial_state的current_step继续
+        section_concurrency: 可选，同时生成的章节数上限，默认使用SECTION_CONCURRENCY
+        outline_strategy: 可选，"plan"时一次调用生成标题和大纲，"streaming"时流式生成大纲并提前生成已到达章节的内容，默认依次生成
+        request_id: 可选，请求ID；每个节点完成后按该ID写入检查点，未传入initial_state时从已有的检查点恢复
+        hierarchical: 可选，是否分层生成（章节 → 小节 → 段落），默认页数达到HIERARCHICAL_PAGE_THRESHOLD时启用
+        deadline: 可选，本次运行的截止时间（秒），默认使用REQUEST_DEADLINE_SECONDS；剩余时间不足时章节逐级降级，
+            降级的章节记录在返回状态的degraded_sections中
         
     Returns:
         完成的工作流状态
     """
     # 初始化状态
+    restored_state = None
     if initial_state is None:
+        restored_state = await asyncio.to_thread(checkpoint_store.load_state, request_id)
         initial_state = {
             "topic": topic,
             "page_limit": page_limit,
@@ -818,79 +1983,82 @@ async def run_document_workflow(
             "outline": None,
             "content": None,
             "user_edited_outline": False,
-            "user_edited_title": False
+            "user_edited_title": False,
+            "section_concurrency": section_concurrency,
+            "outline_strategy": outline_strategy
         }
     else:
         # 确保基本参数一致
         initial_state["topic"] = topic
         initial_state["page_limit"] = page_limit
         initial_state["document_type"] = document_type
+        if section_concurrency is not None:
+            initial_state["section_concurrency"] = section_concurrency
+        if outline_strategy is not None:
+            initial_state["outline_strategy"] = outline_strategy
+    
+    if hierarchical is not None or initial_state.get("hierarchical") is None:
+        initial_state["hierarchical"] = use_hierarchical(page_limit, hierarchical)
+    
+    if request_id:
+        initial_state["request_id"] = request_id
+    request_id = initial_state.get("request_id")
     
-    # 创建工作流
-    workflow = create_complete_workflow()
+    # 进程重启前中断的运行：从最后完成的节点继续
+    if restored_state and restored_state.get("topic") == topic:
+        initial_state.update(restored_state)
+        print(f"从检查点恢复工作流: {request_id}, 已完成步骤: {restored_state.get('current_step')}")
     
-    # 确定入口点 - 在新版LangGraph中需要手动处理不同的入口点
-    entry_point = "generate_title"  # 默认从开始
+    # 图的运行配置：起止阶段和章节并发上限（分层生成时叶子节点较多，默认上限更高）
+    default_concurrency = HIERARCHICAL_CONCURRENCY if initial_state.get("hierarchical") else SECTION_CONCURRENCY
+    concurrency = max(1, initial_state.get("section_concurrency") or default_concurrency)
+    config: RunnableConfig = {
+        "configurable": {"start_at": start_at, "stop_at": stop_at},
+        "max_concurrency": concurrency
+    }
+    entry_point = route_entry(initial_state, config)
     
     # 记录工作流执行开始
     print(f"开始执行文档生成工作流，入口点: {entry_point}")
     print(f"主题: {topic}, 页数: {page_limit}, 文档类型: {document_type}")
     
-    # 运行工作流
+    state = initial_state
     try:
-        # 根据当前状态和stop_at参数决定执行策略
-        current_step = initial_state.get("current_step", "started")
-        
-        # 如果当前已经达到停止步骤，直接返回
-        if stop_at and current_step == stop_at:
-            return initial_state
-            
-        # 只生成标题
-        if current_step == "started":
-            result = await generate_title_node(initial_state)
-            initial_state.update(result)
-            
-            # 如果设置了在生成标题后停止，则返回
-            if stop_at == "title_generated":
-                return initial_state
-        
-        # 只生成大纲
-        if current_step in ["started", "title_generated"] and initial_state.get("title"):
-            if current_step == "title_generated" or initial_state.get("current_step") == "title_generated":
-                outline_result = await generate_outline_node(initial_state)
-                initial_state.update(outline_result)
-                
-                # 如果设置了在生成大纲后停止，则返回
-                if stop_at == "outline_generated":
-                    return initial_state
-        
-        # 只生成内容
-        if current_step in ["started", "title_generated", "outline_generated"] and initial_state.get("outline"):
-            if current_step == "outline_generated" or initial_state.get("current_step") == "outline_generated":
-                content_result = await generate_content_node(initial_state)
-                initial_state.update(content_result)
-                
-                # 如果设置了在生成内容后停止，则返回
-                if stop_at == "content_generated":
-                    return initial_state
-        
-        # 如果未设置停止点，或者当前状态不符合分步执行的条件，执行完整工作流
-        if not stop_at and (current_step == "started" or not initial_state.get("content")):
-            result = await workflow.ainvoke(initial_state)
-            initial_state = result
+        # 逐步获取图的状态，每完成一个阶段写入检查点；截止时间经上下文传递到各节点及其中的LLM调用
+        last_step = initial_state.get("current_step")
+        record = _run_record.get()
+        with deadline_scope(resolve_deadline(deadline)) as run_deadline:
+            async for values in get_workflow().astream(initial_state, config, stream_mode="values"):
+                state = values
+                if record is not None:
+                    record.state = values
+                if values.get("current_step") != last_step:
+                    last_step = values.get("current_step")
+                    await asyncio.to_thread(
+                        checkpoint_store.save_node,
+                        request_id,
+                        last_step,
+                        {key: value for key, value in values.items()
+                         if key not in ("section_results", "chapter_plans", "paragraph_results")}
+                    )
         
         # 记录工作流完成
-        print(f"文档生成工作流完成: {initial_state.get('current_step')}")
+        print(f"文档生成工作流完成: {state.get('current_step')}")
+        if run_deadline is not None and run_deadline.degraded:
+            print(f"截止时间{run_deadline.seconds:.0f}秒，{len(run_deadline.degraded)}个章节降级生成: {state.get('degraded_sections')}")
         
-        return initial_state
+        return state
         
     except Exception as e:
         # 记录错误
         print(f"工作流执行错误: {e}")
         traceback.print_exc()
+        await progress_bus.prime(request_id)
+        progress_bus.publish(request_id, ERROR, progress=0, stage="error", message=f"生成内容时出错: {str(e)}")
         
         # 更新状态
-        initial_state["error_message"] = str(e)
-        initial_state["current_step"] = "workflow_failed"
+        state = dict(state)
+        state["error_message"] = str(e)
+        state["current_step"] = "workflow_failed"
         
-        return initial_state 
\ No newline at end of file
+        return state
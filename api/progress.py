@@ -0,0 +1,327 @@
+"""
+内容生成进度事件总线。
+工作流节点发布带类型的进度事件，订阅者（轮询接口的快照、SSE推送、日志）各自消费。
+每个请求的事件带有递增序号并保留历史，订阅者先登记再回放历史，因此不会漏掉任何更新。
+多进程部署时（STATE_BACKEND=sqlite）最近的事件和快照同时写入共享状态，连接到其他进程的订阅者轮询读取；
+共享状态的写入先在本进程内合并，每隔flush_interval秒在线程中批量写入一次，读取也在线程中进行，都不阻塞事件循环。
+发布事件本身不读取共享状态：开始一次生成前由start()（或prime()）在线程中读取请求的最新快照，序号接着它继续。
+"""
+
+import copy
+import time
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, List, Optional, Callable, Deque, AsyncIterator, MutableMapping
+
+from api.state import generation_progress, progress_events
+
+logger = logging.getLogger(__name__)
+
+# 事件类型
+STARTED = "started"                      # 开始（或重新开始）一次内容生成
+STAGE = "stage"                          # 进入新的阶段
+SECTION_STARTED = "section_started"      # 章节开始生成
+SECTION_COMPLETED = "section_completed"  # 章节生成完成
+SECTION_FAILED = "section_failed"        # 章节生成失败（已使用默认内容）
+COMPLETED = "completed"                  # 全部完成
+ERROR = "error"                          # 生成出错
+CANCELLED = "cancelled"                  # 生成被取消（已完成的章节已保存）
+
+TERMINAL_EVENTS = (COMPLETED, ERROR, CANCELLED)
+
+@dataclass
+class ProgressEvent:
+    """一条进度事件"""
+    request_id: str
+    seq: int
+    type: str
+    progress: Optional[int] = None
+    stage: Optional[str] = None
+    message: Optional[str] = None
+    section: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def _initial_snapshot() -> Dict[str, Any]:
+    return {
+        "progress": 0,
+        "current_stage": "initializing",
+        "message": "正在初始化内容生成...",
+        "current_section": None,
+        "in_flight_sections": [],
+        "completed_sections": [],
+        "seq": 0
+    }
+
+def apply_event(snapshot: Dict[str, Any], event: ProgressEvent) -> None:
+    """将事件合并进进度快照（轮询接口返回的就是这个快照）"""
+    if event.type == STARTED:
+        snapshot.update(_initial_snapshot())
+    if event.progress is not None:
+        snapshot["progress"] = event.progress
+    if event.stage is not None:
+        snapshot["current_stage"] = event.stage
+    if event.message is not None:
+        snapshot["message"] = event.message
+
+    in_flight = snapshot.setdefault("in_flight_sections", [])
+    completed = snapshot.setdefault("completed_sections", [])
+    if event.type == SECTION_STARTED and event.section not in in_flight:
+        in_flight.append(event.section)
+    elif event.type in (SECTION_COMPLETED, SECTION_FAILED):
+        if event.section in in_flight:
+            in_flight.remove(event.section)
+        completed.append(event.section)
+    elif event.type in TERMINAL_EVENTS:
+        in_flight.clear()
+
+    snapshot["current_section"] = in_flight[0] if in_flight else None
+    snapshot["seq"] = event.seq
+
+class ProgressBus:
+    """按请求分发进度事件"""
+
+    def __init__(self, history_size: int = 1000, max_requests: int = 500,
+                 shared_events: Optional[MutableMapping[str, List[Dict[str, Any]]]] = None,
+                 shared_history: int = 200, poll_interval: float = 0.5, flush_interval: float = 0.1):
+        """
+        Args:
+            history_size: 每个请求保留的事件数
+            max_requests: 保留历史的请求数，超出时丢弃最早的请求
+            shared_events: 多进程共享的事件存储（request_id -> 最近的事件），单进程时为None
+            shared_history: 每个请求在共享存储中保留的事件数
+            poll_interval: 订阅者读取共享存储的间隔（秒）
+            flush_interval: 合并写入共享存储的间隔（秒）
+        """
+        self.history_size = history_size
+        self.max_requests = max_requests
+        self.shared_events = shared_events
+        self.shared_history = shared_history
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self._history: "OrderedDict[str, Deque[ProgressEvent]]" = OrderedDict()
+        self._seq: Dict[str, int] = {}
+        # 多进程部署时本进程内的最新快照，以及尚未写入共享存储的快照和事件
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._pending_snapshots: Dict[str, Dict[str, Any]] = {}
+        self._pending_events: Dict[str, List[Dict[str, Any]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._listeners: List[Callable[[ProgressEvent], None]] = [self._update_snapshot, self._log_event]
+        if shared_events is not None:
+            self._listeners.append(self._share_event)
+
+    def add_listener(self, listener: Callable[[ProgressEvent], None]) -> None:
+        """注册同步监听器，每条事件发布时调用"""
+        self._listeners.append(listener)
+
+    async def start(self, request_id: Optional[str], message: str = "正在准备生成详细内容...", progress: int = 0,
+                    stage: str = "preparing") -> Optional[ProgressEvent]:
+        """开始一次新的生成：清空该请求的历史（序号继续递增）并发布started事件"""
+        await self.prime(request_id)
+        self._history.pop(request_id, None)
+        return self.publish(request_id, STARTED, progress=progress, stage=stage, message=message)
+
+    async def prime(self, request_id: Optional[str]) -> None:
+        """读取请求的最新快照（可能由其他进程发布），之后发布的事件序号接着它继续
+
+        在发布不以start()开始的事件（如取消、出错）之前调用。共享存储在线程中读取，不阻塞事件循环。
+        """
+        if not request_id or request_id in self._seq:
+            return
+        snapshot = await self.load_snapshot(request_id)
+        if self.shared_events is not None and snapshot is not None:
+            self._snapshots.setdefault(request_id, snapshot)
+        self._seq.setdefault(request_id, snapshot["seq"] if snapshot else 0)
+
+    def publish(self, request_id: Optional[str], event_type: str, **fields: Any) -> Optional[ProgressEvent]:
+        """发布一条事件；request_id为空时忽略"""
+        if not request_id:
+            return None
+        if request_id not in self._seq:
+            # 序号接着本进程内的快照继续（未调用prime()时不读取共享存储）
+            snapshot = self.snapshot(request_id)
+            self._seq[request_id] = snapshot["seq"] if snapshot else 0
+        seq = self._seq[request_id] + 1
+        self._seq[request_id] = seq
+        event = ProgressEvent(request_id=request_id, seq=seq, type=event_type, **fields)
+
+        history = self._history.get(request_id)
+        if history is None:
+            history = self._history[request_id] = deque(maxlen=self.history_size)
+            while len(self._history) > self.max_requests:
+                old_id, _ = self._history.popitem(last=False)
+                self._seq.pop(old_id, None)
+                self._snapshots.pop(old_id, None)
+        else:
+            self._history.move_to_end(request_id)
+        history.append(event)
+
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"进度监听器出错: {e}")
+        for queue in self._subscribers.get(request_id, []):
+            queue.put_nowait(event)
+        return event
+
+    async def events(self, request_id: str, after: int = 0) -> List[ProgressEvent]:
+        """返回序号大于after的历史事件，包括其他进程发布到共享存储中的事件（在线程中读取）"""
+        events = [event for event in self._history.get(request_id, ()) if event.seq > after]
+        if self.shared_events is not None:
+            events += await asyncio.to_thread(self._shared_events, request_id, events[-1].seq if events else after)
+        return events
+
+    def _shared_events(self, request_id: str, after: int) -> List[ProgressEvent]:
+        if self.shared_events is None:
+            return []
+        return [ProgressEvent(**event) for event in self.shared_events.get(request_id, []) if event["seq"] > after]
+
+    def snapshot(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """本进程内请求的最新进度快照（可能尚未写入共享存储）；其他进程发布的快照用load_snapshot()读取"""
+        if self.shared_events is not None:
+            return self._snapshots.get(request_id)
+        return generation_progress.get(request_id)
+
+    async def load_snapshot(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """请求的最新进度快照；本进程发布过的请求直接返回本进程内的快照，否则在线程中读取共享存储"""
+        snapshot = self.snapshot(request_id)
+        if snapshot is None and self.shared_events is not None:
+            snapshot = await asyncio.to_thread(generation_progress.get, request_id)
+        return snapshot
+
+    async def flush(self) -> None:
+        """把尚未写入的快照和事件写入共享存储（在线程中执行，不阻塞事件循环）"""
+        async with self._flush_lock:
+            snapshots, self._pending_snapshots = self._pending_snapshots, {}
+            events, self._pending_events = self._pending_events, {}
+            if not snapshots and not events:
+                return
+            try:
+                await asyncio.to_thread(self._write_shared, snapshots, events)
+            except Exception as e:
+                logger.error(f"写入共享进度失败: {e}")
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（例如同步代码中发布）：直接写入
+            snapshots, self._pending_snapshots = self._pending_snapshots, {}
+            events, self._pending_events = self._pending_events, {}
+            self._write_shared(snapshots, events)
+            return
+        self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        try:
+            while self._pending_snapshots or self._pending_events:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            self._flush_task = None
+
+    def _write_shared(self, snapshots: Dict[str, Dict[str, Any]], events: Dict[str, List[Dict[str, Any]]]) -> None:
+        for request_id, new_events in events.items():
+            def append(current: Optional[List[Dict[str, Any]]], new_events=new_events) -> List[Dict[str, Any]]:
+                # 新一次生成开始时清空之前的事件
+                starts = [index for index, event in enumerate(new_events) if event["type"] == STARTED]
+                if starts or current is None:
+                    current, new_events = [], new_events[starts[-1]:] if starts else new_events
+                return (current + new_events)[-self.shared_history:]
+
+            self.shared_events.update_item(request_id, append)
+        for request_id, snapshot in snapshots.items():
+            generation_progress[request_id] = snapshot
+
+    async def subscribe(self, request_id: str, after: int = 0,
+                        keepalive: Optional[float] = None) -> AsyncIterator[Optional[ProgressEvent]]:
+        """订阅某个请求的事件，先回放历史再推送实时事件，遇到结束事件后停止
+
+        Args:
+            request_id: 请求ID
+            after: 只返回序号大于该值的事件（用于断线重连）
+            keepalive: 超过该秒数没有事件时产出None，便于调用方发送心跳或检查连接
+
+        Yields:
+            进度事件，或心跳时的None
+        """
+        # 先登记队列再回放历史，回放期间发布的事件也会进入队列
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(request_id, []).append(queue)
+        last_seq = after
+        try:
+            for event in await self.events(request_id, after):
+                last_seq = event.seq
+                yield event
+                if event.type in TERMINAL_EVENTS:
+                    return
+            idle = 0.0
+            while True:
+                # 共享存储中的事件可能由其他进程发布，需要定期读取
+                timeout = keepalive
+                if self.shared_events is not None:
+                    timeout = self.poll_interval if keepalive is None else max(0.0, min(self.poll_interval, keepalive - idle))
+                try:
+                    events = [await asyncio.wait_for(queue.get(), timeout=timeout)]
+                except asyncio.TimeoutError:
+                    events = await asyncio.to_thread(self._shared_events, request_id, last_seq)
+                    if not events:
+                        idle += timeout
+                        if keepalive is not None and idle >= keepalive:
+                            yield None
+                            idle = 0.0
+                        continue
+                idle = 0.0
+                for event in events:
+                    if event.seq <= last_seq:
+                        continue
+                    last_seq = event.seq
+                    yield event
+                    if event.type in TERMINAL_EVENTS:
+                        return
+        finally:
+            subscribers = self._subscribers.get(request_id, [])
+            if queue in subscribers:
+                subscribers.remove(queue)
+            if not subscribers:
+                self._subscribers.pop(request_id, None)
+
+    def _update_snapshot(self, event: ProgressEvent) -> None:
+        """轮询接口订阅者：维护generation_progress中的最新快照（多进程部署时稍后批量写入）"""
+        if self.shared_events is None:
+            snapshot = generation_progress.get(event.request_id)
+            if snapshot is None or event.type == STARTED:
+                snapshot = _initial_snapshot()
+            apply_event(snapshot, event)
+            generation_progress[event.request_id] = snapshot
+            return
+        snapshot = self.snapshot(event.request_id)
+        if snapshot is None or event.type == STARTED:
+            snapshot = _initial_snapshot()
+        apply_event(snapshot, event)
+        self._snapshots[event.request_id] = snapshot
+        self._pending_snapshots[event.request_id] = copy.deepcopy(snapshot)
+        self._schedule_flush()
+
+    def _share_event(self, event: ProgressEvent) -> None:
+        """多进程订阅者：把事件加入待写入共享存储的队列，新一次生成开始时清空共享存储中的事件"""
+        self._pending_events.setdefault(event.request_id, []).append(event.to_dict())
+        self._schedule_flush()
+
+    @staticmethod
+    def _log_event(event: ProgressEvent) -> None:
+        """日志订阅者"""
+        detail = f" [{event.section}]" if event.section else ""
+        logger.info(f"进度 {event.request_id} #{event.seq} {event.type}{detail}: {event.message or ''}")
+
+# 进程内共享的进度总线（多进程部署时事件同时写入共享状态）
+progress_bus = ProgressBus(shared_events=progress_events)
@@ -1,15 +1,27 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request, Header
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
 import os
 import traceback
 import json
 import logging
 import uuid
+import asyncio
+from contextlib import aclosing
 
-from api.graph import run_document_workflow, generate_outline, generate_title
-from utils.document_generator import DocumentGenerator
-from api.state import generation_progress, document_requests
+from api.graph import run_document_workflow, generate_outline, generate_title, generate_plan
+from utils.render_pool import render_pool, RenderQueueFull, RenderTimeout
+from api.state import document_requests, checkpoint_store
+from api.progress import progress_bus, SECTION_STARTED, SECTION_COMPLETED, COMPLETED, ERROR, CANCELLED
+from api.cancellation import generation_registry, GenerationCancelled, OUTLINE_EDITED, CLIENT_DISCONNECTED
+from api.jobs import job_manager, JobQueueFull, RUNNING
+from api.langgraph_impl import (
+    deepseek_client, stream_section_content, section_fingerprint, speculation_stats, length_stats,
+    stream_outline_sections, EarlySectionGenerator, use_hierarchical, record_run, RunRecord
+)
+from utils.llm_cache import bypass_cache
+from utils.deadline import deadline_stats
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -22,6 +34,12 @@ class DocumentRequest(BaseModel):
     topic: str
     page_limit: int
     document_type: str  # "ppt" 或 "word"
+    use_cache: bool = True  # 为False时本次请求跳过LLM响应缓存
+    section_concurrency: Optional[int] = Field(default=None, ge=1)  # 同时生成的章节数上限
+    outline_strategy: Literal["sequential", "plan", "speculative", "streaming"] = "sequential"  # "plan"一次调用生成标题和大纲，"speculative"与标题并行推测大纲，"streaming"流式大纲并提前生成章节内容
+    request_id: Optional[str] = None  # 客户端指定的请求ID，中断后用相同ID重试会从检查点继续
+    hierarchical: Optional[bool] = None  # 分层生成（章节 → 小节 → 段落），默认页数较多时自动启用
+    deadline: Optional[float] = Field(default=None, gt=0)  # 截止时间（秒），剩余时间不足时章节降级生成，默认使用REQUEST_DEADLINE_SECONDS
 
 # 大纲生成请求模型
 class OutlineRequest(BaseModel):
@@ -52,6 +70,7 @@ class OutlineResponse(BaseModel):
     error: Optional[str] = None
     title: str
     request_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    outline_strategy: Optional[str] = None  # 实际采用的大纲生成方式
 
 # 响应模型
 class WorkflowResponse(BaseModel):
@@ -61,6 +80,16 @@ class WorkflowResponse(BaseModel):
     content: Optional[Dict[str, str]] = None
     request_id: str
     message: Optional[str] = None
+    reused_sections: Optional[List[str]] = None       # 内容未变化、直接复用的章节
+    regenerated_sections: Optional[List[str]] = None  # 重新调用模型生成的章节
+    degraded_sections: Optional[List[Dict[str, str]]] = None  # 因截止时间降级生成的章节及所用策略
+    cancel_reason: Optional[str] = None               # 生成被取消时的原因
+
+# 后台重新生成内容任务的选项（与/regenerate-content的查询参数相同）
+class RegenerateContentJobRequest(BaseModel):
+    use_cache: bool = True
+    incremental: bool = True
+    deadline: Optional[float] = Field(default=None, gt=0)
 
 class GenerateDocumentResponse(BaseModel):
     success: bool
@@ -69,20 +98,93 @@ class GenerateDocumentResponse(BaseModel):
 
 # 添加获取生成进度的API端点
 @router.get("/generation-progress/{request_id}")
-async def get_generation_progress(request_id: str):
-    """获取内容生成进度"""
-    logger.info(f"获取生成进度: request_id={request_id}")
+async def get_generation_progress(request_id: str, after: Optional[int] = None):
+    """获取内容生成进度
     
-    if request_id not in generation_progress:
-        return {
+    返回最新的进度快照；传入after（上次收到的seq）时，同时返回此后的全部事件，
+    轮询间隔内发生的章节开始/完成也不会遗漏。
+    """
+    snapshot = await progress_bus.load_snapshot(request_id)
+    if snapshot is None:
+        snapshot = {
             "progress": 0,
             "current_stage": "not_started",
             "message": "生成尚未开始",
             "current_section": None,
-            "completed_sections": []
+            "in_flight_sections": [],
+            "completed_sections": [],
+            "seq": 0
         }
+    else:
+        snapshot = dict(snapshot)
+    
+    if after is not None:
+        snapshot["events"] = [event.to_dict() for event in await progress_bus.events(request_id, after)]
+    return snapshot
+
+# 进度事件推送端点（SSE）
+@router.get("/generation-progress/{request_id}/events")
+async def stream_generation_progress(
+    request_id: str,
+    request: Request,
+    after: int = 0,
+    last_event_id: Optional[str] = Header(default=None)
+):
+    """以SSE推送进度事件，直到生成完成或出错
+    
+    先回放已发生的事件再推送实时事件；断线重连时浏览器会带上Last-Event-ID，从断点继续。
+    """
+    if last_event_id and last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+    
+    async def event_stream():
+        async for event in progress_bus.subscribe(request_id, after=after, keepalive=15.0):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                # 心跳，防止代理断开空闲连接
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {event.seq}\n" + _sse_event(event.type, event.to_dict())
     
-    return generation_progress[request_id]
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# LLM客户端监控端点
+@router.get("/llm-stats")
+async def get_llm_stats():
+    """获取LLM客户端的运行统计（连接池等）"""
+    return {
+        "pool": deepseek_client.pool_stats(),
+        "cache": deepseek_client.cache.stats(),
+        "limiter": deepseek_client.limiter.stats(),
+        "singleflight": deepseek_client.singleflight.stats(),
+        "router": deepseek_client.router.stats(),
+        "circuit_breaker": deepseek_client.breaker.stats(),
+        "speculation": speculation_stats.stats(),
+        "length_control": length_stats.stats(),
+        "generations": generation_registry.stats(),
+        "deadline": deadline_stats.stats(),
+        "jobs": await job_manager.stats(),
+        "render": render_pool.stats(),
+        "usage": deepseek_client.usage_stats()
+    }
+
+# LLM熔断器状态端点
+@router.get("/circuit-breaker")
+async def get_circuit_breaker():
+    """获取LLM熔断器的状态（closed / open / half_open）和失败窗口统计"""
+    return deepseek_client.breaker.stats()
+
+@router.post("/circuit-breaker/reset")
+async def reset_circuit_breaker():
+    """手动将LLM熔断器恢复为关闭状态"""
+    deepseek_client.breaker.reset()
+    logger.info("LLM熔断器已手动重置")
+    return deepseek_client.breaker.stats()
 
 # 添加兼容旧API的大纲生成端点
 @router.post("/generate-outline", response_model=OutlineResponse)
@@ -90,20 +192,32 @@ async def api_generate_outline(request: DocumentRequest):
     """生成文档大纲API"""
     try:
         logger.info(f"收到大纲生成请求: 主题={request.topic}, 页数={request.page_limit}, 类型={request.document_type}")
+        hierarchical = use_hierarchical(request.page_limit, request.hierarchical)
         
-        # 首先生成标题
-        title_result = await generate_title(request.topic, request.document_type, request.page_limit)
-        title = title_result["title"]
-        
-        logger.info(f"生成的标题: {title}")
-        
-        # 然后调用大纲生成函数
-        outline_result = await generate_outline(
-            topic=request.topic,
-            title=title,
-            page_limit=request.page_limit,
-            document_type=request.document_type
-        )
+        with bypass_cache(not request.use_cache):
+            if request.outline_strategy != "sequential":
+                # 一次调用同时生成标题和大纲，或与标题并行推测大纲
+                outline_result = await generate_plan(request.topic, request.document_type, request.page_limit,
+                                                     strategy=request.outline_strategy, hierarchical=hierarchical)
+                title = outline_result["title"]
+                strategy = outline_result["strategy"]
+                logger.info(f"生成的标题: {title}（{strategy}）")
+            else:
+                # 首先生成标题
+                title_result = await generate_title(request.topic, request.document_type, request.page_limit)
+                title = title_result["title"]
+                strategy = "sequential"
+                
+                logger.info(f"生成的标题: {title}")
+                
+                # 然后调用大纲生成函数
+                outline_result = await generate_outline(
+                    topic=request.topic,
+                    title=title,
+                    page_limit=request.page_limit,
+                    document_type=request.document_type,
+                    hierarchical=hierarchical
+                )
         
         logger.info(f"大纲生成完成，包含{len(outline_result['outline'])}个章节")
         
@@ -111,7 +225,7 @@ async def api_generate_outline(request: DocumentRequest):
         request_id = str(uuid.uuid4())
         
         # 保存请求数据到内存存储，便于后续使用
-        document_requests[request_id] = {
+        await document_requests.aset(request_id, {
             "topic": request.topic,
             "title": title,
             "outline": outline_result["outline"],
@@ -119,8 +233,10 @@ async def api_generate_outline(request: DocumentRequest):
             "page_limit": request.page_limit,
             "content": None,
             "user_edited_title": False,
-            "user_edited_outline": False
-        }
+            "user_edited_outline": False,
+            "section_concurrency": request.section_concurrency,
+            "hierarchical": hierarchical
+        })
         
         return {
             "success": outline_result["success"],
@@ -128,7 +244,8 @@ async def api_generate_outline(request: DocumentRequest):
             "estimated_pages": outline_result.get("estimated_pages", request.page_limit),
             "error": outline_result.get("error"),
             "title": title,
-            "request_id": request_id
+            "request_id": request_id,
+            "outline_strategy": strategy
         }
         
     except Exception as e:
@@ -148,38 +265,194 @@ async def api_generate_outline(request: DocumentRequest):
             "request_id": str(uuid.uuid4())
         }
 
+# 流式大纲生成端点：每个章节的大纲一解析出来就推送，可选地同时提前生成章节内容
+@router.post("/generate-outline/stream")
+async def generate_outline_stream(request: DocumentRequest, prefetch_content: bool = False):
+    """以SSE流式生成大纲，逐章节推送；prefetch_content为True时章节大纲一到达就开始生成该章节的内容，
+    生成的内容按章节指纹保存，之后调用内容生成接口时直接复用"""
+    logger.info(f"收到流式大纲生成请求: 主题={request.topic}, 页数={request.page_limit}, 类型={request.document_type}")
+    request_id = request.request_id or str(uuid.uuid4())
+    
+    async def event_stream():
+        yield _sse_event("start", {"request_id": request_id})
+        
+        with bypass_cache(not request.use_cache):
+            title_result = await generate_title(request.topic, request.document_type, request.page_limit)
+        title = title_result["title"]
+        yield _sse_event("title", {"title": title})
+        
+        state = {
+            "topic": request.topic,
+            "title": title,
+            "document_type": request.document_type,
+            "page_limit": request.page_limit,
+            "section_concurrency": request.section_concurrency,
+            "hierarchical": use_hierarchical(request.page_limit, request.hierarchical),
+            "request_id": request_id
+        }
+        # 分层生成的章节由小节和段落组装，不提前按整章生成
+        prefetch = prefetch_content and not state["hierarchical"]
+        early = EarlySectionGenerator(state) if prefetch else None
+        completed = False
+        async with generation_registry.track(request_id) as generation:
+            try:
+                outline = []
+                strategy = "streaming"
+                try:
+                    async with aclosing(stream_outline_sections(state, use_cache=request.use_cache)) as sections:
+                        async for section in sections:
+                            outline.append(section)
+                            yield _sse_event("section", {"index": len(outline) - 1, "section": section})
+                            if early:
+                                with bypass_cache(not request.use_cache):
+                                    early.submit(section, outline)
+                except Exception as e:
+                    logger.error(f"流式大纲生成失败，改为一次性生成: {e}")
+                    if early:
+                        early.cancel()
+                        early = EarlySectionGenerator(state) if prefetch else None
+                    if outline:
+                        # 已推送的章节作废
+                        yield _sse_event("outline_reset", {})
+                    with bypass_cache(not request.use_cache):
+                        outline_result = await generate_outline(request.topic, title, request.page_limit, request.document_type,
+                                                                hierarchical=state["hierarchical"])
+                    outline = outline_result["outline"]
+                    strategy = "streaming_fallback"
+                    for index, section in enumerate(outline):
+                        yield _sse_event("section", {"index": index, "section": section})
+                        if early:
+                            with bypass_cache(not request.use_cache):
+                                early.submit(section, outline)
+                
+                request_data = {
+                    "topic": request.topic,
+                    "title": title,
+                    "outline": outline,
+                    "document_type": request.document_type,
+                    "page_limit": request.page_limit,
+                    "content": None,
+                    "user_edited_title": False,
+                    "user_edited_outline": False,
+                    "section_concurrency": request.section_concurrency,
+                    "hierarchical": state["hierarchical"],
+                    "section_contents": {}
+                }
+                await document_requests.aset(request_id, request_data)
+                yield _sse_event("outline_done", {
+                    "request_id": request_id,
+                    "title": title,
+                    "outline": outline,
+                    "estimated_pages": 2 + len(outline),
+                    "outline_strategy": strategy
+                })
+                
+                if early:
+                    async for section, content, ok in early.completed():
+                        yield _sse_event("section_content", {"title": section["title"], "content": content, "ok": ok})
+                    await document_requests.apatch(request_id, {"section_contents": dict(early.contents)})
+                    # 提前生成的章节已保存在document_requests中，不再需要检查点
+                    await asyncio.to_thread(checkpoint_store.finish_run, request_id)
+                completed = True
+            finally:
+                # 客户端断开或取消时不再继续提前生成，已完成的章节保留
+                if early:
+                    early.cancel()
+                    if not completed and await document_requests.acontains(request_id):
+                        await _keep_finished_sections(request_id, dict(early.contents), generation.reason or CLIENT_DISCONNECTED)
+        
+        yield _sse_event("done", {"request_id": request_id, "prefetched_sections": len(early.contents) if early else 0})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/document-workflow", response_model=WorkflowResponse)
-async def document_workflow(request: DocumentRequest):
-    """LangGraph工作流：一次性生成包含标题、大纲和内容的完整文档"""
+async def document_workflow(request: DocumentRequest, http_request: Request = None):
+    """LangGraph工作流：一次性生成包含标题、大纲和内容的完整文档
+    
+    客户端断开连接或调用取消接口时停止生成，已完成的章节保存在document_requests中。
+    """
+    # 生成请求ID（检查点按该ID保存）
+    request_id = request.request_id or str(uuid.uuid4())
+    
     try:
         logger.info(f"收到文档工作流请求: 主题={request.topic}, 页数={request.page_limit}, 类型={request.document_type}")
+        logger.info(f"请求ID: {request_id}")
+        
+        # 相同ID的请求已经完成（例如重启后已自动恢复），直接返回结果
+        existing = await document_requests.aget(request_id)
+        if request.request_id and existing and existing.get("content") and not existing.get("needs_content_update"):
+            logger.info(f"请求已完成，直接返回: {request_id}")
+            return {
+                "success": not existing.get("error_message"),
+                "title": existing["title"],
+                "outline": existing["outline"],
+                "content": existing["content"],
+                "request_id": request_id,
+                "message": "文档内容已生成"
+            }
         
-        # 运行基于LangGraph的完整工作流
-        workflow_result = await run_document_workflow(
-            topic=request.topic,
-            page_limit=request.page_limit,
-            document_type=request.document_type
-        )
+        # 登记运行，进程中途退出时启动后会自动恢复
+        await asyncio.to_thread(checkpoint_store.start_run, request_id, "document_workflow", request.dict())
         
-        # 生成请求ID
-        request_id = str(uuid.uuid4())
-        logger.info(f"生成请求ID: {request_id}")
+        # 运行基于LangGraph的完整工作流（登记为可取消的生成任务）
+        with bypass_cache(not request.use_cache), record_run() as record:
+            try:
+                workflow_result = await generation_registry.run(request_id, run_document_workflow(
+                    topic=request.topic,
+                    page_limit=request.page_limit,
+                    document_type=request.document_type,
+                    section_concurrency=request.section_concurrency,
+                    outline_strategy=request.outline_strategy,
+                    request_id=request_id,
+                    hierarchical=request.hierarchical,
+                    deadline=request.deadline
+                ), request=http_request)
+            except GenerationCancelled as cancelled:
+                state = record.state or {}
+                if state.get("title") and state.get("outline"):
+                    await document_requests.aset(request_id, {
+                        "topic": request.topic,
+                        "title": state["title"],
+                        "outline": state["outline"],
+                        "document_type": request.document_type,
+                        "page_limit": request.page_limit,
+                        "content": None,
+                        "section_contents": {},
+                        "user_edited_title": False,
+                        "user_edited_outline": False,
+                        "section_concurrency": request.section_concurrency,
+                        "hierarchical": state.get("hierarchical"),
+                        "needs_content_update": True
+                    })
+                return await _cancelled_response(request_id, record, cancelled.reason,
+                                           state.get("title") or f"{request.topic}研究分析", state.get("outline") or [])
         
         # 保存请求数据到内存存储
-        document_requests[request_id] = {
+        await document_requests.aset(request_id, {
             "topic": request.topic,
             "title": workflow_result["title"],
             "outline": workflow_result["outline"],
             "document_type": request.document_type,
             "page_limit": request.page_limit,
             "content": workflow_result["content"],
+            "section_contents": workflow_result.get("section_contents") or {},
             "user_edited_title": False,
             "user_edited_outline": False,
+            "section_concurrency": request.section_concurrency,
+            "hierarchical": workflow_result.get("hierarchical"),
             "error_message": workflow_result.get("error_message")
-        }
+        })
+        await asyncio.to_thread(checkpoint_store.finish_run, request_id)
         
         # 构建响应信息
+        degraded_sections = workflow_result.get("degraded_sections") or []
         message = "文档内容生成成功"
+        if degraded_sections:
+            message = f"文档内容生成成功，{len(degraded_sections)}个章节因截止时间降级生成"
         if workflow_result.get("error_message"):
             message = f"文档生成部分成功，但有问题: {workflow_result.get('error_message')}"
         
@@ -191,7 +464,8 @@ async def document_workflow(request: DocumentRequest):
             "outline": workflow_result["outline"],
             "content": workflow_result["content"] or {},
             "request_id": request_id,
-            "message": message
+            "message": message,
+            "degraded_sections": degraded_sections
         }
         
     except Exception as e:
@@ -220,11 +494,8 @@ async def document_workflow(request: DocumentRequest):
         for section in basic_outline:
             empty_content[section["title"]] = "内容生成失败，请手动填写或重试。"
         
-        # 生成请求ID
-        request_id = str(uuid.uuid4())
-        
         # 保存基本数据
-        document_requests[request_id] = {
+        await document_requests.aset(request_id, {
             "topic": request.topic,
             "title": default_title,
             "outline": basic_outline,
@@ -233,7 +504,7 @@ async def document_workflow(request: DocumentRequest):
             "content": empty_content,
             "user_edited_title": False,
             "user_edited_outline": False
-        }
+        })
         
         return {
             "success": False,
@@ -249,20 +520,19 @@ async def edit_workflow_title(request_id: str, title_edit: TitleEditRequest):
     """编辑文档标题（工作流版本）"""
     logger.info(f"收到标题编辑请求: request_id={request_id}")
     
-    if request_id not in document_requests:
+    if not await document_requests.acontains(request_id):
         logger.warning(f"请求ID不存在: {request_id}")
         raise HTTPException(status_code=404, detail="请求ID不存在")
     
     try:
-        # 获取原始请求数据
-        request_data = document_requests[request_id]
-        
-        # 更新标题
-        request_data["title"] = title_edit.title
-        request_data["user_edited_title"] = True
-        
-        # 提示需要重新生成内容
-        request_data["needs_content_update"] = True
+        # 更新标题，并提示需要重新生成内容（原子更新，不覆盖同时写入的其他字段）
+        request_data = await document_requests.apatch(request_id, {
+            "title": title_edit.title,
+            "user_edited_title": True,
+            "needs_content_update": True
+        })
+        # 正在进行的生成已经过时
+        await generation_registry.cancel(request_id, OUTLINE_EDITED)
         
         logger.info(f"标题已更新: {title_edit.title}")
         
@@ -285,27 +555,23 @@ async def edit_workflow_outline(request_id: str, outline_edit: OutlineEditReques
     """编辑文档大纲（工作流版本）"""
     logger.info(f"收到大纲编辑请求: request_id={request_id}")
     
-    if request_id not in document_requests:
+    if not await document_requests.acontains(request_id):
         logger.warning(f"请求ID不存在: {request_id}")
         raise HTTPException(status_code=404, detail="请求ID不存在")
     
     try:
-        # 获取原始请求数据
-        request_data = document_requests[request_id]
-        
-        # 更新大纲
+        # 更新大纲，并提示需要重新生成内容
         outline_dict = [item.dict() for item in outline_edit.outline]
-        request_data["outline"] = outline_dict
-        request_data["user_edited_outline"] = True
+        updates = {"outline": outline_dict, "user_edited_outline": True, "needs_content_update": True}
         
         # 更新标题（如果提供）
         if outline_edit.title:
-            request_data["title"] = outline_edit.title
-            request_data["user_edited_title"] = True
+            updates.update({"title": outline_edit.title, "user_edited_title": True})
             logger.info(f"标题已更新: {outline_edit.title}")
         
-        # 提示需要重新生成内容
-        request_data["needs_content_update"] = True
+        request_data = await document_requests.apatch(request_id, updates)
+        # 正在进行的生成已经过时（已完成且未修改的章节重新生成时会复用）
+        await generation_registry.cancel(request_id, OUTLINE_EDITED)
         
         logger.info(f"大纲已更新: {json.dumps(outline_dict)[:200]}...")
         
@@ -336,7 +602,7 @@ async def generate_document(request_id: str, background_tasks: BackgroundTasks):
     try:
         logger.info(f"收到生成文档请求: request_id={request_id}")
         
-        if request_id not in document_requests:
+        if not await document_requests.acontains(request_id):
             logger.warning(f"找不到request_id: {request_id}")
             
             # 为了前端体验，返回更友好的错误而不是抛出异常
@@ -346,7 +612,7 @@ async def generate_document(request_id: str, background_tasks: BackgroundTasks):
                 "file_path": None
             }
         
-        request_data = document_requests[request_id]
+        request_data = await document_requests.aget(request_id)
         title = request_data["title"]
         outline_data = request_data["outline"]
         document_type = request_data["document_type"]
@@ -369,36 +635,33 @@ async def generate_document(request_id: str, background_tasks: BackgroundTasks):
         file_name = f"{title.replace(' ', '_').replace('/', '_')}_{request_id[-8:]}"
         
         if document_type.lower() == "ppt":
-            # 生成PPT
             logger.info(f"生成PPT文档，页数限制: {request_data.get('page_limit')}")
-            logger.info(f"内容数据章节: {list(content_data.keys()) if content_data else '无'}")
-            
-            ppt = DocumentGenerator.generate_ppt(title, outline_data, content_data, request_data.get("page_limit"))
-            file_path = os.path.join(static_dir, f"{file_name}.pptx")
-            ppt.save(file_path)
-            # 构建相对URL路径，而不是绝对文件系统路径
-            relative_path = f"documents/{file_name}.pptx"
-            logger.info(f"PPT已保存: {file_path}, 相对路径: {relative_path}")
-            
+            extension = "pptx"
         elif document_type.lower() == "word":
-            # 生成Word文档
             logger.info(f"生成Word文档")
-            logger.info(f"内容数据章节: {list(content_data.keys()) if content_data else '无'}")
-            
-            doc = DocumentGenerator.generate_word(title, outline_data, content_data)
-            file_path = os.path.join(static_dir, f"{file_name}.docx")
-            doc.save(file_path)
-            # 构建相对URL路径，而不是绝对文件系统路径
-            relative_path = f"documents/{file_name}.docx"
-            logger.info(f"Word文档已保存: {file_path}, 相对路径: {relative_path}")
-            
+            extension = "docx"
         else:
             logger.warning(f"不支持的文档类型: {document_type}")
             raise HTTPException(status_code=400, detail="不支持的文档类型")
+        logger.info(f"内容数据章节: {list(content_data.keys()) if content_data else '无'}")
+        
+        # 渲染和保存在进程池中执行，不阻塞事件循环
+        file_path = os.path.join(static_dir, f"{file_name}.{extension}")
+        try:
+            result = await render_pool.render(
+                document_type, title, outline_data, content_data, request_data.get("page_limit"), file_path
+            )
+        except RenderQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except RenderTimeout as e:
+            raise HTTPException(status_code=504, detail=f"生成文档超时: {e}")
+        # 构建相对URL路径，而不是绝对文件系统路径
+        relative_path = f"documents/{file_name}.{extension}"
+        logger.info(f"{document_type.upper()}文档已保存: {file_path}, 相对路径: {relative_path}, "
+                    f"渲染耗时{result['render_seconds']:.2f}s, 总耗时{result['total_seconds']:.2f}s")
         
         # 保存文件路径到请求数据中
-        request_data["file_path"] = file_path
-        request_data["relative_path"] = relative_path
+        await document_requests.apatch(request_id, {"file_path": file_path, "relative_path": relative_path})
         
         return {
             "success": True,
@@ -406,23 +669,37 @@ async def generate_document(request_id: str, background_tasks: BackgroundTasks):
             "file_path": relative_path  # 返回相对路径
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"生成文档时出错: {e}")
         logger.error(f"详细错误: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"生成文档失败: {str(e)}")
 
 @router.post("/regenerate-content/{request_id}", response_model=WorkflowResponse)
-async def regenerate_content(request_id: str):
-    """当编辑标题或大纲后，重新生成内容"""
+async def regenerate_content(request_id: str, use_cache: bool = True, incremental: bool = True,
+                             http_request: Request = None, deadline: Optional[float] = None):
+    """当编辑标题或大纲后，重新生成内容
+    
+    incremental为True时只为新增或修改过的章节调用模型，未变化（包括只调整了顺序）的章节复用已有内容。
+    deadline为本次生成的截止时间（秒），剩余时间不足时章节降级生成，降级的章节在degraded_sections中列出。
+    客户端断开连接、调用取消接口或生成途中再次编辑时停止生成，已完成的章节保存在document_requests中。
+    """
+    return await _regenerate_content(request_id, use_cache, incremental, http_request, deadline)
+
+async def _regenerate_content(request_id: str, use_cache: bool = True, incremental: bool = True,
+                              http_request: Request = None, deadline: Optional[float] = None,
+                              resumed: bool = False) -> Dict[str, Any]:
+    """重新生成内容；resumed为True时是恢复进程重启前中断的运行，即使非增量生成也复用该运行已完成的章节"""
     logger.info(f"收到重新生成内容请求: request_id={request_id}")
     
-    if request_id not in document_requests:
+    if not await document_requests.acontains(request_id):
         logger.warning(f"请求ID不存在: {request_id}")
         raise HTTPException(status_code=404, detail="请求ID不存在")
     
     try:
         # 获取原始请求数据
-        request_data = document_requests[request_id]
+        request_data = await document_requests.aget(request_id)
         
         # 记录重要信息以便调试
         logger.info(f"开始内容生成，标题: {request_data['title']}")
@@ -444,27 +721,40 @@ async def regenerate_content(request_id: str):
             "content": None,
             "user_edited_outline": request_data.get("user_edited_outline", False),
             "user_edited_title": request_data.get("user_edited_title", False),
+            "section_concurrency": request_data.get("section_concurrency"),
+            "hierarchical": request_data.get("hierarchical"),
+            "section_contents": request_data.get("section_contents") if incremental else None,
+            "incremental": incremental,
+            "resumed": resumed,
             "request_id": request_id  # 添加请求ID到状态中
         }
         
         # 初始化进度
-        generation_progress[request_id] = {
-            "progress": 0,
-            "current_stage": "initializing",
-            "message": "正在初始化内容生成...",
-            "current_section": None,
-            "completed_sections": []
-        }
+        await progress_bus.start(request_id, message="正在初始化内容生成...", stage="initializing")
+        
+        # 非增量生成时丢弃之前运行留下的章节检查点，全部章节重新生成
+        if not incremental and not resumed:
+            await asyncio.to_thread(checkpoint_store.clear_sections, request_id)
+        
+        # 登记运行，进程中途退出时启动后会自动恢复，已完成的章节不会重新生成
+        await asyncio.to_thread(checkpoint_store.start_run, request_id, "regenerate_content",
+                                {"use_cache": use_cache, "incremental": incremental})
         
         # 运行工作流获取新内容
         logger.info("开始调用工作流生成内容...")
-        workflow_result = await run_document_workflow(
-            topic=request_data["topic"],
-            page_limit=request_data["page_limit"],
-            document_type=request_data["document_type"],
-            initial_state=initial_state,
-            stop_at="content_generated"  # 执行到内容生成后停止
-        )
+        with bypass_cache(not use_cache), record_run() as record:
+            try:
+                workflow_result = await generation_registry.run(request_id, run_document_workflow(
+                    topic=request_data["topic"],
+                    page_limit=request_data["page_limit"],
+                    document_type=request_data["document_type"],
+                    initial_state=initial_state,
+                    stop_at="content_generated",  # 执行到内容生成后停止
+                    deadline=deadline
+                ), request=http_request)
+            except GenerationCancelled as cancelled:
+                return await _cancelled_response(request_id, record, cancelled.reason,
+                                           request_data["title"], request_data["outline"])
         
         # 检查结果
         if workflow_result.get("content"):
@@ -474,11 +764,22 @@ async def regenerate_content(request_id: str):
         else:
             logger.warning("内容生成结果为空")
         
-        # 更新请求数据的内容
-        request_data["content"] = workflow_result["content"]
-        request_data["needs_content_update"] = False
+        # 更新请求数据的内容（只写内容字段，生成期间对其他字段的修改不会被覆盖）
+        await document_requests.apatch(request_id, {
+            "content": workflow_result["content"],
+            "section_contents": workflow_result.get("section_contents") or {},
+            "needs_content_update": False
+        })
+        await asyncio.to_thread(checkpoint_store.finish_run, request_id)
         
+        reused_sections = workflow_result.get("reused_sections") or []
+        regenerated_sections = workflow_result.get("regenerated_sections") or []
+        degraded_sections = workflow_result.get("degraded_sections") or []
         message = "内容重新生成成功"
+        if reused_sections:
+            message = f"内容重新生成成功，重新生成{len(regenerated_sections)}个章节，复用{len(reused_sections)}个未变化的章节"
+        if degraded_sections:
+            message = f"{message}，{len(degraded_sections)}个章节因截止时间降级生成"
         if workflow_result.get("error_message"):
             message = f"内容部分重新生成成功，但有问题: {workflow_result.get('error_message')}"
         
@@ -490,25 +791,294 @@ async def regenerate_content(request_id: str):
             "outline": request_data["outline"],
             "content": workflow_result["content"] or {},
             "request_id": request_id,
-            "message": message
+            "message": message,
+            "reused_sections": reused_sections,
+            "regenerated_sections": regenerated_sections,
+            "degraded_sections": degraded_sections
         }
         
     except Exception as e:
         logger.error(f"重新生成内容时出错: {e}")
         logger.error(f"详细错误: {traceback.format_exc()}")
+        await progress_bus.prime(request_id)
+        progress_bus.publish(request_id, ERROR, progress=0, stage="error", message=f"重新生成内容失败: {str(e)}")
         
+        request_data = await document_requests.aget(request_id)
         return {
             "success": False,
-            "title": document_requests[request_id]["title"],
-            "outline": document_requests[request_id]["outline"],
-            "content": document_requests[request_id].get("content", {}),
+            "title": request_data["title"],
+            "outline": request_data["outline"],
+            "content": request_data.get("content", {}),
             "request_id": request_id,
             "message": f"重新生成内容失败: {str(e)}"
         }
 
 # 添加别名端点，使/api/generate-content/{request_id}也能工作
 @router.post("/generate-content/{request_id}", response_model=WorkflowResponse)
-async def generate_content_alias(request_id: str):
+async def generate_content_alias(request_id: str, use_cache: bool = True, incremental: bool = True,
+                                 http_request: Request = None, deadline: Optional[float] = None):
     """生成内容的别名端点，转发到regenerate_content"""
     logger.info(f"通过别名端点收到内容生成请求: request_id={request_id}")
-    return await regenerate_content(request_id) 
\ No newline at end of file
+    return await regenerate_content(request_id, use_cache, incremental, http_request, deadline)
+
+async def resume_interrupted_runs() -> None:
+    """恢复进程退出时仍在进行的生成任务（启动时在后台调用）
+    
+    已完成的节点和章节从检查点读取，只生成剩余部分；结果写回document_requests。
+    """
+    runs = await asyncio.to_thread(checkpoint_store.interrupted_runs)
+    if not runs:
+        return
+    logger.info(f"发现{len(runs)}个中断的生成任务，开始恢复")
+    
+    async def resume(run: Dict[str, Any]) -> None:
+        request_id = run["request_id"]
+        if await job_manager.is_pending(request_id):
+            # 由后台任务发起的运行随任务重新排队，不在这里恢复
+            return
+        if not await generation_registry.claim(request_id):
+            # 多进程部署时已由其他进程恢复
+            return
+        try:
+            if run["kind"] == "document_workflow":
+                await document_workflow(DocumentRequest(**{**run["params"], "request_id": request_id}))
+            elif run["kind"] == "regenerate_content" and await document_requests.acontains(request_id):
+                await _regenerate_content(request_id, **run["params"], resumed=True)
+            else:
+                await asyncio.to_thread(checkpoint_store.clear, request_id)
+                return
+            logger.info(f"已恢复生成任务: {request_id}")
+        except Exception as e:
+            logger.error(f"恢复生成任务{request_id}失败: {e}")
+    
+    await asyncio.gather(*(resume(run) for run in runs))
+
+async def _keep_finished_sections(request_id: str, sections: Dict[str, str], reason: str) -> int:
+    """生成被取消后保留已完成的章节：按指纹写入document_requests，之后重新生成时直接复用"""
+    if sections:
+        await document_requests.aupdate_item(request_id, lambda request_data: {
+            **request_data,
+            "section_contents": {**(request_data.get("section_contents") or {}), **sections},
+            "needs_content_update": True
+        } if request_data is not None else None)
+    # 取消的运行不再在重启后恢复
+    await asyncio.to_thread(checkpoint_store.finish_run, request_id)
+    await progress_bus.prime(request_id)
+    progress_bus.publish(request_id, CANCELLED, stage="cancelled",
+                         message=f"生成已取消，已保存{len(sections)}个已完成的章节")
+    logger.info(f"生成已取消: {request_id}（{reason}），保存了{len(sections)}个已完成的章节")
+    return len(sections)
+
+async def _cancelled_response(request_id: str, record: RunRecord, reason: str, title: str,
+                              outline: List[Dict[str, Any]]) -> Dict[str, Any]:
+    saved = await _keep_finished_sections(request_id, record.sections, reason)
+    return {
+        "success": False,
+        "title": title,
+        "outline": outline,
+        "content": None,
+        "request_id": request_id,
+        "message": f"生成已取消（{reason}），已保存{saved}个已完成的章节",
+        "cancel_reason": reason
+    }
+
+# 取消正在进行的生成
+@router.delete("/generation/{request_id}")
+async def cancel_generation(request_id: str):
+    """取消请求正在进行的生成：停止未完成的章节、中止上游请求并释放并发名额，已完成的章节保留"""
+    if not await generation_registry.cancel(request_id):
+        if not await document_requests.acontains(request_id):
+            raise HTTPException(status_code=404, detail="请求ID不存在")
+        return {"success": False, "request_id": request_id, "message": "没有正在进行的生成任务"}
+    return {"success": True, "request_id": request_id, "message": "已取消生成，已完成的章节会被保留"}
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# 流式内容生成端点：章节文本随模型输出实时推送到浏览器
+@router.api_route("/generate-content/{request_id}/stream", methods=["GET", "POST"])
+async def generate_content_stream(request_id: str, use_cache: bool = True, incremental: bool = True):
+    """以SSE流式生成内容，逐章节推送模型输出的文本；incremental为True时未变化的章节直接复用"""
+    logger.info(f"收到流式内容生成请求: request_id={request_id}")
+    
+    if not await document_requests.acontains(request_id):
+        logger.warning(f"请求ID不存在: {request_id}")
+        raise HTTPException(status_code=404, detail="请求ID不存在")
+    
+    request_data = await document_requests.aget(request_id)
+    outline = request_data["outline"] or []
+    
+    previous_contents = (request_data.get("section_contents") or {}) if incremental else {}
+    
+    async def event_stream():
+        content_dict = {}
+        section_contents = {}
+        total_sections = len(outline)
+        completed = False
+        # 登记为可取消的生成任务；客户端断开时Starlette会取消本任务
+        async with generation_registry.track(request_id) as generation:
+            try:
+                await progress_bus.start(request_id, message="正在流式生成内容...", stage="generating")
+                
+                yield _sse_event("start", {"request_id": request_id, "sections": [section["title"] for section in outline]})
+                
+                for index, section in enumerate(outline):
+                    section_title = section["title"]
+                    progress_bus.publish(
+                        request_id,
+                        SECTION_STARTED,
+                        progress=int(100 * index / max(total_sections, 1)),
+                        message=f"正在生成章节: {section_title}",
+                        section=section_title
+                    )
+                    yield _sse_event("section_start", {"index": index, "title": section_title})
+                    
+                    fingerprint = section_fingerprint(
+                        request_data["title"], request_data["topic"], section_title, section["content"], request_data["document_type"]
+                    )
+                    if fingerprint in previous_contents:
+                        # 章节未变化，直接推送已有内容
+                        content_dict[section_title] = section_contents[fingerprint] = previous_contents[fingerprint]
+                        yield _sse_event("section_end", {"index": index, "title": section_title,
+                                                         "content": content_dict[section_title], "reused": True})
+                        progress_bus.publish(
+                            request_id,
+                            SECTION_COMPLETED,
+                            progress=int(100 * (index + 1) / max(total_sections, 1)),
+                            message=f"章节'{section_title}'未变化，复用已有内容",
+                            section=section_title
+                        )
+                        continue
+                    
+                    # aclosing: 客户端断开或取消时立即关闭章节生成器及其上游流
+                    async with aclosing(stream_section_content(
+                        title=request_data["title"],
+                        topic=request_data["topic"],
+                        section_title=section_title,
+                        section_points=section["content"],
+                        document_type=request_data["document_type"],
+                        page_limit=request_data["page_limit"],
+                        use_cache=use_cache,
+                        outline=outline
+                    )) as events:
+                        async for event in events:
+                            if event["type"] == "delta":
+                                yield _sse_event("delta", {"index": index, "text": event["text"]})
+                            elif event["type"] == "reset":
+                                yield _sse_event("section_reset", {"index": index})
+                            else:
+                                content_dict[section_title] = event["content"]
+                                if not event.get("fallback"):
+                                    section_contents[fingerprint] = event["content"]
+                                yield _sse_event("section_end", {"index": index, "title": section_title, "content": event["content"]})
+                    
+                    progress_bus.publish(
+                        request_id,
+                        SECTION_COMPLETED,
+                        progress=int(100 * (index + 1) / max(total_sections, 1)),
+                        section=section_title
+                    )
+                
+                # 保存生成结果
+                await document_requests.apatch(request_id, {
+                    "content": content_dict,
+                    "section_contents": section_contents,
+                    "needs_content_update": False
+                })
+                
+                progress_bus.publish(request_id, COMPLETED, progress=100, stage="completed", message="内容生成完成！")
+                completed = True
+                yield _sse_event("done", {"request_id": request_id, "content": content_dict})
+            finally:
+                if not completed:
+                    await _keep_finished_sections(request_id, section_contents, generation.reason or CLIENT_DISCONNECTED)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 后台任务：提交后立即返回202和任务ID，由有界的工作协程池在后台生成
+async def _run_document_workflow_job(request_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    return await document_workflow(DocumentRequest(**{**params, "request_id": request_id}))
+
+async def _run_regenerate_content_job(request_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    if not await document_requests.acontains(request_id):
+        raise ValueError("请求ID不存在")
+    return await regenerate_content(request_id, **params)
+
+job_manager.register("document_workflow", _run_document_workflow_job)
+job_manager.register("regenerate_content", _run_regenerate_content_job)
+
+async def _job_accepted(kind: str, request_id: str, params: Dict[str, Any]) -> JSONResponse:
+    """提交任务，返回202及查询状态、订阅进度的地址；队列已满时返回503"""
+    try:
+        job = await job_manager.submit(kind, request_id, params)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return JSONResponse(status_code=202, content={
+        "job_id": job["job_id"],
+        "request_id": request_id,
+        "status": job["status"],
+        "status_url": f"/api/jobs/{job['job_id']}",
+        "events_url": f"/api/jobs/{job['job_id']}/events",
+        "progress_url": f"/api/generation-progress/{request_id}/events"
+    }, headers={"Location": f"/api/jobs/{job['job_id']}"})
+
+@router.post("/jobs/document-workflow", status_code=202)
+async def submit_document_workflow_job(request: DocumentRequest):
+    """以后台任务运行完整工作流，结果与/document-workflow的响应相同"""
+    request_id = request.request_id or str(uuid.uuid4())
+    logger.info(f"收到文档工作流任务: 主题={request.topic}, 请求ID: {request_id}")
+    return await _job_accepted("document_workflow", request_id, {**request.dict(), "request_id": request_id})
+
+@router.post("/jobs/regenerate-content/{request_id}", status_code=202)
+async def submit_regenerate_content_job(request_id: str, options: Optional[RegenerateContentJobRequest] = None):
+    """以后台任务重新生成内容，结果与/regenerate-content的响应相同"""
+    if not await document_requests.acontains(request_id):
+        raise HTTPException(status_code=404, detail="请求ID不存在")
+    return await _job_accepted("regenerate_content", request_id, (options or RegenerateContentJobRequest()).dict())
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态；执行中的任务附带进度快照，结束的任务附带结果"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    progress = await progress_bus.load_snapshot(job["request_id"]) if job["status"] == RUNNING else None
+    if progress is not None:
+        job["progress"] = dict(progress)
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """以SSE推送任务状态变化（job事件），任务结束后推送包含结果的最后一条事件并关闭"""
+    if await job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    async def event_stream():
+        async for job in job_manager.watch(job_id, keepalive=15.0):
+            if await request.is_disconnected():
+                break
+            if job is None:
+                yield ": keepalive\n\n"
+                continue
+            yield _sse_event("job", job)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消任务：排队中的任务不再执行，执行中的任务停止生成并保留已完成的章节"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if not await job_manager.cancel(job_id):
+        return {"success": False, "job_id": job_id, "status": job["status"], "message": "任务已结束，无法取消"}
+    return {"success": True, "job_id": job_id, "message": "已取消任务"}
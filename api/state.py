@@ -5,50 +5,512 @@ This module holds shared variables to avoid circular imports between routes.py a
 
 import os
 import json
+import time
+import random
+import asyncio
+import sqlite3
 import threading
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 # File for persistence
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 os.makedirs(DATA_DIR, exist_ok=True)
 REQUESTS_FILE = os.path.join(DATA_DIR, "requests.json")
+JOBS_FILE = os.path.join(DATA_DIR, "jobs.json")
+
+# Where shared state lives: "file" keeps it in this process (requests and jobs are persisted to data/*.json),
+# "sqlite" shares it between worker processes (uvicorn --workers N) through one SQLite database in WAL mode
+STATE_BACKEND = os.getenv("STATE_BACKEND", "file").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(DATA_DIR, "state.sqlite3"))
 
 # Lock for thread-safe file operations
 file_lock = threading.Lock()
 
-# Dictionary to track generation progress for different requests
-generation_progress = {}
-
-# Load saved requests if file exists
-try:
-    with file_lock:
-        if os.path.exists(REQUESTS_FILE):
-            with open(REQUESTS_FILE, 'r') as f:
-                document_requests = json.load(f)
-        else:
-            document_requests = {}
-except Exception as e:
-    print(f"Error loading requests data: {e}")
-    document_requests = {}
-
-# Function to save document_requests to file
-def save_requests():
+# Returned by an update_item() updater to delete the entry
+REMOVE = object()
+
+def _load_json(path: str) -> Dict[str, Any]:
     try:
         with file_lock:
-            with open(REQUESTS_FILE, 'w') as f:
-                json.dump(document_requests, f)
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    return json.load(f)
     except Exception as e:
-        print(f"Error saving requests data: {e}")
+        print(f"Error loading {os.path.basename(path)}: {e}")
+    return {}
+
+class StateDict(dict):
+    """In-process state with the same atomic update interface as SharedDict"""
+
+    shared = False
+
+    def update_item(self, key: str, updater: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        """Replace the value of key with updater(current value, or None if missing) and return the stored value
+
+        The updater returns the new value, None to leave the entry unchanged, or REMOVE to delete it.
+        It must not modify the value it is given in place.
+        """
+        value = updater(self.get(key))
+        if value is REMOVE:
+            if key in self:
+                del self[key]
+            return None
+        if value is not None:
+            self[key] = value
+        return self.get(key)
+
+    def patch(self, key: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge fields into the record stored under key and return it; returns None if there is no such record"""
+        return self.update_item(key, lambda current: {**current, **fields} if current is not None else None)
+
+    # Async interface shared with SharedDict. In-process state is used directly on the event loop,
+    # which also keeps update_item() atomic with respect to other coroutines.
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return self.get(key, default)
+
+    async def aset(self, key: str, value: Any) -> None:
+        self[key] = value
+
+    async def acontains(self, key: str) -> bool:
+        return key in self
+
+    async def aitems(self) -> List[Tuple[str, Any]]:
+        return list(self.items())
+
+    async def aupdate_item(self, key: str, updater: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        return self.update_item(key, updater)
+
+    async def apatch(self, key: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.patch(key, fields)
 
 # Update document_requests dictionary with persistence
-class PersistentDict(dict):
+class PersistentDict(StateDict):
+    def __init__(self, *args, path: str = REQUESTS_FILE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+    
+    def save(self):
+        try:
+            with file_lock:
+                with open(self.path, 'w') as f:
+                    json.dump(self, f)
+        except Exception as e:
+            print(f"Error saving {os.path.basename(self.path)}: {e}")
+    
     def __setitem__(self, key, value):
         super().__setitem__(key, value)
-        save_requests()
+        self.save()
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.save()
     
     def update(self, *args, **kwargs):
         super().update(*args, **kwargs)
-        save_requests()
+        self.save()
+
+class SQLiteStateStore:
+    """Key-value state shared by all worker processes through one SQLite database (WAL mode)
+
+    Values are stored as JSON, grouped by namespace. update() reads, modifies and writes inside a
+    BEGIN IMMEDIATE transaction, so concurrent updates of the same key from different processes run one after another.
+    Transactions are short, so the busy timeout is short too: when another process holds the lock the
+    operation backs off and retries. All calls block, so async code goes through SharedDict's async methods,
+    which run them in a worker thread.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH, busy_timeout: float = 0.2, max_retries: int = 5,
+                 indexed_fields: Tuple[str, ...] = ("status", "request_id")):
+        """
+        Args:
+            path: database file
+            busy_timeout: seconds to wait for another process to release the lock on each attempt
+            max_retries: retries while the database is still locked
+            indexed_fields: top-level value fields to index, so find() on them does not scan the namespace
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.max_retries = max_retries
+        self.indexed_fields = indexed_fields
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use, one connection per process (caller holds the lock)"""
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # isolation_level=None: autocommit, update() opens its transaction explicitly
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                                   isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS state ("
+                    "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                    "updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+                )
+                for field in self.indexed_fields:
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS state_{field} ON state (namespace, {self._field_expr(field)})"
+                    )
+            except sqlite3.Error:
+                # Locked during setup: close the connection and set up again on retry
+                conn.close()
+                raise
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _retry(self, operation: Callable[[], Any]) -> Any:
+        """Run a database operation, backing off and retrying while another process holds the lock (without holding our lock)"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                if attempt == self.max_retries or "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                self.retries += 1
+                time.sleep(min(0.5, 0.01 * 2 ** attempt) * (0.5 + random.random()))
+
+    def _execute(self, sql: str, params: tuple = (), fetch: bool = True) -> Any:
+        """Run one statement and return all rows (the row count when fetch is False)"""
+        def run() -> Any:
+            with self._lock:
+                cursor = self._connect().execute(sql, params)
+                return cursor.fetchall() if fetch else cursor.rowcount
+
+        return self._retry(run)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        rows = self._execute("SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+        return json.loads(rows[0][0]) if rows else None
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), time.time()),
+            fetch=False
+        )
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self._execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key), fetch=False) > 0
+
+    def keys(self, namespace: str) -> List[str]:
+        return [row[0] for row in self._execute("SELECT key FROM state WHERE namespace = ?", (namespace,))]
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        rows = self._execute("SELECT key, value FROM state WHERE namespace = ?", (namespace,))
+        return [(key, json.loads(value)) for key, value in rows]
+
+    @staticmethod
+    def _field_expr(field: str) -> str:
+        """SQL expression for a top-level value field (must match the index expression exactly for the index to be used)"""
+        if not field.isidentifier():
+            raise ValueError(f"Invalid field name: {field}")
+        return f"json_extract(value, '$.{field}')"
+
+    def find(self, namespace: str, field: str, value: Any) -> List[Tuple[str, Any]]:
+        """Entries whose top-level field equals value; uses an index when field is in indexed_fields"""
+        rows = self._execute(
+            f"SELECT key, value FROM state WHERE namespace = ? AND {self._field_expr(field)} = ?",
+            (namespace, value)
+        )
+        return [(key, json.loads(item)) for key, item in rows]
+
+    def count(self, namespace: str) -> int:
+        return self._execute("SELECT COUNT(*) FROM state WHERE namespace = ?", (namespace,))[0][0]
+
+    def update(self, namespace: str, key: str, updater: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        """Atomic read-modify-write, see StateDict.update_item"""
+        return self._retry(lambda: self._update(namespace, key, updater))
+
+    def _update(self, namespace: str, key: str, updater: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchall()
+                current = json.loads(rows[0][0]) if rows else None
+                value = updater(current)
+                if value is REMOVE:
+                    conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+                    value = None
+                elif value is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                        (namespace, key, json.dumps(value, ensure_ascii=False), time.time())
+                    )
+                else:
+                    value = current
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return value
+
+class SharedDict(MutableMapping):
+    """One namespace of a SQLiteStateStore, used like a dict
+
+    Every read returns a fresh copy: changing a nested value is not written back, use patch() / update_item()
+    (or assign the whole value) instead.
+    """
+
+    shared = True
+
+    def __init__(self, store: SQLiteStateStore, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.store.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if not self.store.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.store.get(self.namespace, key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.namespace))
+
+    def __len__(self) -> int:
+        return self.store.count(self.namespace)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.store.get(self.namespace, key)
+        return default if value is None else value
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return self.store.items(self.namespace)
+
+    def values(self) -> List[Any]:
+        return [value for _, value in self.store.items(self.namespace)]
+
+    def find(self, field: str, value: Any) -> List[Any]:
+        """All values whose top-level field equals value (see SQLiteStateStore.find)"""
+        return [item for _, item in self.store.find(self.namespace, field, value)]
+
+    def update_item(self, key: str, updater: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        return self.store.update(self.namespace, key, updater)
+
+    def patch(self, key: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.update_item(key, lambda current: {**current, **fields} if current is not None else None)
+
+    # Async interface: every call runs in a worker thread, so waiting for the database lock
+    # (including the retry backoff) never blocks the event loop
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def aset(self, key: str, value: Any) -> None:
+        await asyncio.to_thread(self.__setitem__, key, value)
+
+    async def acontains(self, key: str) -> bool:
+        return await asyncio.to_thread(self.__contains__, key)
+
+    async def aitems(self) -> List[Tuple[str, Any]]:
+        return await asyncio.to_thread(self.items)
+
+    async def afind(self, field: str, value: Any) -> List[Any]:
+        return await asyncio.to_thread(self.find, field, value)
+
+    async def aupdate_item(self, key: str, updater: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        return await asyncio.to_thread(self.update_item, key, updater)
+
+    async def apatch(self, key: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.patch, key, fields)
+
+if STATE_BACKEND == "sqlite":
+    state_store = SQLiteStateStore(STATE_DB_PATH)
+    generation_progress = SharedDict(state_store, "generation_progress")
+    document_requests = SharedDict(state_store, "document_requests")
+    document_jobs = SharedDict(state_store, "document_jobs")
+    # Coordination between processes: which process runs each generation, pending cancel requests, recent progress events
+    running_generations: Optional[SharedDict] = SharedDict(state_store, "running_generations")
+    cancel_requests: Optional[SharedDict] = SharedDict(state_store, "cancel_requests")
+    progress_events: Optional[SharedDict] = SharedDict(state_store, "progress_events")
+
+    # Import data saved by the file backend once; entries already in the database win
+    for _mapping, _path in ((document_requests, REQUESTS_FILE), (document_jobs, JOBS_FILE)):
+        for _key, _value in _load_json(_path).items():
+            _mapping.update_item(_key, lambda current, value=_value: value if current is None else None)
+elif STATE_BACKEND == "file":
+    state_store = None
+    # Dictionary to track generation progress for different requests
+    generation_progress = StateDict()
+    document_requests = PersistentDict(_load_json(REQUESTS_FILE))
+    # Background generation jobs (see api/jobs.py), persisted alongside the requests they generate
+    document_jobs = PersistentDict(_load_json(JOBS_FILE), path=JOBS_FILE)
+    # A single process needs no cross-process coordination
+    running_generations = None
+    cancel_requests = None
+    progress_events = None
+else:
+    raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND} (expected 'file' or 'sqlite')")
+
+# Persistent checkpoints of generation runs, so an interrupted workflow can continue after a restart
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(DATA_DIR, "checkpoints.sqlite3"))
+
+class CheckpointStore:
+    """Checkpoints stored per request_id (SQLite)
+
+    Three kinds of records are kept for each request:
+    - runs: the generation run (document_workflow / regenerate_content) with its parameters and status
+    - node_checkpoints: the workflow state after each node
+    - section_checkpoints: the content of each finished section, keyed by section fingerprint
+
+    All methods block; async code calls them through asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH, ttl: float = 7 * 24 * 3600, enabled: bool = True):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @classmethod
+    def from_env(cls) -> "CheckpointStore":
+        return cls(
+            path=CHECKPOINT_PATH,
+            ttl=float(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600))),
+            enabled=os.getenv("CHECKPOINT_ENABLED", "true").lower() in ("1", "true", "yes")
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use (caller holds the lock)"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "request_id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, "
+                "status TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS node_checkpoints ("
+                "request_id TEXT NOT NULL, node TEXT NOT NULL, state TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (request_id, node))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS section_checkpoints ("
+                "request_id TEXT NOT NULL, fingerprint TEXT NOT NULL, section_title TEXT NOT NULL, "
+                "content TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (request_id, fingerprint))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+
+    def start_run(self, request_id: str, kind: str, params: Dict[str, Any]) -> None:
+        """Record a run in progress; if the process exits before it finishes, it is resumed on startup"""
+        if not self.enabled or not request_id:
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO runs (request_id, kind, params, status, updated_at) VALUES (?, ?, ?, 'running', ?)",
+            (request_id, kind, json.dumps(params, ensure_ascii=False), time.time())
+        )
+
+    def finish_run(self, request_id: str) -> None:
+        """The run's result is saved in document_requests, so its checkpoints are no longer needed"""
+        if not self.enabled or not request_id:
+            return
+        self.clear(request_id)
+
+    def interrupted_runs(self) -> List[Dict[str, Any]]:
+        """Runs that were still in progress when the process exited"""
+        if not self.enabled:
+            return []
+        rows = self._execute("SELECT request_id, kind, params FROM runs WHERE status = 'running' ORDER BY updated_at")
+        return [{"request_id": row[0], "kind": row[1], "params": json.loads(row[2])} for row in rows]
+
+    def save_node(self, request_id: Optional[str], node: str, state: Dict[str, Any]) -> None:
+        """Save the workflow state after a node finishes"""
+        if not self.enabled or not request_id:
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO node_checkpoints (request_id, node, state, updated_at) VALUES (?, ?, ?, ?)",
+            (request_id, node, json.dumps(state, ensure_ascii=False, default=str), time.time())
+        )
+
+    def load_state(self, request_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The request's latest node checkpoint"""
+        if not self.enabled or not request_id:
+            return None
+        rows = self._execute(
+            "SELECT state FROM node_checkpoints WHERE request_id = ? ORDER BY updated_at DESC LIMIT 1",
+            (request_id,)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_section(self, request_id: Optional[str], fingerprint: str, section_title: str, content: str) -> None:
+        """Save a finished section"""
+        if not self.enabled or not request_id:
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO section_checkpoints (request_id, fingerprint, section_title, content, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (request_id, fingerprint, section_title, content, time.time())
+        )
+
+    def load_sections(self, request_id: Optional[str]) -> Dict[str, str]:
+        """The request's finished sections as {fingerprint: content}"""
+        if not self.enabled or not request_id:
+            return {}
+        rows = self._execute("SELECT fingerprint, content FROM section_checkpoints WHERE request_id = ?", (request_id,))
+        return {fingerprint: content for fingerprint, content in rows}
+
+    def clear_sections(self, request_id: Optional[str]) -> None:
+        """Delete the request's section checkpoints so a non-incremental regeneration does not reuse them"""
+        if not self.enabled or not request_id:
+            return
+        self._execute("DELETE FROM section_checkpoints WHERE request_id = ?", (request_id,))
+
+    def clear(self, request_id: str) -> None:
+        """Delete all of the request's checkpoints"""
+        with self._lock:
+            conn = self._connect()
+            for table in ("runs", "node_checkpoints", "section_checkpoints"):
+                conn.execute(f"DELETE FROM {table} WHERE request_id = ?", (request_id,))
+            conn.commit()
+
+    def prune(self) -> int:
+        """Delete checkpoints older than the TTL and return the number of rows removed"""
+        if not self.enabled or self.ttl <= 0:
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        with self._lock:
+            conn = self._connect()
+            for table in ("runs", "node_checkpoints", "section_checkpoints"):
+                removed += conn.execute(f"DELETE FROM {table} WHERE updated_at < ?", (cutoff,)).rowcount
+            conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        counts = {
+            table: self._execute(f"SELECT COUNT(*) FROM {table}")[0][0]
+            for table in ("runs", "node_checkpoints", "section_checkpoints")
+        }
+        return {"enabled": True, "path": self.path, **counts}
 
-# Replace the standard dict with our persistent version
-if not isinstance(document_requests, PersistentDict):
-    document_requests = PersistentDict(document_requests) 
\ No newline at end of file
+checkpoint_store = CheckpointStore.from_env()
@@ -1,15 +1,46 @@
 import os
+import asyncio
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
+from contextlib import asynccontextmanager
 import uvicorn
 
-from api.routes import router as api_router
+from api.routes import router as api_router, resume_interrupted_runs
+from api.langgraph_impl import deepseek_client, warm_up
+from api.state import checkpoint_store
+from api.jobs import job_manager
+from api.progress import progress_bus
+from utils.render_pool import render_pool
 
-app = FastAPI(title="AI文档生成平台")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时预热工作流组件、打开LLM连接池、启动文档渲染进程池和后台任务池并恢复中断的生成任务，关闭时释放"""
+    warm_up()
+    await deepseek_client.start()
+    await asyncio.to_thread(checkpoint_store.prune)
+    await render_pool.start()
+    # 先让未完成的后台任务重新排队，它们的运行不再由resume_interrupted_runs重复恢复
+    await job_manager.start()
+    resume_task = None
+    if os.getenv("CHECKPOINT_RESUME_ON_STARTUP", "true").lower() in ("1", "true", "yes"):
+        resume_task = asyncio.create_task(resume_interrupted_runs())
+    try:
+        yield
+    finally:
+        # 未完成的任务保留检查点，下次启动时继续
+        if resume_task is not None and not resume_task.done():
+            resume_task.cancel()
+        await job_manager.stop()
+        # 写入尚未同步到共享状态的进度
+        await progress_bus.flush()
+        render_pool.shutdown()
+        await deepseek_client.aclose()
+
+app = FastAPI(title="AI文档生成平台", lifespan=lifespan)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -0,0 +1,57 @@
+"""
+测试公共配置。
+异步用例通过anyio插件在asyncio上运行；DeepSeekClient使用httpx.MockTransport模拟上游，不访问网络。
+"""
+
+import os
+from typing import Callable
+
+import httpx
+import pytest
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+@pytest.fixture
+def make_client(monkeypatch) -> Callable[..., "DeepSeekClient"]:
+    """创建使用模拟上游、独立限流器和熔断器的DeepSeekClient
+
+    用法:
+        client = make_client(lambda request: httpx.Response(200, json={...}))
+    """
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "test-key")
+    monkeypatch.setenv("DEEPSEEK_API_URL", "http://upstream.test")
+    monkeypatch.delenv("DEEPSEEK_ENDPOINTS", raising=False)
+    monkeypatch.setenv("LLM_CACHE_ENABLED", "false")
+    monkeypatch.setenv("API_MAX_RETRIES", "1")
+    monkeypatch.setenv("API_RETRY_DELAY", "0")
+
+    from utils.deepseek_client import DeepSeekClient
+    from utils.circuit_breaker import CircuitBreaker
+    from utils.llm_limiter import AdaptiveConcurrencyLimiter
+
+    def factory(handler: Callable[[httpx.Request], httpx.Response], **env: str) -> DeepSeekClient:
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        client = DeepSeekClient()
+        client._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client.limiter = AdaptiveConcurrencyLimiter()
+        client.breaker = CircuitBreaker()
+        return client
+
+    return factory
+
+def completion(content: str) -> dict:
+    """chat/completions的成功响应体"""
+    return {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": {"prompt_tokens": 1}}
+
+@pytest.fixture
+def checkpoints(tmp_path, monkeypatch) -> "CheckpointStore":
+    """使用临时数据库的检查点存储，替换工作流模块中的全局实例"""
+    from api.state import CheckpointStore
+    import api.langgraph_impl
+
+    store = CheckpointStore(path=str(tmp_path / "checkpoints.sqlite3"))
+    monkeypatch.setattr(api.langgraph_impl, "checkpoint_store", store)
+    return store
@@ -0,0 +1,124 @@
+"""生成任务的取消"""
+
+import os
+import asyncio
+
+import pytest
+
+from api.cancellation import (
+    GenerationRegistry, GenerationCancelled, CANCELLED_BY_USER, CLIENT_DISCONNECTED, SUPERSEDED
+)
+from api.state import StateDict
+
+async def slow(result="完成", delay=10.0):
+    await asyncio.sleep(delay)
+    return result
+
+@pytest.mark.anyio
+async def test_run_returns_result_and_forgets_request():
+    registry = GenerationRegistry()
+
+    assert await registry.run("req", slow(delay=0)) == "完成"
+    assert not await registry.is_running("req")
+    assert not await registry.cancel("req")
+
+@pytest.mark.anyio
+async def test_cancel_stops_generation_with_reason():
+    registry = GenerationRegistry()
+    run = asyncio.ensure_future(registry.run("req", slow()))
+    await asyncio.sleep(0)
+
+    assert await registry.is_running("req")
+    assert await registry.cancel("req")
+    with pytest.raises(GenerationCancelled) as cancelled:
+        await run
+
+    assert cancelled.value.reason == CANCELLED_BY_USER
+    assert registry.stats() == {"running": [], "cancelled": {CANCELLED_BY_USER: 1}}
+
+@pytest.mark.anyio
+async def test_new_generation_supersedes_running_one():
+    registry = GenerationRegistry()
+    first = asyncio.ensure_future(registry.run("req", slow("旧")))
+    await asyncio.sleep(0)
+
+    second = await registry.run("req", slow("新", delay=0))
+
+    with pytest.raises(GenerationCancelled) as cancelled:
+        await first
+    assert cancelled.value.reason == SUPERSEDED
+    assert second == "新"
+    assert not await registry.is_running("req")
+
+@pytest.mark.anyio
+async def test_caller_cancellation_propagates_unchanged():
+    registry = GenerationRegistry()
+    run = asyncio.ensure_future(registry.run("req", slow()))
+    await asyncio.sleep(0)
+
+    run.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+    assert not await registry.is_running("req")
+
+@pytest.mark.anyio
+async def test_client_disconnect_cancels_generation():
+    class Disconnected:
+        async def is_disconnected(self):
+            return True
+
+    registry = GenerationRegistry(disconnect_poll=0.01)
+
+    with pytest.raises(GenerationCancelled) as cancelled:
+        await registry.run("req", slow(), request=Disconnected())
+    assert cancelled.value.reason == CLIENT_DISCONNECTED
+
+@pytest.mark.anyio
+async def test_track_cancels_current_task():
+    registry = GenerationRegistry()
+
+    async def stream():
+        async with registry.track("req") as generation:
+            try:
+                await slow()
+            except asyncio.CancelledError:
+                return generation.reason
+
+    task = asyncio.ensure_future(stream())
+    await asyncio.sleep(0)
+    assert await registry.cancel("req")
+
+    assert await task == CANCELLED_BY_USER
+    assert not await registry.is_running("req")
+
+@pytest.mark.anyio
+async def test_cancel_reaches_generation_in_another_process():
+    running, cancels = StateDict(), StateDict()
+    local = GenerationRegistry(disconnect_poll=0.01, shared_running=running, shared_cancels=cancels)
+    run = asyncio.ensure_future(local.run("req", slow()))
+    await asyncio.sleep(0)
+    token = running["req"]["token"]
+
+    # 另一个进程的登记表：本进程的生成对它而言在其他存活进程中
+    remote = GenerationRegistry(shared_running=running, shared_cancels=cancels)
+    running["req"] = {**running["req"], "pid": os.getppid()}
+    assert await remote.is_running("req")
+    assert await remote.cancel("req")
+    assert cancels["req"]["token"] == token
+
+    with pytest.raises(GenerationCancelled) as cancelled:
+        await run
+    assert cancelled.value.reason == CANCELLED_BY_USER
+    assert "req" not in cancels and "req" not in running
+
+@pytest.mark.anyio
+async def test_claim_skips_generation_owned_by_live_process():
+    running = StateDict()
+    registry = GenerationRegistry(shared_running=running, shared_cancels=StateDict())
+
+    running["live"] = {"pid": os.getppid(), "token": "t", "started_at": 0}
+    running["dead"] = {"pid": 2 ** 22 + 1, "token": "t", "started_at": 0}
+
+    assert not await registry.claim("live")
+    assert await registry.claim("dead") and running["dead"]["pid"] == os.getpid()
+    assert await registry.claim("new")
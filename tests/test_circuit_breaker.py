@@ -0,0 +1,97 @@
+"""熔断器的状态转换"""
+
+import time
+
+import pytest
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+def fail(breaker: CircuitBreaker, status_code: int = 500) -> None:
+    with breaker.call() as call:
+        call.record(status_code)
+
+def succeed(breaker: CircuitBreaker) -> None:
+    with breaker.call() as call:
+        call.record(200)
+
+def test_opens_when_failure_rate_reached_after_min_calls():
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4)
+    fail(breaker)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED  # 调用数不足min_calls
+
+    succeed(breaker)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 1
+
+def test_open_breaker_rejects_calls():
+    breaker = CircuitBreaker(min_calls=1, open_seconds=60)
+    fail(breaker)
+
+    with pytest.raises(CircuitOpenError):
+        succeed(breaker)
+    assert breaker.rejected == 1
+    assert breaker.is_open
+
+def test_throttling_and_client_errors_are_not_failures():
+    breaker = CircuitBreaker(min_calls=2)
+    for status_code in (429, 400, 404):
+        fail(breaker, status_code)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+def test_exceptions_count_as_failures():
+    breaker = CircuitBreaker(min_calls=1)
+    with pytest.raises(TimeoutError):
+        with breaker.call():
+            raise TimeoutError()
+    assert breaker.state == OPEN
+
+def test_half_open_probe_success_closes(monkeypatch):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=10, half_open_calls=1)
+    fail(breaker)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+
+    assert breaker.state == HALF_OPEN
+    succeed(breaker)
+    assert breaker.state == CLOSED
+
+def test_half_open_limits_probes_and_failure_reopens(monkeypatch):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=10, half_open_calls=1)
+    fail(breaker)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+
+    probe = breaker.call().__enter__()
+    with pytest.raises(CircuitOpenError):
+        succeed(breaker)  # 探测名额已被占用
+
+    probe.record(502)
+    probe.__exit__(None, None, None)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+def test_cancelled_call_is_ignored():
+    import asyncio
+
+    breaker = CircuitBreaker(min_calls=1)
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.call():
+            raise asyncio.CancelledError()
+    assert breaker.state == CLOSED
+
+def test_disabled_breaker_always_allows():
+    breaker = CircuitBreaker(min_calls=1, enabled=False)
+    fail(breaker)
+    fail(breaker)
+    assert not breaker.is_open
+    succeed(breaker)
+
+def test_reset_closes_and_clears_window():
+    breaker = CircuitBreaker(min_calls=1)
+    fail(breaker)
+    breaker.reset()
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
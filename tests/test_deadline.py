@@ -0,0 +1,67 @@
+"""截止时间与章节降级"""
+
+import pytest
+
+from api.langgraph_impl import generate_section_content, section_degradation, section_fingerprint
+from utils.deadline import Deadline, deadline_scope, NO_EXPANSION, SHORT_OUTPUT, OFFLINE, TIMED_OUT
+
+def test_degrade_keeps_most_severe_strategy():
+    deadline = Deadline(60)
+
+    deadline.degrade("a", SHORT_OUTPUT)
+    deadline.degrade("a", NO_EXPANSION)
+    deadline.degrade("b", NO_EXPANSION)
+    deadline.degrade("b", TIMED_OUT)
+
+    assert deadline.degraded == {"a": SHORT_OUTPUT, "b": TIMED_OUT}
+
+@pytest.mark.anyio
+async def test_degradation_is_keyed_by_section_fingerprint():
+    # 两个同名章节：只有实际降级生成的那个被记录
+    overview = {"title": "概述", "content": ["背景"]}
+    other_overview = {"title": "概述", "content": ["结论"]}
+
+    with deadline_scope(1) as deadline:
+        content = await generate_section_content("标题", "主题", overview["title"], overview["content"], "word")
+        degraded = section_degradation(section_fingerprint("标题", "主题", "概述", overview["content"], "word"))
+        other = section_degradation(section_fingerprint("标题", "主题", "概述", other_overview["content"], "word"))
+
+    assert content
+    assert degraded == OFFLINE
+    assert other is None
+    assert "概述" not in deadline.degraded
+
+@pytest.mark.anyio
+async def test_collected_degraded_sections_are_reported_by_title():
+    from api.langgraph_impl import collect_content_node
+
+    outline = [{"title": "概述", "content": ["背景"]}, {"title": "概述", "content": ["结论"]}]
+    state = {
+        "outline": outline,
+        "section_fingerprints": ["fp0", "fp1"],
+        "section_results": {
+            0: {"content": "离线内容", "ok": True, "reused": False, "degraded": OFFLINE},
+            1: {"content": "完整内容", "ok": True, "reused": False, "degraded": None}
+        }
+    }
+
+    result = await collect_content_node(state)
+
+    assert result["degraded_sections"] == [{"section": "概述", "strategy": OFFLINE}]
+    assert result["section_contents"] == {"fp1": "完整内容"}
+
+@pytest.mark.anyio
+async def test_chapter_plan_records_applied_strategy():
+    from api.langgraph_impl import plan_chapter_node
+
+    section = {"title": "概述", "content": ["背景"]}
+    task = {
+        "index": 0, "total": 1, "fingerprint": "fp", "section": section, "title": "标题", "topic": "主题",
+        "document_type": "word", "page_limit": 5, "outline": [section], "request_id": None
+    }
+
+    with deadline_scope(1) as deadline:
+        result = await plan_chapter_node(task)
+
+    assert result["chapter_plans"][0]["subsections"]
+    assert deadline.degraded == {"fp": OFFLINE}
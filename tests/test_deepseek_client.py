@@ -0,0 +1,114 @@
+"""DeepSeekClient的端点路由、失败处理和对冲请求"""
+
+import httpx
+import pytest
+
+from tests.conftest import completion
+from utils.llm_router import EndpointRouter
+
+MESSAGES = [{"role": "user", "content": "写一段介绍"}]
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("body", [b"{not json", b'{"choices": []}', b'{"choices": "oops"}'])
+async def test_malformed_success_body_counts_as_endpoint_failure(make_client, body):
+    client = make_client(lambda request: httpx.Response(200, content=body))
+    endpoint = client.router.endpoints[0]
+
+    result = await client._attempt(endpoint, client._build_payload(MESSAGES, 100))
+
+    assert result == {"status_code": None, "content": None}
+    assert endpoint.failures == 1
+    assert endpoint.successes == 0
+
+@pytest.mark.anyio
+async def test_chat_falls_back_offline_on_malformed_body(make_client):
+    client = make_client(lambda request: httpx.Response(200, content=b'{"truncated": '))
+
+    content = await client.chat(MESSAGES, use_cache=False)
+
+    assert content
+    assert client.router.endpoints[0].failures >= 1
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("error", [
+    httpx.RemoteProtocolError("connection reset"),
+    httpx.ReadError("read failed"),
+    httpx.WriteTimeout("write timed out"),
+    httpx.PoolTimeout("pool exhausted"),
+])
+async def test_transport_errors_are_retryable_endpoint_failures(make_client, error):
+    def handler(request):
+        raise error
+
+    client = make_client(handler)
+    endpoint = client.router.endpoints[0]
+
+    result = await client._attempt(endpoint, client._build_payload(MESSAGES, 100))
+
+    assert result == {"status_code": None, "content": None}
+    assert not result.get("fatal")
+    assert endpoint.failures == 1
+
+@pytest.mark.anyio
+async def test_transport_errors_eject_endpoint_and_route_to_the_other(make_client):
+    def handler(request):
+        if request.url.host == "bad.test":
+            raise httpx.RemoteProtocolError("stream reset")
+        return httpx.Response(200, json=completion("来自备用端点"))
+
+    client = make_client(handler, DEEPSEEK_ENDPOINTS="http://bad.test|k1,http://good.test|k2",
+                         LLM_EJECT_AFTER_FAILURES="1", API_MAX_RETRIES="3")
+    bad, good = client.router.endpoints
+    # 让故障端点先被选中
+    bad.ewma_latency, good.ewma_latency = 0.1, 1.0
+
+    content = await client.chat(MESSAGES, use_cache=False)
+
+    assert content == "来自备用端点"
+    assert bad.ejections == 1
+    assert not bad.is_healthy()
+
+def test_hedge_min_samples_read_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "3")
+    monkeypatch.setenv("DEEPSEEK_ENDPOINTS", "http://a.test|k1,http://b.test|k2")
+    router = EndpointRouter.from_env("http://unused.test", None)
+    primary = router.endpoints[0]
+
+    assert router.hedge_min_samples == 3
+    assert router.hedge_delay(primary) == router.hedge_default_delay
+    for latency in (0.7, 0.8, 0.9):
+        router.record_success(primary, latency)
+    assert router.hedge_delay(primary) == pytest.approx(0.9)
+
+@pytest.mark.anyio
+async def test_hedged_request_uses_faster_backup(make_client):
+    import asyncio
+
+    async def slow_then_fast(request):
+        if request.url.host == "slow.test":
+            await asyncio.sleep(2)
+            return httpx.Response(200, json=completion("慢"))
+        return httpx.Response(200, json=completion("快"))
+
+    client = make_client(slow_then_fast, DEEPSEEK_ENDPOINTS="http://slow.test|k1,http://fast.test|k2",
+                         LLM_HEDGE_ENABLED="true", LLM_HEDGE_MIN_DELAY="0.05", LLM_HEDGE_DEFAULT_DELAY="0.05")
+    slow, fast = client.router.endpoints
+    slow.ewma_latency, fast.ewma_latency = 0.1, 1.0
+
+    result = await client._hedged_attempt(client._build_payload(MESSAGES, 100))
+
+    assert result["content"] == "快"
+    assert client.router.hedges_sent == 1
+    assert client.router.hedges_won == 1
+
+@pytest.mark.anyio
+async def test_stream_without_endpoint_falls_back_offline(make_client):
+    requests = []
+    client = make_client(lambda request: requests.append(request) or httpx.Response(200))
+    client.router.endpoints[0].api_key = ""
+
+    chunks = [chunk async for chunk in client.stream_chat(MESSAGES, use_cache=False)]
+
+    assert len(chunks) == 1 and chunks[0]
+    assert requests == []
@@ -0,0 +1,202 @@
+"""按章节指纹的增量复用"""
+
+import pytest
+
+from api.langgraph_impl import prepare_content_node, section_fingerprint
+
+OUTLINE = [
+    {"title": "背景", "content": ["现状", "问题"]},
+    {"title": "方案", "content": ["架构", "实现"]},
+    {"title": "总结", "content": ["结论"]}
+]
+
+def make_state(outline, **fields):
+    return {
+        "title": "标题",
+        "topic": "主题",
+        "document_type": "word",
+        "page_limit": 5,
+        "outline": outline,
+        "request_id": None,
+        **fields
+    }
+
+def fingerprint(section, **overrides):
+    args = {"title": "标题", "topic": "主题", "document_type": "word", **overrides}
+    return section_fingerprint(args["title"], args["topic"], section["title"], section["content"], args["document_type"])
+
+def test_fingerprint_depends_on_section_inputs():
+    section = OUTLINE[0]
+    assert fingerprint(section) == fingerprint(dict(section))
+    assert fingerprint(section) == fingerprint(section, document_type="WORD")
+    assert fingerprint(section) != fingerprint(section, title="新标题")
+    assert fingerprint(section) != fingerprint(section, topic="新主题")
+    assert fingerprint(section) != fingerprint({**section, "content": ["现状"]})
+    assert fingerprint(section) != fingerprint({**section, "title": "研究背景"})
+
+@pytest.mark.anyio
+async def test_unchanged_sections_are_reused(checkpoints):
+    previous = {fingerprint(OUTLINE[0]): "背景内容", fingerprint(OUTLINE[2]): "总结内容"}
+
+    result = await prepare_content_node(make_state(OUTLINE, section_contents=previous))
+
+    assert result["section_fingerprints"] == [fingerprint(section) for section in OUTLINE]
+    assert set(result["section_results"]) == {0, 2}
+    assert result["section_results"][0] == {"content": "背景内容", "ok": True, "reused": True}
+    assert result["section_results"][2]["content"] == "总结内容"
+
+@pytest.mark.anyio
+async def test_reordered_sections_are_reused_by_fingerprint(checkpoints):
+    previous = {fingerprint(section): f"{section['title']}内容" for section in OUTLINE}
+
+    result = await prepare_content_node(make_state(list(reversed(OUTLINE)), section_contents=previous))
+
+    assert [result["section_results"][index]["content"] for index in range(3)] == ["总结内容", "方案内容", "背景内容"]
+
+@pytest.mark.anyio
+async def test_edited_section_is_regenerated(checkpoints):
+    previous = {fingerprint(section): f"{section['title']}内容" for section in OUTLINE}
+    edited = [OUTLINE[0], {"title": "方案", "content": ["架构", "实现", "部署"]}, OUTLINE[2]]
+
+    result = await prepare_content_node(make_state(edited, section_contents=previous))
+
+    assert set(result["section_results"]) == {0, 2}
+
+@pytest.mark.anyio
+async def test_non_incremental_run_ignores_checkpointed_sections(checkpoints):
+    checkpoints.save_section("req", fingerprint(OUTLINE[0]), "背景", "旧内容")
+
+    result = await prepare_content_node(make_state(OUTLINE, request_id="req", incremental=False))
+
+    assert result["section_results"] == {}
+
+@pytest.mark.anyio
+async def test_resumed_run_reuses_checkpointed_sections(checkpoints):
+    checkpoints.save_section("req", fingerprint(OUTLINE[0]), "背景", "中断前完成的内容")
+
+    incremental = await prepare_content_node(make_state(OUTLINE, request_id="req"))
+    resumed = await prepare_content_node(make_state(OUTLINE, request_id="req", incremental=False, resumed=True))
+
+    assert incremental["section_results"][0]["content"] == "中断前完成的内容"
+    assert resumed["section_results"][0]["content"] == "中断前完成的内容"
+
+@pytest.mark.anyio
+async def test_early_generator_honours_incremental(checkpoints):
+    from api.langgraph_impl import EarlySectionGenerator
+
+    checkpoints.save_section("req", fingerprint(OUTLINE[0]), "背景", "旧内容")
+
+    assert not EarlySectionGenerator(make_state(OUTLINE, request_id="req")).submit(OUTLINE[0], OUTLINE)
+    assert fingerprint(OUTLINE[0]) not in EarlySectionGenerator(make_state(OUTLINE, request_id="req", incremental=False))._known
+
+@pytest.mark.anyio
+async def test_non_incremental_regeneration_clears_section_checkpoints(checkpoints, monkeypatch):
+    import api.routes
+    from api.state import StateDict
+
+    requests = StateDict(req={
+        "topic": "主题", "title": "标题", "outline": OUTLINE, "document_type": "word", "page_limit": 5,
+        "content": None, "section_contents": {fingerprint(OUTLINE[0]): "旧内容"}
+    })
+    states = []
+
+    async def fake_workflow(initial_state, **kwargs):
+        states.append(dict(initial_state))
+        return {"current_step": "content_generated", "content": {}, "section_contents": {}}
+
+    monkeypatch.setattr(api.routes, "document_requests", requests)
+    monkeypatch.setattr(api.routes, "checkpoint_store", checkpoints)
+    monkeypatch.setattr(api.routes, "run_document_workflow", fake_workflow)
+    checkpoints.save_section("req", fingerprint(OUTLINE[0]), "背景", "旧内容")
+
+    await api.routes.regenerate_content("req", incremental=False)
+
+    assert states[0]["incremental"] is False and states[0]["section_contents"] is None
+    assert checkpoints.load_sections("req") == {}
+
+    # 恢复中断的非增量运行时保留该运行已完成的章节
+    checkpoints.save_section("req", fingerprint(OUTLINE[1]), "方案", "中断前完成的内容")
+    monkeypatch.setattr(checkpoints, "finish_run", lambda request_id: None)
+    await api.routes._regenerate_content("req", incremental=False, resumed=True)
+
+    assert states[1]["resumed"] is True
+    assert checkpoints.load_sections("req") == {fingerprint(OUTLINE[1]): "中断前完成的内容"}
+
+async def run_sections(outline, request_id="req"):
+    """对全部章节执行章节节点和汇总节点，返回汇总结果"""
+    from api.langgraph_impl import collect_content_node, generate_section_node
+
+    fingerprints = [fingerprint(section) for section in outline]
+    results = {}
+    for index, section in enumerate(outline):
+        update = await generate_section_node({
+            "index": index, "total": len(outline), "fingerprint": fingerprints[index], "section": section,
+            "title": "标题", "topic": "主题", "document_type": "word", "page_limit": 5,
+            "outline": outline, "request_id": request_id
+        })
+        results.update(update["section_results"])
+    return await collect_content_node(make_state(outline, request_id=request_id,
+                                                 section_fingerprints=fingerprints, section_results=results))
+
+@pytest.mark.anyio
+async def test_failed_sections_are_not_reused(checkpoints, monkeypatch):
+    import api.langgraph_impl
+
+    class FailingLLM:
+        async def ainvoke(self, messages, **kwargs):
+            raise RuntimeError("上游不可用")
+
+    monkeypatch.setattr(api.langgraph_impl, "get_llm", lambda: FailingLLM())
+
+    collected = await run_sections(OUTLINE)
+
+    assert collected["section_contents"] == {}
+    assert collected["error_message"]
+    assert all(collected["content"].values())
+    assert checkpoints.load_sections("req") == {}
+    result = await prepare_content_node(make_state(OUTLINE, request_id="req", section_contents=collected["section_contents"]))
+    assert result["section_results"] == {}
+
+@pytest.mark.anyio
+async def test_offline_fallback_sections_are_not_reused(checkpoints, make_client, monkeypatch):
+    import httpx
+    import api.langgraph_impl
+
+    # 上游持续返回500：客户端回退到离线生成器，内容可以展示但不保存
+    client = make_client(lambda request: httpx.Response(500, text="down"))
+    monkeypatch.setattr(api.langgraph_impl, "deepseek_client", client)
+
+    collected = await run_sections(OUTLINE[:1])
+
+    assert collected["content"]["背景"]
+    assert collected["section_contents"] == {}
+    assert checkpoints.load_sections("req") == {}
+    result = await prepare_content_node(make_state(OUTLINE, request_id="req", section_contents=collected["section_contents"]))
+    assert result["section_results"] == {}
+
+@pytest.mark.anyio
+async def test_section_checkpoints_are_written_off_the_event_loop(checkpoints, monkeypatch):
+    import threading
+    import api.langgraph_impl
+
+    class FakeLLM:
+        async def ainvoke(self, messages, **kwargs):
+            class Message:
+                content = "章节内容。" * 400
+            return Message()
+
+    threads = []
+    save_section = checkpoints.save_section
+
+    def recording_save_section(*args):
+        threads.append(threading.get_ident())
+        save_section(*args)
+
+    monkeypatch.setattr(api.langgraph_impl, "get_llm", lambda: FakeLLM())
+    monkeypatch.setattr(checkpoints, "save_section", recording_save_section)
+
+    collected = await run_sections(OUTLINE)
+
+    assert set(collected["section_contents"]) == {fingerprint(section) for section in OUTLINE}
+    assert len(threads) == len(OUTLINE) and threading.get_ident() not in threads
+    assert set(checkpoints.load_sections("req")) == set(collected["section_contents"])
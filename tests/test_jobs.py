@@ -0,0 +1,160 @@
+"""后台任务的认领、取消和重新排队"""
+
+import os
+import asyncio
+import multiprocessing
+
+import pytest
+
+from api.jobs import JobManager, QUEUED, RUNNING, SUCCEEDED, CANCELLED
+from api.state import SQLiteStateStore, SharedDict, StateDict
+
+def shared_jobs(path):
+    return SharedDict(SQLiteStateStore(str(path)), "document_jobs")
+
+def queued_job(job_id, **fields):
+    return {
+        "job_id": job_id, "kind": "echo", "request_id": f"req-{job_id}", "params": {}, "status": QUEUED,
+        "created_at": 0.0, "started_at": None, "finished_at": None, "result": None, "error": None, **fields
+    }
+
+def make_manager(jobs, runs):
+    manager = JobManager(jobs, workers=2, watch_poll=0.01)
+
+    async def echo(request_id, params):
+        runs.append(request_id)
+        await asyncio.sleep(0.01)
+        return {"success": True, "request_id": request_id}
+
+    manager.register("echo", echo)
+    return manager
+
+def claim(path, job_id, results):
+    manager = JobManager(shared_jobs(path))
+    job = asyncio.run(manager._transition(job_id, lambda job: job["status"] == QUEUED, status=RUNNING, worker=os.getpid()))
+    results.put(job is not None)
+
+@pytest.mark.anyio
+async def test_transition_applies_only_when_condition_holds():
+    jobs = StateDict(a=queued_job("a"))
+    manager = JobManager(jobs)
+
+    running = await manager._transition("a", lambda job: job["status"] == QUEUED, status=RUNNING)
+
+    assert running["status"] == RUNNING and jobs["a"]["status"] == RUNNING
+    assert await manager._transition("a", lambda job: job["status"] == QUEUED, status=RUNNING) is None
+    assert await manager._transition("missing", lambda job: True, status=RUNNING) is None
+
+def test_claim_is_atomic_across_processes(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    shared_jobs(path)["a"] = queued_job("a")
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    processes = [context.Process(target=claim, args=(path, "a", results)) for _ in range(6)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+
+    assert sorted(results.get(timeout=5) for _ in processes) == [False] * 5 + [True]
+    assert shared_jobs(path)["a"]["status"] == RUNNING
+
+@pytest.mark.anyio
+async def test_queued_job_runs_once_with_two_managers(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    runs = []
+    first, second = make_manager(shared_jobs(path), runs), make_manager(shared_jobs(path), runs)
+    await first.start()
+    await second.start()
+    job = await first.submit("echo", "req", {})
+    # 另一个进程启动时也会把排队中的任务放入自己的队列（两个管理器在同一进程中，这里直接放入，
+    # 避免second.start()把first已认领的任务当作本进程上次运行遗留的任务重新排队）
+    second._queue.put_nowait(job["job_id"])
+
+    try:
+        async for record in second.watch(job["job_id"]):
+            status = record["status"]
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert status == SUCCEEDED
+    assert runs == ["req"]
+
+@pytest.mark.anyio
+async def test_cancel_queued_job_skips_execution():
+    runs = []
+    jobs = StateDict(a=queued_job("a"))
+    manager = make_manager(jobs, runs)
+
+    assert await manager.cancel("a")
+    assert jobs["a"]["status"] == CANCELLED
+    assert not await manager.cancel("a")
+
+    await manager.start()
+    await manager._queue.join()
+    await manager.stop()
+
+    assert runs == []
+    assert jobs["a"]["status"] == CANCELLED
+
+@pytest.mark.anyio
+async def test_start_requeues_only_orphaned_running_jobs():
+    runs = []
+    jobs = StateDict(
+        orphaned=queued_job("orphaned", status=RUNNING, worker=2 ** 22 + 1),
+        owned=queued_job("owned", status=RUNNING, worker=os.getppid())
+    )
+    manager = make_manager(jobs, runs)
+
+    assert await manager.start() == 1
+    await manager._queue.join()
+    await manager.stop()
+
+    assert runs == ["req-orphaned"]
+    assert jobs["orphaned"]["status"] == SUCCEEDED
+    assert jobs["owned"]["status"] == RUNNING
+
+class NoScan:
+    """禁止遍历全部任务记录的存储"""
+
+    def values(self):
+        raise AssertionError("不应扫描全部任务记录")
+
+    items = values
+
+class NoScanStateDict(NoScan, StateDict):
+    pass
+
+class NoScanSharedDict(NoScan, SharedDict):
+    pass
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+async def test_job_queries_use_indexes(tmp_path, backend):
+    if backend == "sqlite":
+        jobs = NoScanSharedDict(SQLiteStateStore(str(tmp_path / "state.sqlite3")), "document_jobs")
+    else:
+        jobs = NoScanStateDict()
+    for index in range(20):
+        jobs[f"done-{index}"] = queued_job(f"done-{index}", status=SUCCEEDED)
+    manager = make_manager(jobs, [])
+    manager._queue = asyncio.Queue()
+
+    first = await manager.submit("echo", "req-1", {})
+    second = await manager.submit("echo", "req-2", {})
+    third = await manager.submit("echo", "req-3", {})
+    await manager._transition(first["job_id"], lambda job: True, status=RUNNING)
+
+    assert (await manager.get(second["job_id"]))["queue_position"] == 0
+    assert (await manager.get(third["job_id"]))["queue_position"] == 1
+    assert await manager.is_pending("req-1") and await manager.is_pending("req-2")
+    assert not await manager.is_pending("req-done-0")
+    stats = await manager.stats()
+    assert (stats["queued"], stats["running"]) == (2, 1)
+
+    await manager._finish(await manager.get(first["job_id"]), SUCCEEDED)
+
+    assert not await manager.is_pending("req-1")
+    assert (await manager.stats())["running"] == 0
@@ -0,0 +1,69 @@
+"""增量JSON数组解析"""
+
+import json
+
+import pytest
+
+from utils.json_stream import StreamingArrayParser
+
+OUTLINE = {
+    "title": "标题",
+    "outline": [
+        {"title": "背景 {概述}", "content": ["引号\"和反斜杠\\", "右括号]与}"]},
+        {"title": "方案", "content": ["架构", "实现"], "meta": {"nested": [1, 2]}},
+        {"title": "总结", "content": []}
+    ]
+}
+
+def feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_objects_are_emitted_for_any_chunk_size(size):
+    text = json.dumps(OUTLINE, ensure_ascii=False)
+    parser = StreamingArrayParser("outline")
+
+    items = feed_all(parser, [text[start:start + size] for start in range(0, len(text), size)])
+
+    assert items == OUTLINE["outline"]
+    assert parser.done and parser.emitted == 3 and parser.errors == 0
+    assert parser.text == text
+
+def test_each_object_is_emitted_as_soon_as_it_closes():
+    parser = StreamingArrayParser("outline")
+
+    assert parser.feed('{"outline": [{"title": "a"') == []
+    assert parser.feed('}, {"title"') == [{"title": "a"}]
+    assert parser.feed(': "b"}]') == [{"title": "b"}]
+    assert parser.feed(', "ignored": [{"title": "c"}]}') == []
+
+def test_chunk_boundary_inside_escape_sequence():
+    parser = StreamingArrayParser("outline")
+
+    assert feed_all(parser, ['{"outline": [{"title": "a\\', '"}"}, {"title": "b\\\\', '"}]}']) == [
+        {"title": 'a"}'},
+        {"title": "b\\"}
+    ]
+
+def test_key_split_across_chunks_and_preamble_ignored():
+    parser = StreamingArrayParser("outline")
+
+    items = feed_all(parser, ['说明文字 ```json\n{"title": "[不是数组]", "out', 'line"', ' :\n [{"title": "a"}]}'])
+
+    assert items == [{"title": "a"}]
+
+def test_without_key_parses_first_array():
+    parser = StreamingArrayParser()
+
+    assert feed_all(parser, ['[{"a": 1},', ' 2, "x", {"b": [3]}]']) == [{"a": 1}, {"b": [3]}]
+
+def test_malformed_object_is_counted_and_skipped():
+    parser = StreamingArrayParser("outline")
+
+    items = parser.feed('{"outline": [{"title": "a",}, {"title": "b"}]}')
+
+    assert items == [{"title": "b"}]
+    assert parser.errors == 1 and parser.emitted == 1
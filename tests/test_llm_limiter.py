@@ -0,0 +1,87 @@
+"""AIMD并发限流器和Retry-After解析"""
+
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from utils.llm_limiter import AdaptiveConcurrencyLimiter, parse_retry_after
+
+@pytest.mark.parametrize("value, expected", [(None, None), ("", None), ("3", 3.0), ("-5", 0.0), ("soon", None)])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+def test_parse_retry_after_http_date():
+    assert parse_retry_after(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+def test_additive_increase_and_multiplicative_decrease():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=8, decrease_cooldown=0, throttle_pause=0)
+
+    for _ in range(4):
+        limiter.release("success")
+    assert limiter.stats()["window"] == pytest.approx(5, abs=0.2)
+
+    limiter.release("throttled")
+    assert limiter.limit == 2
+
+    for _ in range(5):
+        limiter.release("throttled")
+    assert limiter.limit == 1
+
+def test_throttle_decrease_has_cooldown():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, decrease_cooldown=60, throttle_pause=0)
+    limiter.release("throttled")
+    limiter.release("throttled")
+    assert limiter.limit == 4
+
+def test_errors_and_cancellations_do_not_change_window():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+    limiter.release("error")
+    limiter.release("cancelled")
+    assert limiter.stats()["window"] == 4
+
+@pytest.mark.anyio
+async def test_callers_beyond_window_wait_in_fifo_order():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+    order = []
+
+    async def call(name):
+        async with limiter.slot() as permit:
+            order.append(name)
+            await asyncio.sleep(0.01)
+            permit.record(200)
+
+    await asyncio.gather(*(call(name) for name in "abc"))
+
+    assert order == ["a", "b", "c"]
+    assert limiter.stats()["max_queue_depth"] == 2
+    assert limiter.stats()["in_flight"] == 0
+
+@pytest.mark.anyio
+async def test_retry_after_pauses_admission():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, decrease_cooldown=0)
+
+    async with limiter.slot() as permit:
+        permit.record(429, "0.2")
+
+    started = time.monotonic()
+    async with limiter.slot() as permit:
+        permit.record(200)
+    assert time.monotonic() - started >= 0.15
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_does_not_leak_permit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+    await limiter.acquire()
+
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    limiter.release("success")
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.stats()["queue_depth"] == 0
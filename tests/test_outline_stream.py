@@ -0,0 +1,41 @@
+"""流式大纲与提前生成章节内容"""
+
+import pytest
+
+OUTLINE = [
+    {"title": "背景", "content": ["现状"]},
+    {"title": "方案", "content": ["架构"]}
+]
+
+@pytest.mark.anyio
+async def test_prefetched_sections_are_stored_and_run_finished(checkpoints, monkeypatch):
+    import api.langgraph_impl
+    import api.routes
+    from api.state import StateDict
+
+    async def fake_title(*args, **kwargs):
+        return {"title": "标题"}
+
+    async def fake_sections(state, use_cache=True):
+        for section in OUTLINE:
+            yield section
+
+    async def fake_content(section_title, **kwargs):
+        return f"{section_title}内容"
+
+    requests = StateDict()
+    monkeypatch.setattr(api.routes, "document_requests", requests)
+    monkeypatch.setattr(api.routes, "checkpoint_store", checkpoints)
+    monkeypatch.setattr(api.routes, "generate_title", fake_title)
+    monkeypatch.setattr(api.routes, "stream_outline_sections", fake_sections)
+    monkeypatch.setattr(api.langgraph_impl, "generate_section_content", fake_content)
+
+    request = api.routes.DocumentRequest(topic="主题", page_limit=3, document_type="word",
+                                         request_id="req", hierarchical=False)
+    response = await api.routes.generate_outline_stream(request, prefetch_content=True)
+    body = "".join([chunk async for chunk in response.body_iterator])
+
+    assert "event: outline_done" in body and '"prefetched_sections": 2' in body
+    assert sorted(requests["req"]["section_contents"].values()) == ["方案内容", "背景内容"]
+    # 提前生成的章节已写入document_requests，检查点随运行结束清除
+    assert checkpoints.load_sections("req") == {}
@@ -0,0 +1,71 @@
+"""文档渲染进程池的排队、超时和回收"""
+
+import os
+import time
+import asyncio
+
+import pytest
+
+import utils.document_generator  # noqa: F401  回收后新建的工作进程无需再导入渲染库
+import utils.render_pool
+from utils.render_pool import RenderPool, RenderTimeout, RenderQueueFull
+
+def fake_render(document_type, title, outline, content, page_limit, file_path):
+    """按title指定的秒数模拟渲染"""
+    time.sleep(float(title))
+    return {"file_path": file_path, "render_seconds": float(title), "save_seconds": 0.0, "pid": os.getpid()}
+
+@pytest.fixture
+def pool(monkeypatch):
+    # fork启动的工作进程继承替换后的渲染函数
+    monkeypatch.setattr(utils.render_pool, "render_document", fake_render)
+    pools = []
+
+    def factory(**kwargs):
+        pools.append(RenderPool(start_method="fork", **kwargs))
+        return pools[-1]
+
+    yield factory
+    for created in pools:
+        created.shutdown()
+
+async def render(pool, seconds):
+    try:
+        return (await pool.render("word", str(seconds), [], {}, None, "unused"))["render_seconds"]
+    except (RenderTimeout, RenderQueueFull) as e:
+        return type(e).__name__
+
+@pytest.mark.anyio
+async def test_queue_wait_does_not_count_towards_timeout(pool):
+    render_pool = pool(workers=1, timeout=1.0)
+    await render_pool.start()
+
+    results = await asyncio.gather(render(render_pool, 1.5), *(render(render_pool, 0.3) for _ in range(3)))
+
+    # 排在超时渲染之后的渲染各自只用0.3秒，总共等待了超过timeout的时间也不会超时或被取消
+    assert results == ["RenderTimeout", 0.3, 0.3, 0.3]
+    assert render_pool.stats()["timeouts"] == 1 and render_pool.stats()["recycles"] == 1
+
+@pytest.mark.anyio
+async def test_renders_killed_by_recycle_are_retried(pool):
+    render_pool = pool(workers=2, timeout=1.0)
+    await render_pool.start()
+
+    async def later(seconds):
+        await asyncio.sleep(0.6)
+        return await render(render_pool, seconds)
+
+    # 第二个渲染在第一个超时回收进程池时仍在进行，在新进程池中重试成功
+    results = await asyncio.gather(render(render_pool, 2.0), later(0.6))
+
+    assert results == ["RenderTimeout", 0.6]
+    assert render_pool.renders == 1 and render_pool.failures == 0
+
+@pytest.mark.anyio
+async def test_full_queue_is_rejected(pool):
+    render_pool = pool(workers=1, max_queue=1, timeout=5.0)
+    await render_pool.start()
+
+    results = await asyncio.gather(*(render(render_pool, 0.2) for _ in range(3)))
+
+    assert sorted(map(str, results)) == ["0.2", "0.2", "RenderQueueFull"]
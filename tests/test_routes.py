@@ -0,0 +1,199 @@
+"""接口和工作流的端到端检查：请求经过真实的路由和LangGraph工作流，上游模型由httpx.MockTransport模拟"""
+
+import re
+import json
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from tests.conftest import completion
+from api.cancellation import CANCELLED_BY_USER
+from api.jobs import JobManager, SUCCEEDED
+from api.langgraph_impl import section_fingerprint
+from api.state import StateDict
+from utils.circuit_breaker import CircuitBreaker
+
+OUTLINE = [
+    {"title": "背景", "content": ["现状", "问题"]},
+    {"title": "方案", "content": ["架构", "实现"]},
+    {"title": "总结", "content": ["结论"]}
+]
+
+def document(outline):
+    return {
+        "topic": "主题", "title": "标题", "outline": outline, "document_type": "word", "page_limit": 5,
+        "content": None, "section_concurrency": len(outline)
+    }
+
+def fingerprint(section):
+    return section_fingerprint("标题", "主题", section["title"], section["content"], "word")
+
+class Upstream:
+    """模拟的DeepSeek上游：按提示中的章节标题返回内容，并记录收到的请求"""
+
+    def __init__(self):
+        self.calls = []            # 每次请求的章节标题（非章节请求为None）
+        self.responses = {}        # 章节标题 -> 依次返回的响应，用完后返回正常内容
+        self.blocked = set()       # 这些章节的请求一直挂起，直到被取消
+        self.failing = False       # 为True时全部返回500
+        self.delay = 0.0
+        self.cancelled = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        match = re.search(r"章节标题: (\S+)", prompt)
+        section = match.group(1) if match else None
+        self.calls.append(section)
+        try:
+            await asyncio.sleep(60 if section in self.blocked else self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.responses.get(section):
+            return self.responses[section].pop(0)
+        if self.failing:
+            return httpx.Response(500, text="down")
+        return httpx.Response(200, json=completion(f"{section}的内容。" * 200))
+
+class Service:
+    def __init__(self, http, upstream, llm, requests, jobs):
+        self.http = http
+        self.upstream = upstream
+        self.llm = llm
+        self.requests = requests
+        self.jobs = jobs
+
+@pytest.fixture
+async def service(checkpoints, make_client, monkeypatch):
+    """挂载全部API路由的应用：使用模拟上游、临时的检查点和进程内的请求与任务存储"""
+    import api.langgraph_impl
+    import api.routes
+
+    upstream = Upstream()
+    llm = make_client(upstream)
+    requests = StateDict()
+    jobs = JobManager(StateDict(), workers=2, watch_poll=0.01)
+    jobs._handlers = dict(api.routes.job_manager._handlers)
+    monkeypatch.setattr(api.langgraph_impl, "deepseek_client", llm)
+    monkeypatch.setattr(api.routes, "deepseek_client", llm)
+    # 提示链和工作流在构建时绑定LLM，换成模拟上游后重新构建
+    monkeypatch.setattr(api.langgraph_impl.registry, "_components", {})
+    monkeypatch.setattr(api.routes, "document_requests", requests)
+    monkeypatch.setattr(api.routes, "checkpoint_store", checkpoints)
+    monkeypatch.setattr(api.routes, "job_manager", jobs)
+
+    app = FastAPI()
+    app.include_router(api.routes.router, prefix="/api")
+    await jobs.start()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            yield Service(http, upstream, llm, requests, jobs)
+    finally:
+        await jobs.stop()
+
+@pytest.mark.anyio
+async def test_throttled_section_is_requeued_and_shrinks_limiter_window(service):
+    """user-004: 429按Retry-After重新排队，不回退到离线内容，并发窗口收缩"""
+    service.requests["req"] = document(OUTLINE[:1])
+    service.upstream.responses["背景"] = [httpx.Response(429, headers={"Retry-After": "0"}, text="busy")]
+
+    result = (await service.http.post("/api/regenerate-content/req")).json()
+
+    assert result["success"] and "背景的内容" in result["content"]["背景"]
+    assert service.upstream.calls == ["背景", "背景"]
+    assert list(service.requests["req"]["section_contents"]) == [fingerprint(OUTLINE[0])]
+    limiter = (await service.http.get("/api/llm-stats")).json()["limiter"]
+    assert limiter["throttled"] == 1 and limiter["window"] < 4
+    assert limiter["queue_depth"] == 0 and limiter["in_flight"] == 0
+
+@pytest.mark.anyio
+async def test_identical_title_requests_share_one_upstream_call(service):
+    """user-005: 同时为同一主题生成标题只调用一次上游"""
+    from api.langgraph_impl import generate_title_node
+
+    service.upstream.delay = 0.05
+    state = {"topic": "主题", "document_type": "ppt"}
+
+    first, second = await asyncio.gather(generate_title_node(state), generate_title_node(state))
+
+    assert first["title"] == second["title"]
+    assert service.upstream.calls == [None]
+    assert (await service.http.get("/api/llm-stats")).json()["singleflight"]["coalesced"] == 1
+
+@pytest.mark.anyio
+async def test_open_circuit_serves_sections_without_calling_upstream(service):
+    """user-009: 熔断后章节直接使用离线内容，状态接口可以查看和重置"""
+    service.llm.breaker = CircuitBreaker(min_calls=1)
+    service.upstream.failing = True
+    service.requests["req"] = document(OUTLINE[:1])
+
+    await service.http.post("/api/regenerate-content/req")
+    assert service.upstream.calls == ["背景"]
+    assert (await service.http.get("/api/circuit-breaker")).json()["state"] == "open"
+
+    result = (await service.http.post("/api/regenerate-content/req")).json()
+
+    assert result["content"]["背景"]
+    assert service.upstream.calls == ["背景"]
+    assert service.requests["req"]["section_contents"] == {}
+    assert (await service.http.post("/api/circuit-breaker/reset")).json()["state"] == "closed"
+
+@pytest.mark.anyio
+async def test_edited_outline_regenerates_only_changed_sections(service):
+    """user-015: 编辑大纲后只为修改过的章节调用模型，调整顺序和未修改的章节复用"""
+    service.requests["req"] = document(OUTLINE)
+    first = (await service.http.post("/api/regenerate-content/req")).json()
+    assert sorted(first["regenerated_sections"]) == sorted(section["title"] for section in OUTLINE)
+
+    edited = [OUTLINE[2], {**OUTLINE[1], "content": ["架构", "部署"]}, OUTLINE[0]]
+    assert (await service.http.put("/api/edit-workflow-outline/req", json={"outline": edited})).status_code == 200
+    service.upstream.calls.clear()
+
+    second = (await service.http.post("/api/regenerate-content/req")).json()
+
+    assert second["success"]
+    assert second["regenerated_sections"] == ["方案"] and sorted(second["reused_sections"]) == ["总结", "背景"]
+    assert service.upstream.calls == ["方案"]
+    assert second["content"]["背景"] == first["content"]["背景"]
+
+@pytest.mark.anyio
+async def test_cancel_route_stops_generation_and_keeps_finished_sections(service, checkpoints):
+    """user-021: 取消接口中止未完成章节的上游请求并释放并发名额，已完成的章节保留"""
+    service.requests["req"] = document(OUTLINE)
+    service.upstream.blocked = {"方案", "总结"}
+    generation = asyncio.ensure_future(service.http.post("/api/regenerate-content/req"))
+    for _ in range(500):
+        if len(service.upstream.calls) == 3 and checkpoints.load_sections("req"):
+            break
+        await asyncio.sleep(0.01)
+
+    assert (await service.http.delete("/api/generation/req")).json()["success"]
+    result = (await generation).json()
+
+    assert result["cancel_reason"] == CANCELLED_BY_USER
+    assert list(service.requests["req"]["section_contents"]) == [fingerprint(OUTLINE[0])]
+    assert service.upstream.cancelled == 2
+    assert service.llm.limiter.stats()["in_flight"] == 0
+    assert not (await service.http.delete("/api/generation/req")).json()["success"]
+
+@pytest.mark.anyio
+async def test_job_routes_run_generation_in_background(service):
+    """user-023: 提交任务立即返回202，结果通过状态查询和SSE获取"""
+    service.requests["req"] = document(OUTLINE[:1])
+
+    response = await service.http.post("/api/jobs/regenerate-content/req", json={"incremental": False})
+
+    assert response.status_code == 202
+    job = response.json()
+    assert response.headers["location"] == job["status_url"]
+    async with service.http.stream("GET", job["events_url"]) as events:
+        body = "".join([chunk async for chunk in events.aiter_text()])
+    assert body.count("event: job") >= 1 and f'"status": "{SUCCEEDED}"' in body
+
+    finished = (await service.http.get(job["status_url"])).json()
+    assert finished["status"] == SUCCEEDED and "背景的内容" in finished["result"]["content"]["背景"]
+    assert not (await service.http.delete(job["status_url"])).json()["success"]
+    assert (await service.http.get("/api/jobs/missing")).status_code == 404
+    assert (await service.http.post("/api/jobs/regenerate-content/missing")).status_code == 404
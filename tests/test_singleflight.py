@@ -0,0 +1,77 @@
+"""单飞请求合并"""
+
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+@pytest.mark.anyio
+async def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "结果"
+
+    results = await asyncio.gather(*(flight.do("key", upstream) for _ in range(5)))
+
+    assert results == ["结果"] * 5
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4, "cancelled_upstream": 0}
+
+@pytest.mark.anyio
+async def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0)
+        return 1
+
+    await asyncio.gather(flight.do("a", upstream), flight.do("b", upstream))
+    assert flight.stats()["leaders"] == 2
+
+@pytest.mark.anyio
+async def test_cancelling_one_waiter_keeps_upstream_for_others():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def upstream():
+        await release.wait()
+        return "完成"
+
+    first = asyncio.ensure_future(flight.do("key", upstream))
+    second = asyncio.ensure_future(flight.do("key", upstream))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await second == "完成"
+    assert first.cancelled()
+    assert flight.stats()["cancelled_upstream"] == 0
+
+@pytest.mark.anyio
+async def test_last_waiter_leaving_cancels_upstream():
+    flight = SingleFlight()
+    upstream_cancelled = asyncio.Event()
+
+    async def upstream():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            upstream_cancelled.set()
+            raise
+
+    waiter = asyncio.ensure_future(flight.do("key", upstream))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+
+    await asyncio.wait_for(upstream_cancelled.wait(), 1)
+    assert flight.stats()["cancelled_upstream"] == 1
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,186 @@
+"""多进程共享状态（STATE_BACKEND=sqlite）"""
+
+import asyncio
+import sqlite3
+import threading
+import multiprocessing
+
+import pytest
+
+import api.progress
+from api.progress import ProgressBus, STARTED, STAGE, SECTION_STARTED, COMPLETED
+from api.state import SQLiteStateStore, SharedDict, REMOVE
+
+def increment(path, times):
+    counters = SharedDict(SQLiteStateStore(str(path)), "counters")
+    for _ in range(times):
+        counters.update_item("total", lambda value: (value or 0) + 1)
+
+def write_then_read(path, results):
+    shared = SharedDict(SQLiteStateStore(str(path)), "requests")
+    shared["child"] = {"pid": "child"}
+    results.put(shared.get("parent"))
+
+def test_writes_are_visible_across_processes(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    shared = SharedDict(SQLiteStateStore(str(path)), "requests")
+    shared["parent"] = {"title": "标题"}
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    process = context.Process(target=write_then_read, args=(path, results))
+    process.start()
+    process.join(30)
+
+    assert results.get(timeout=5) == {"title": "标题"}
+    assert shared["child"] == {"pid": "child"}
+    assert sorted(shared) == ["child", "parent"] and len(shared) == 2
+
+def test_update_item_is_atomic_across_processes(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    context = multiprocessing.get_context("fork")
+
+    processes = [context.Process(target=increment, args=(path, 100)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+
+    assert SharedDict(SQLiteStateStore(str(path)), "counters")["total"] == 400
+
+def test_shared_dict_behaves_like_dict(tmp_path):
+    shared = SharedDict(SQLiteStateStore(str(tmp_path / "state.sqlite3")), "requests")
+    shared["a"] = {"title": "标题", "content": None}
+
+    # 读取返回副本，修改嵌套的值不会写回
+    shared["a"]["title"] = "修改"
+    assert shared["a"]["title"] == "标题"
+    assert shared.patch("a", {"content": {"背景": "内容"}}) == {"title": "标题", "content": {"背景": "内容"}}
+    assert shared.patch("missing", {"content": None}) is None
+    assert shared.update_item("a", lambda value: REMOVE) is None
+    assert "a" not in shared and shared.get("a", "默认") == "默认"
+    with pytest.raises(KeyError):
+        del shared["a"]
+
+def test_find_uses_field_index(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.sqlite3"))
+    jobs = SharedDict(store, "jobs")
+    jobs["a"] = {"status": "queued", "request_id": "req"}
+    jobs["b"] = {"status": "succeeded", "request_id": "req"}
+    SharedDict(store, "other")["c"] = {"status": "queued"}
+
+    assert jobs.find("status", "queued") == [{"status": "queued", "request_id": "req"}]
+    assert len(jobs.find("request_id", "req")) == 2
+    plan = store._execute(f"EXPLAIN QUERY PLAN SELECT key FROM state WHERE namespace = ? AND {store._field_expr('status')} = ?",
+                          ("jobs", "queued"))
+    assert "USING INDEX state_status" in str(plan)
+    with pytest.raises(ValueError):
+        jobs.find("status') OR 1=1 --", "queued")
+
+def hold_write_lock(path, seconds, locked):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    locked.set()
+    threading.Event().wait(seconds)
+    conn.execute("COMMIT")
+    conn.close()
+
+def test_locked_database_is_retried(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    store = SQLiteStateStore(path, busy_timeout=0.05, max_retries=8)
+    store.set("requests", "a", 1)
+    locked = threading.Event()
+    holder = threading.Thread(target=hold_write_lock, args=(path, 0.3, locked))
+    holder.start()
+    locked.wait()
+
+    store.update("requests", "a", lambda value: value + 1)
+    holder.join()
+
+    assert store.get("requests", "a") == 2
+    assert store.retries > 0
+
+def test_retries_are_bounded(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    store = SQLiteStateStore(path, busy_timeout=0.01, max_retries=1)
+    store.set("requests", "a", 1)
+    locked = threading.Event()
+    holder = threading.Thread(target=hold_write_lock, args=(path, 1.0, locked))
+    holder.start()
+    locked.wait()
+
+    with pytest.raises(sqlite3.OperationalError):
+        store.set("requests", "a", 2)
+    holder.join()
+
+@pytest.mark.anyio
+async def test_async_access_waits_for_lock_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    shared = SharedDict(SQLiteStateStore(path, busy_timeout=0.05, max_retries=8), "requests")
+    shared["a"] = 1
+    locked = threading.Event()
+    holder = threading.Thread(target=hold_write_lock, args=(path, 0.3, locked))
+    holder.start()
+    locked.wait()
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    # 等待锁（包括重试间隔）在线程中进行，事件循环上的其他任务继续运行
+    ticker = asyncio.ensure_future(tick())
+    assert await shared.aupdate_item("a", lambda value: value + 1) == 2
+    ticker.cancel()
+    holder.join()
+
+    assert ticks >= 10
+
+@pytest.mark.anyio
+async def test_progress_writes_are_batched_and_shared(tmp_path, monkeypatch):
+    store = SQLiteStateStore(str(tmp_path / "state.sqlite3"))
+    snapshots = SharedDict(store, "generation_progress")
+    monkeypatch.setattr(api.progress, "generation_progress", snapshots)
+    events = SharedDict(store, "progress_events")
+    # 两个进程中的总线共用同一个共享存储
+    publisher = ProgressBus(shared_events=events, flush_interval=60)
+    other = ProgressBus(shared_events=events, poll_interval=0.01)
+
+    await publisher.start("req", message="开始")
+    publisher.publish("req", SECTION_STARTED, section="背景")
+
+    # 写入合并后延迟进行，本进程内的快照立即更新
+    assert "req" not in snapshots
+    assert publisher.snapshot("req")["in_flight_sections"] == ["背景"]
+
+    await publisher.flush()
+    assert snapshots["req"]["seq"] == 2
+    assert [event["type"] for event in events["req"]] == [STARTED, SECTION_STARTED]
+    assert other.snapshot("req") is None
+    assert (await other.load_snapshot("req"))["in_flight_sections"] == ["背景"]
+
+    publisher.publish("req", STAGE, message="生成中")
+    publisher.publish("req", COMPLETED, progress=100)
+    await publisher.flush()
+    received = [event.type async for event in other.subscribe("req")]
+    assert received == [STARTED, SECTION_STARTED, STAGE, COMPLETED]
+
+    # 新一次生成开始时清空共享存储中的事件
+    await publisher.start("req")
+    await publisher.flush()
+    assert [event["seq"] for event in events["req"]] == [5]
+
+@pytest.mark.anyio
+async def test_progress_is_flushed_in_background(tmp_path, monkeypatch):
+    store = SQLiteStateStore(str(tmp_path / "state.sqlite3"))
+    snapshots = SharedDict(store, "generation_progress")
+    monkeypatch.setattr(api.progress, "generation_progress", snapshots)
+    bus = ProgressBus(shared_events=SharedDict(store, "progress_events"), flush_interval=0.01)
+
+    await bus.start("req")
+    bus.publish("req", COMPLETED, progress=100)
+    await asyncio.sleep(0.2)
+
+    assert snapshots["req"]["progress"] == 100
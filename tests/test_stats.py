@@ -0,0 +1,13 @@
+"""百分位数计算"""
+
+from utils.stats import percentile
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile([], 95) is None
+    assert percentile([3.0], 50) == 3.0
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(reversed(values), 99) == 99.0
+    assert percentile(values, 100) == 100.0
@@ -0,0 +1 @@
+# tools包初始化文件
@@ -0,0 +1,81 @@
+"""
+工作流组件构建开销的微基准。
+
+对比每个请求都重新构建组件（原先的做法：编译StateGraph、创建标题链/大纲链、
+创建JSON解析器并生成格式说明）与从注册表复用组件的单次请求开销:
+
+    python -m tools.bench_registry --iterations 200
+"""
+
+import time
+import argparse
+import statistics
+from typing import Callable, Dict, List
+
+from langchain_core.output_parsers import JsonOutputParser
+
+from api import langgraph_impl
+from api.langgraph_impl import (
+    OutlineResponse,
+    create_complete_workflow,
+    create_title_chain,
+    create_outline_chain,
+    get_title_chain,
+    get_outline_chain,
+    get_outline_format_instructions,
+    get_workflow,
+    registry
+)
+
+def per_request_rebuild() -> None:
+    """原先每个请求的构建路径"""
+    create_title_chain()
+    create_outline_chain()
+    JsonOutputParser(pydantic_object=OutlineResponse).get_format_instructions()
+    create_complete_workflow()
+
+def per_request_registry() -> None:
+    """使用注册表后的路径"""
+    get_title_chain()
+    get_outline_chain()
+    get_outline_format_instructions()
+    get_workflow()
+
+def measure(fn: Callable[[], None], iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "mean": statistics.mean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="工作流组件构建开销微基准")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    # 先预热一次，排除模块首次导入等一次性开销
+    per_request_rebuild()
+    warm_up_times = langgraph_impl.warm_up()
+
+    before = summarize(measure(per_request_rebuild, args.iterations))
+    after = summarize(measure(per_request_registry, args.iterations))
+
+    print(f"预热耗时: {sum(warm_up_times.values()) * 1000:.2f}ms（仅启动时一次）")
+    print(f"{'路径':<10}{'mean(ms)':>12}{'p50(ms)':>12}{'p95(ms)':>12}")
+    print(f"{'重新构建':<10}{before['mean']:>12.3f}{before['p50']:>12.3f}{before['p95']:>12.3f}")
+    print(f"{'注册表':<10}{after['mean']:>12.4f}{after['p50']:>12.4f}{after['p95']:>12.4f}")
+    if after["mean"] > 0:
+        print(f"单次请求开销降低约 {before['mean'] / after['mean']:.0f} 倍")
+    print(f"注册表状态: {registry.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+文档生成流程的负载测试驱动。
+
+以N个并发用户循环执行 大纲生成 → 内容生成 → 文档生成 的完整流程，
+统计吞吐量以及各阶段和整体流程的p50/p95/p99延迟。通常与tools/mock_deepseek_server.py配合使用:
+
+    python -m tools.load_test --base-url http://127.0.0.1:8000 --users 20 --iterations 3
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from utils.stats import percentile
+
+STAGES = ("outline", "content", "document", "flow")
+
+class LoadTestResult:
+    """收集各阶段的延迟和错误"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: List[str] = []
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+    def record(self, stage: str, latency: float) -> None:
+        self.latencies[stage].append(latency)
+
+    def fail(self, stage: str, reason: str) -> None:
+        self.errors[stage] += 1
+        if len(self.error_samples) < 10:
+            self.error_samples.append(f"{stage}: {reason}")
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        completed = len(self.latencies["flow"])
+        stages = {}
+        for stage in STAGES:
+            values = self.latencies[stage]
+            stages[stage] = {
+                "count": len(values),
+                "errors": self.errors[stage],
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values) if values else None
+            }
+        return {
+            "elapsed": round(elapsed, 3),
+            "completed_flows": completed,
+            "failed_flows": sum(self.errors.values()),
+            "throughput_per_second": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+            "stages": stages,
+            "error_samples": self.error_samples
+        }
+
+async def run_flow(client: httpx.AsyncClient, args: argparse.Namespace, user: int, iteration: int,
+                   result: LoadTestResult) -> None:
+    """执行一次完整的文档生成流程"""
+    flow_start = time.perf_counter()
+    topic = args.topics[(user + iteration) % len(args.topics)]
+    if args.unique_topics:
+        topic = f"{topic}-{user}-{iteration}"
+
+    stage = "outline"
+    try:
+        start = time.perf_counter()
+        response = await client.post("/api/generate-outline", json={
+            "topic": topic,
+            "page_limit": args.page_limit,
+            "document_type": args.document_type,
+            "use_cache": args.use_cache,
+            "outline_strategy": args.outline_strategy
+        })
+        response.raise_for_status()
+        outline = response.json()
+        if not outline.get("success"):
+            raise RuntimeError(outline.get("error") or "大纲生成失败")
+        request_id = outline["request_id"]
+        result.record(stage, time.perf_counter() - start)
+
+        stage = "content"
+        start = time.perf_counter()
+        response = await client.post(f"/api/generate-content/{request_id}",
+                                     params={"use_cache": str(args.use_cache).lower()})
+        response.raise_for_status()
+        if not response.json().get("success"):
+            raise RuntimeError(response.json().get("message") or "内容生成失败")
+        result.record(stage, time.perf_counter() - start)
+
+        if not args.skip_document:
+            stage = "document"
+            start = time.perf_counter()
+            response = await client.post(f"/api/generate-document/{request_id}")
+            response.raise_for_status()
+            if not response.json().get("success"):
+                raise RuntimeError(response.json().get("message") or "文档生成失败")
+            result.record(stage, time.perf_counter() - start)
+
+        result.record("flow", time.perf_counter() - flow_start)
+    except Exception as e:
+        result.fail(stage, f"{type(e).__name__}: {e}")
+
+async def run_user(client: httpx.AsyncClient, args: argparse.Namespace, user: int, result: LoadTestResult) -> None:
+    """单个虚拟用户：按顺序执行若干次流程"""
+    if args.ramp_up > 0:
+        await asyncio.sleep(args.ramp_up * user / max(1, args.users))
+    for iteration in range(args.iterations):
+        await run_flow(client, args, user, iteration, result)
+
+async def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    result = LoadTestResult()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(run_user(client, args, user, result) for user in range(args.users)))
+        result.finished_at = time.perf_counter()
+
+        summary = result.summary()
+        try:
+            stats = await client.get("/api/llm-stats")
+            if stats.status_code == 200:
+                summary["llm_stats"] = stats.json()
+        except httpx.HTTPError:
+            pass
+    return summary
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    def fmt(value: Optional[float]) -> str:
+        return f"{value:8.3f}" if value is not None else "       -"
+
+    print(f"总耗时: {summary['elapsed']:.2f}s  完成流程: {summary['completed_flows']}  "
+          f"失败: {summary['failed_flows']}  吞吐量: {summary['throughput_per_second']:.3f} 流程/秒")
+    print(f"{'阶段':<10}{'次数':>6}{'错误':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, data in summary["stages"].items():
+        print(f"{stage:<10}{data['count']:>6}{data['errors']:>6}  {fmt(data['p50'])}  {fmt(data['p95'])}  "
+              f"{fmt(data['p99'])}  {fmt(data['max'])}")
+    for sample in summary["error_samples"]:
+        print(f"错误示例: {sample}")
+
+def main():
+    parser = argparse.ArgumentParser(description="文档生成流程负载测试")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--iterations", type=int, default=1, help="每个用户执行的流程次数")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="在多少秒内逐步启动全部用户")
+    parser.add_argument("--topics", nargs="+", default=["人工智能", "云计算", "区块链", "新能源汽车"])
+    parser.add_argument("--unique-topics", action="store_true", help="为每次流程生成不同的主题，避免缓存和请求合并")
+    parser.add_argument("--document-type", choices=["ppt", "word"], default="ppt")
+    parser.add_argument("--page-limit", type=int, default=5)
+    parser.add_argument("--outline-strategy", choices=["sequential", "plan", "speculative", "streaming"], default="sequential",
+                        help="标题和大纲的生成方式")
+    parser.add_argument("--use-cache", action="store_true", help="允许使用LLM响应缓存（默认跳过）")
+    parser.add_argument("--skip-document", action="store_true", help="不执行文档生成阶段")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_load_test(args))
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
+
+if __name__ == "__main__":
+    main()
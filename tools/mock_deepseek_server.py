@@ -0,0 +1,338 @@
+"""
+本地的DeepSeek/OpenAI兼容模拟服务器，用于负载测试和延迟测试。
+
+将DEEPSEEK_API_URL指向本服务即可在不消耗真实API额度的情况下运行整个平台:
+
+    python -m tools.mock_deepseek_server --port 9000 --latency-dist lognormal --latency-mean 1.5 \
+        --tokens-per-second 40 --rate-429 0.05 --rate-500 0.02 --seed 42
+    DEEPSEEK_API_URL=http://127.0.0.1:9000 DEEPSEEK_API_KEY=mock uvicorn app.main:app
+
+同一请求内容第N次到达时的延迟、错误和输出只由(seed, 请求内容, N)决定，
+因此在并发交错顺序不同的多次运行之间结果保持一致。
+"""
+
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+class MockConfig:
+    """模拟服务器的行为配置"""
+
+    def __init__(
+        self,
+        latency_dist: str = "fixed",
+        latency_mean: float = 0.5,
+        latency_stddev: float = 0.2,
+        latency_min: float = 0.0,
+        latency_max: float = 30.0,
+        tokens_per_second: float = 0.0,
+        rate_429: float = 0.0,
+        rate_500: float = 0.0,
+        rate_503: float = 0.0,
+        rate_timeout: float = 0.0,
+        timeout_hang: float = 300.0,
+        retry_after: Optional[float] = 1.0,
+        short_rate: float = 0.0,
+        seed: int = 0
+    ):
+        """
+        Args:
+            latency_dist: 首包延迟分布，fixed / uniform / normal / lognormal
+            latency_mean: 平均延迟（秒）
+            latency_stddev: 延迟标准差（normal/lognormal）
+            latency_min: 延迟下限，uniform分布的下界
+            latency_max: 延迟上限，uniform分布的上界
+            tokens_per_second: 生成速度；>0时非流式响应也会按输出长度额外等待
+            rate_429 / rate_500 / rate_503: 注入对应错误的概率
+            rate_timeout: 请求挂起timeout_hang秒（模拟超时）的概率
+            retry_after: 429/503响应携带的Retry-After秒数，None表示不携带
+            short_rate: 章节内容只返回约一半要求长度的概率（用于测试长度补足）
+            seed: 随机种子
+        """
+        self.latency_dist = latency_dist
+        self.latency_mean = latency_mean
+        self.latency_stddev = latency_stddev
+        self.latency_min = latency_min
+        self.latency_max = latency_max
+        self.tokens_per_second = tokens_per_second
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_503 = rate_503
+        self.rate_timeout = rate_timeout
+        self.timeout_hang = timeout_hang
+        self.retry_after = retry_after
+        self.short_rate = short_rate
+        self.seed = seed
+
+class MockDeepSeek:
+    """模拟chat/completions接口的确定性行为"""
+
+    # 模拟服务端前缀缓存的块大小（字符）
+    PREFIX_BLOCK = 128
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.seen: Dict[str, int] = defaultdict(int)
+        self.prefix_blocks = set()
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def _rng(self, messages: List[Dict[str, str]]) -> random.Random:
+        """由种子、请求内容和该内容的到达次数派生随机数发生器"""
+        digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        occurrence = self.seen[digest]
+        self.seen[digest] += 1
+        return random.Random(f"{self.config.seed}:{digest}:{occurrence}")
+
+    def _latency(self, rng: random.Random) -> float:
+        config = self.config
+        if config.latency_dist == "uniform":
+            value = rng.uniform(config.latency_min, config.latency_max)
+        elif config.latency_dist == "normal":
+            value = rng.gauss(config.latency_mean, config.latency_stddev)
+        elif config.latency_dist == "lognormal":
+            # 按给定的均值和标准差换算对数正态参数
+            mean = max(config.latency_mean, 1e-6)
+            variance = config.latency_stddev ** 2
+            sigma2 = math.log(1 + variance / mean ** 2)
+            mu = math.log(mean) - sigma2 / 2
+            value = rng.lognormvariate(mu, sigma2 ** 0.5)
+        else:
+            value = config.latency_mean
+        return min(config.latency_max, max(config.latency_min, value))
+
+    def _fault(self, rng: random.Random) -> Optional[str]:
+        """按配置的概率抽取要注入的故障"""
+        roll = rng.random()
+        for fault, rate in (
+            ("429", self.config.rate_429),
+            ("500", self.config.rate_500),
+            ("503", self.config.rate_503),
+            ("timeout", self.config.rate_timeout)
+        ):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def _cached_prefix_chars(self, messages: List[Dict[str, str]]) -> int:
+        """按块模拟服务端前缀缓存，返回命中的前缀字符数"""
+        text = json.dumps(messages, ensure_ascii=False)
+        hit = 0
+        missed = False
+        for end in range(self.PREFIX_BLOCK, len(text) + 1, self.PREFIX_BLOCK):
+            block = hashlib.sha1(text[:end].encode("utf-8")).hexdigest()
+            if not missed and block in self.prefix_blocks:
+                hit = end
+            else:
+                missed = True
+                self.prefix_blocks.add(block)
+        return hit
+
+    def respond(self, messages: List[Dict[str, str]], max_tokens: int, rng: random.Random) -> str:
+        """根据提示类型生成确定性的响应文本"""
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        user = "\n".join(m["content"] for m in messages if m["role"] == "user")
+        topic_match = re.search(r"主题:\s*(\S+)", user)
+        topic = topic_match.group(1) if topic_match else "示例主题"
+
+        if "标题生成专家" in system:
+            return f"{topic}：原理、实践与展望"
+
+        if "文档策划专家" in system:
+            count_match = re.search(r"约(\d+)个章节", user)
+            count = int(count_match.group(1)) if count_match else 3
+            plan = {"title": f"{topic}：原理、实践与展望"}
+            plan.update(canned_outline(topic, count))
+            return json.dumps(plan, ensure_ascii=False)
+
+        if "文档结构设计专家" in system:
+            points_match = re.search(r"章节要点:\n((?:- .*\n?)+)", user)
+            points = [line[2:].strip() for line in points_match.group(1).splitlines()] if points_match else ["要点"]
+            count_match = re.search(r"规划(\d+)个段落", user)
+            count = int(count_match.group(1)) if count_match else 2
+            subsections = [
+                {"title": point, "paragraphs": [f"{point}的第{index + 1}个方面" for index in range(count)]}
+                for point in points
+            ]
+            return json.dumps({"subsections": subsections}, ensure_ascii=False)
+
+        if "大纲" in system and "JSON" in (system + user):
+            count_match = re.search(r"约(\d+)个章节", user)
+            count = int(count_match.group(1)) if count_match else 3
+            return json.dumps(canned_outline(topic, count), ensure_ascii=False)
+
+        # 续写请求只生成要求补充的长度
+        last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        continue_match = re.search(r"补充约(\d+)字符", last_user)
+        length_match = continue_match or re.search(r"(?:至少|约)(\d+)字符", user)
+        target = int(length_match.group(1)) if length_match else 400
+        if not continue_match and rng.random() < self.config.short_rate:
+            target //= 2
+        # 输出长度受max_tokens约束（按每token约1.5个汉字估算）
+        target = min(int(target * rng.uniform(1.0, 1.3)), int(max_tokens * 1.5))
+        sentence = f"{topic}的这一部分包含若干关键概念，需要结合具体场景进行分析和说明。"
+        paragraphs = []
+        length = 0
+        while length < target:
+            paragraphs.append(f"- {sentence}")
+            length += len(sentence) + 2
+        return "\n".join(paragraphs)
+
+    def usage(self, messages: List[Dict[str, str]], content: str) -> Dict[str, int]:
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        prompt_tokens = max(1, int(prompt_chars / 1.5))
+        hit_tokens = min(prompt_tokens, int(self._cached_prefix_chars(messages) / 1.5))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": max(1, int(len(content) / 1.5)),
+            "total_tokens": prompt_tokens + max(1, int(len(content) / 1.5)),
+            "prompt_cache_hit_tokens": hit_tokens,
+            "prompt_cache_miss_tokens": prompt_tokens - hit_tokens
+        }
+
+def canned_outline(topic: str, count: int) -> Dict[str, Any]:
+    """返回固定格式的大纲JSON"""
+    templates = [
+        ("概述与背景", ["基本概念", "发展历程", "研究意义"]),
+        ("核心原理", ["理论基础", "关键方法", "技术框架"]),
+        ("典型应用", ["行业案例", "实施流程", "效果评估"]),
+        ("挑战与对策", ["主要问题", "解决思路", "最佳实践"]),
+        ("未来展望", ["发展趋势", "前沿方向", "总结建议"]),
+    ]
+    sections = []
+    for index in range(count):
+        name, points = templates[index % len(templates)]
+        suffix = "" if index < len(templates) else f"（{index // len(templates) + 1}）"
+        sections.append({"title": f"{topic}{name}{suffix}", "content": [f"{topic}{point}" for point in points]})
+    return {"outline": sections, "estimated_pages": count + 2}
+
+def create_app(config: MockConfig) -> FastAPI:
+    """创建模拟服务器应用"""
+    app = FastAPI(title="Mock DeepSeek")
+    mock = MockDeepSeek(config)
+
+    def _error(status: int) -> JSONResponse:
+        headers = {}
+        if status in (429, 503) and config.retry_after is not None:
+            headers["Retry-After"] = str(config.retry_after)
+        return JSONResponse({"error": {"message": f"mock error {status}"}}, status_code=status, headers=headers)
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        max_tokens = int(body.get("max_tokens", 2000))
+        stream = bool(body.get("stream"))
+        rng = mock._rng(messages)
+        mock.counters["requests"] += 1
+
+        fault = mock._fault(rng)
+        latency = mock._latency(rng)
+        if fault == "timeout":
+            mock.counters["timeout"] += 1
+            await asyncio.sleep(config.timeout_hang)
+            return _error(504)
+        await asyncio.sleep(latency)
+        if fault:
+            mock.counters[fault] += 1
+            return _error(int(fault))
+
+        content = mock.respond(messages, max_tokens, rng)
+        usage = mock.usage(messages, content)
+        created = int(time.time())
+        mock.counters["ok"] += 1
+
+        if not stream:
+            if config.tokens_per_second > 0:
+                await asyncio.sleep(usage["completion_tokens"] / config.tokens_per_second)
+            return {
+                "id": f"mock-{created}",
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            }
+
+        async def event_stream():
+            # 每个token约1.5个汉字，按tokens_per_second匀速输出
+            step = 3
+            delay = (2.0 / config.tokens_per_second) if config.tokens_per_second > 0 else 0
+            for start in range(0, len(content), step):
+                chunk = {
+                    "id": f"mock-{created}",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + step]}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if delay:
+                    await asyncio.sleep(delay)
+            final = {"id": f"mock-{created}", "object": "chat.completion.chunk", "created": created,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(final)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    @app.get("/mock/stats")
+    async def stats():
+        """模拟服务器收到的请求和注入的故障计数"""
+        return dict(mock.counters)
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="本地DeepSeek/OpenAI兼容模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "normal", "lognormal"], default="fixed")
+    parser.add_argument("--latency-mean", type=float, default=0.5)
+    parser.add_argument("--latency-stddev", type=float, default=0.2)
+    parser.add_argument("--latency-min", type=float, default=0.0)
+    parser.add_argument("--latency-max", type=float, default=30.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--rate-503", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--timeout-hang", type=float, default=300.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--short-rate", type=float, default=0.0, help="章节内容过短的概率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_dist=args.latency_dist,
+        latency_mean=args.latency_mean,
+        latency_stddev=args.latency_stddev,
+        latency_min=args.latency_min,
+        latency_max=args.latency_max,
+        tokens_per_second=args.tokens_per_second,
+        rate_429=args.rate_429,
+        rate_500=args.rate_500,
+        rate_503=args.rate_503,
+        rate_timeout=args.rate_timeout,
+        timeout_hang=args.timeout_hang,
+        retry_after=args.retry_after if args.retry_after >= 0 else None,
+        short_rate=args.short_rate,
+        seed=args.seed
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
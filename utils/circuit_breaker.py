@@ -0,0 +1,232 @@
+"""
+LLM上游熔断器。
+在一个共享的时间窗口内统计上游请求的失败率，失败率过高时熔断（open），
+熔断期间的调用直接使用离线生成器而不再重试；冷却结束后进入半开（half-open）状态，
+放行少量探测请求，探测成功则恢复（closed），失败则重新熔断。
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Any, Optional, Deque, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，拒绝本次上游调用"""
+
+class BreakerCall:
+    """一次经过熔断器放行的上游调用，用于记录结果"""
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        self._breaker = breaker
+        self.outcome: Optional[str] = None
+        self.probe = False
+
+    def record(self, status_code: int) -> None:
+        """根据HTTP状态码记录结果
+
+        5xx视为上游故障；429属于限流（由限流器处理），其他4xx是请求本身的问题，二者都不计入失败率。
+        """
+        if status_code < 400:
+            self.outcome = "success"
+        elif status_code >= 500:
+            self.outcome = "failure"
+        else:
+            self.outcome = "ignored"
+
+    def __enter__(self) -> "BreakerCall":
+        self.probe = self._breaker.state == HALF_OPEN
+        if not self._breaker.allow_request():
+            raise CircuitOpenError("熔断器已打开")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            # 调用方取消不代表上游状况
+            outcome = "ignored"
+        elif exc_type is not None:
+            # 网络错误、超时等异常
+            outcome = "failure"
+        else:
+            outcome = self.outcome or "success"
+        self._breaker.release(outcome, probe=self.probe)
+
+class CircuitBreaker:
+    """基于滑动时间窗口失败率的三态熔断器"""
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_calls: int = 5,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+        enabled: bool = True
+    ):
+        """初始化熔断器
+
+        Args:
+            failure_rate: 窗口内失败率达到该值时熔断
+            min_calls: 窗口内至少有多少次调用才判断失败率
+            window_seconds: 统计窗口长度（秒）
+            open_seconds: 熔断持续时长，之后进入半开状态
+            half_open_calls: 半开状态下放行的探测请求数，全部成功后恢复
+            enabled: 是否启用熔断
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.enabled = enabled
+
+        self._state = CLOSED
+        self._window: Deque[Tuple[float, bool]] = deque()
+        self._opened_until = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._changed_at = time.time()
+
+        self.times_opened = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        """根据环境变量创建熔断器"""
+        return cls(
+            failure_rate=float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+            min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+            window_seconds=float(os.getenv("LLM_BREAKER_WINDOW", "60")),
+            open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30")),
+            half_open_calls=int(os.getenv("LLM_BREAKER_HALF_OPEN_CALLS", "1")),
+            enabled=os.getenv("LLM_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+        )
+
+    @property
+    def state(self) -> str:
+        """当前状态；熔断时长结束后自动转为半开"""
+        if self._state == OPEN and time.monotonic() >= self._opened_until:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """是否正在熔断（调用方应直接降级）"""
+        return self.enabled and self.state == OPEN
+
+    def call(self) -> BreakerCall:
+        """包裹一次上游调用（上下文管理器），不允许调用时抛出CircuitOpenError
+
+        用法:
+            with breaker.call() as call:
+                response = await client.post(...)
+                call.record(response.status_code)
+        """
+        return BreakerCall(self)
+
+    def allow_request(self) -> bool:
+        """判断是否放行一次上游调用；半开状态下占用一个探测名额"""
+        if not self.enabled:
+            return True
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes_in_flight < self.half_open_calls:
+            self._probes_in_flight += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self, outcome: str, probe: bool = False) -> None:
+        """记录一次已放行调用的结果
+
+        Args:
+            outcome: "success" / "failure" / "ignored"
+            probe: 是否为半开状态下放行的探测请求
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+
+        if probe:
+            if self._state != HALF_OPEN:
+                # 状态已被其他调用改变，过期的探测结果不再生效
+                return
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if outcome == "failure":
+                self._open(now)
+            elif outcome == "success":
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            return
+
+        if outcome == "ignored":
+            return
+        self._window.append((now, outcome == "failure"))
+        self._prune(now)
+        if self._state == CLOSED:
+            calls, failures = self._counts()
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open(now)
+
+    def reset(self) -> None:
+        """手动恢复为关闭状态并清空统计窗口"""
+        self._window.clear()
+        self._transition(CLOSED)
+
+    def _open(self, now: float) -> None:
+        self._opened_until = now + self.open_seconds
+        self.times_opened += 1
+        self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        previous = self._state
+        self._state = state
+        self._changed_at = time.time()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == CLOSED:
+            self._window.clear()
+        print(f"LLM熔断器状态: {previous} -> {state}")
+
+    def _prune(self, now: float) -> None:
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+
+    def _counts(self) -> Tuple[int, int]:
+        calls = len(self._window)
+        failures = sum(1 for _, failed in self._window if failed)
+        return calls, failures
+
+    def stats(self) -> Dict[str, Any]:
+        """返回熔断器状态"""
+        now = time.monotonic()
+        state = self.state
+        self._prune(now)
+        calls, failures = self._counts()
+        return {
+            "enabled": self.enabled,
+            "state": state,
+            "state_since": self._changed_at,
+            "open_for": round(max(0.0, self._opened_until - now), 2) if state == OPEN else 0.0,
+            "window_seconds": self.window_seconds,
+            "window_calls": calls,
+            "window_failures": failures,
+            "window_failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "failure_rate_threshold": self.failure_rate,
+            "min_calls": self.min_calls,
+            "open_seconds": self.open_seconds,
+            "half_open_probes_in_flight": self._probes_in_flight,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
+
+# 进程内共享的熔断器实例（所有客户端共用同一个失败窗口）
+llm_breaker = CircuitBreaker.from_env()
@@ -0,0 +1,144 @@
+"""
+请求级截止时间（deadline）。
+一次请求的总时间预算保存在上下文变量中，工作流的各个节点和其中的LLM调用（包括创建的任务）都能读取剩余时间：
+LLM调用的等待时间不超过剩余预算，超时后回退到离线生成器；章节生成按剩余时间逐级降级为更省时的策略。
+"""
+
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
+
+# 服务端默认的请求截止时间（秒），0表示不限制；请求中指定的deadline优先
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "0"))
+# 剩余时间低于这些阈值（秒）时依次降级：不再补足长度 → 缩短输出 → 直接使用离线模板
+DEADLINE_NO_EXPANSION_SECONDS = float(os.getenv("DEADLINE_NO_EXPANSION_SECONDS", "30"))
+DEADLINE_SHORT_OUTPUT_SECONDS = float(os.getenv("DEADLINE_SHORT_OUTPUT_SECONDS", "15"))
+DEADLINE_OFFLINE_SECONDS = float(os.getenv("DEADLINE_OFFLINE_SECONDS", "5"))
+# 缩短输出时章节调用的max_tokens上限
+DEADLINE_SHORT_MAX_TOKENS = int(os.getenv("DEADLINE_SHORT_MAX_TOKENS", "512"))
+
+# 生成策略（按降级程度从低到高）
+FULL = "full"                   # 正常生成
+NO_EXPANSION = "no_expansion"   # 内容过短时不再续写或扩写
+SHORT_OUTPUT = "short_output"   # 缩短max_tokens，且不补足长度
+OFFLINE = "offline"             # 不调用模型，直接使用离线模板
+TIMED_OUT = "timed_out"         # 调用模型时预算耗尽，回退到离线生成器
+
+_SEVERITY = {FULL: 0, NO_EXPANSION: 1, SHORT_OUTPUT: 2, OFFLINE: 3, TIMED_OUT: 4}
+
+class Deadline:
+    """一次请求的截止时间，以及因预算不足而降级的章节
+    
+    降级的章节按章节指纹记录（大纲中可能有同名的章节），返回给客户端时由调用方对应回章节标题。
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        # 章节指纹 -> 实际使用的降级策略（同一章节多次降级时保留最严重的）
+        self.degraded: Dict[str, str] = {}
+
+    def remaining(self) -> float:
+        """剩余的秒数（不小于0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def strategy(self) -> str:
+        """按剩余时间选择章节的生成策略"""
+        remaining = self.remaining()
+        if remaining <= DEADLINE_OFFLINE_SECONDS:
+            return OFFLINE
+        if remaining <= DEADLINE_SHORT_OUTPUT_SECONDS:
+            return SHORT_OUTPUT
+        if remaining <= DEADLINE_NO_EXPANSION_SECONDS:
+            return NO_EXPANSION
+        return FULL
+
+    def degrade(self, section_key: str, strategy: str) -> None:
+        """记录章节（按指纹）实际使用的降级策略"""
+        if strategy == FULL:
+            return
+        if _SEVERITY[strategy] > _SEVERITY.get(self.degraded.get(section_key, FULL), 0):
+            self.degraded[section_key] = strategy
+
+class DeadlineStats:
+    """设置了截止时间的请求数、超时的请求数，以及各降级策略被使用的章节数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.expired = 0
+        self.degraded: Dict[str, int] = {}
+
+    def record(self, deadline: Deadline) -> None:
+        self.requests += 1
+        if deadline.expired:
+            self.expired += 1
+        for strategy in deadline.degraded.values():
+            self.degraded[strategy] = self.degraded.get(strategy, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "default_seconds": REQUEST_DEADLINE_SECONDS,
+            "requests": self.requests,
+            "expired": self.expired,
+            "degraded_sections": dict(self.degraded)
+        }
+
+deadline_stats = DeadlineStats()
+
+# 当前上下文的截止时间（由deadline_scope设置）
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+def resolve_deadline(seconds: Optional[float]) -> Optional[float]:
+    """请求中指定的截止时间优先，未指定时使用REQUEST_DEADLINE_SECONDS；不大于0表示不限制"""
+    if seconds is None:
+        seconds = REQUEST_DEADLINE_SECONDS
+    return seconds if seconds and seconds > 0 else None
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """在代码块内（包括其中创建的任务）应用截止时间，seconds为None时不限制
+
+    外层已有更早的截止时间时沿用外层的。
+
+    用法:
+        with deadline_scope(60) as deadline:
+            await run_document_workflow(...)
+        print(deadline.degraded)
+    """
+    outer = _deadline.get()
+    if seconds is None or (outer is not None and outer.remaining() <= seconds):
+        yield outer
+        return
+    deadline = Deadline(seconds)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+        deadline_stats.record(deadline)
+
+def current_deadline() -> Optional[Deadline]:
+    """当前上下文的截止时间，未设置时为None"""
+    return _deadline.get()
+
+def remaining_time() -> Optional[float]:
+    """当前上下文剩余的秒数，未设置截止时间时为None"""
+    deadline = _deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+def current_strategy() -> str:
+    """当前上下文中章节应使用的生成策略"""
+    deadline = _deadline.get()
+    return deadline.strategy() if deadline is not None else FULL
+
+def mark_degraded(section_key: str, strategy: str) -> None:
+    """记录章节（按指纹）使用了降级策略（未设置截止时间时忽略）"""
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.degrade(section_key, strategy)
@@ -1,14 +1,23 @@
 import os
 import json
 import asyncio
+import contextvars
 import httpx
-from typing import Dict, Any, Optional, List, Union, Type, Tuple, Mapping, cast
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Union, Type, Tuple, Mapping, AsyncIterator, cast
 import time
 import random
 from dotenv import load_dotenv
 import requests
 import logging
 
+from utils.circuit_breaker import llm_breaker, CircuitOpenError
+from utils.deadline import remaining_time
+from utils.llm_cache import LLMCache, make_cache_key
+from utils.llm_limiter import llm_limiter, parse_retry_after, THROTTLE_STATUS_CODES
+from utils.llm_router import EndpointRouter, LLMEndpoint
+from utils.singleflight import SingleFlight
+
 # 加载环境变量
 load_dotenv()
 
@@ -23,6 +32,39 @@ from langchain_openai import ChatOpenAI
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 未提供system消息时使用的默认系统提示
+DEFAULT_SYSTEM_PROMPT = "你是一位专业的写作助手，擅长生成专业、清晰、连贯的内容。"
+
+# 当前上下文的token用量累加器（由usage_scope设置）
+_usage_scope: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("llm_usage_scope", default=None)
+
+@contextmanager
+def usage_scope():
+    """统计代码块内（包括其中创建的任务）实际发往上游的LLM调用的token用量
+
+    命中响应缓存或合并到其他请求的调用不计入；deadline_fallbacks为因请求截止时间耗尽而回退到离线生成器的调用次数，
+    offline_fallbacks为使用离线生成器的全部调用次数（包括无API密钥、熔断器打开、请求失败和截止时间耗尽）。
+
+    用法:
+        with usage_scope() as usage:
+            await llm.ainvoke(messages)
+        print(usage["completion_tokens"])
+    """
+    usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "deadline_fallbacks": 0, "offline_fallbacks": 0}
+    token = _usage_scope.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage_scope.reset(token)
+
+def _h2_available() -> bool:
+    """检查是否安装了HTTP/2支持（h2包）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 class DeepSeekLangChain(BaseChatModel):
     """DeepSeek API客户端的LangChain包装器"""
     
@@ -78,10 +120,13 @@ class DeepSeekLangChain(BaseChatModel):
         Returns:
             ChatResult对象
         """
-        prompt = self._convert_messages_to_prompt(messages)
-        
-        # 调用底层客户端
-        response = await self._client.generate_content(prompt)
+        # 保留角色信息，直接以多条消息调用底层客户端
+        response = await self._client.chat(
+            self._convert_messages_to_dicts(messages),
+            max_tokens=kwargs.get("max_tokens", 2000),
+            temperature=kwargs.get("temperature", 0.5),
+            response_format=kwargs.get("response_format")
+        )
         
         # 创建生成结果
         message = AIMessage(content=response)
@@ -108,28 +153,29 @@ class DeepSeekLangChain(BaseChatModel):
         """
         raise NotImplementedError("DeepSeekLangChain只支持异步操作")
     
-    def _convert_messages_to_prompt(self, messages: List[BaseMessage]) -> str:
-        """将消息列表转换为单一提示文本
+    def _convert_messages_to_dicts(self, messages: List[BaseMessage]) -> List[Dict[str, str]]:
+        """将LangChain消息列表转换为chat/completions的消息格式
         
         Args:
             messages: 消息列表
             
         Returns:
-            合并后的提示文本
+            带role字段的消息字典列表
         """
-        prompt_parts = []
-        
-        for i, message in enumerate(messages):
-            if isinstance(message, SystemMessage):
-                prompt_parts.append(f"系统: {message.content}")
-            elif isinstance(message, HumanMessage):
-                prompt_parts.append(f"用户: {message.content}")
-            elif isinstance(message, AIMessage):
-                prompt_parts.append(f"助手: {message.content}")
-            else:
-                prompt_parts.append(f"消息{i}: {message.content}")
-        
-        return "\n\n".join(prompt_parts)
+        return convert_messages(messages)
+
+def convert_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    """将LangChain消息转换为OpenAI兼容的 {"role", "content"} 字典"""
+    converted = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            role = "system"
+        elif isinstance(message, AIMessage):
+            role = "assistant"
+        else:
+            role = "user"
+        converted.append({"role": role, "content": message.content})
+    return converted
 
 class DeepSeekClient:
     """DeepSeek API客户端"""
@@ -137,13 +183,18 @@ class DeepSeekClient:
     def __init__(self):
         """初始化客户端"""
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
-        if not self.api_key:
+        self.base_url = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com")
+        
+        # 多端点路由（DEEPSEEK_ENDPOINTS未配置时只有DEEPSEEK_API_URL一个端点）
+        self.router = EndpointRouter.from_env(self.base_url, self.api_key)
+        if not self.router.has_credentials:
             print("警告: 未找到DEEPSEEK_API_KEY环境变量")
         
-        self.base_url = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com")
         self.model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
         self.max_retries = int(os.getenv("API_MAX_RETRIES", "3"))
         self.retry_delay = float(os.getenv("API_RETRY_DELAY", "2.0"))
+        # 429/503限流时重新排队的最大次数（不占用max_retries）
+        self.max_throttle_retries = int(os.getenv("API_MAX_THROTTLE_RETRIES", "8"))
         
         # 客户端配置
         self.timeout = float(os.getenv("API_TIMEOUT", "60.0"))
@@ -151,101 +202,590 @@ class DeepSeekClient:
             "timeout": httpx.Timeout(self.timeout),
             "follow_redirects": True
         }
+        
+        # 连接池配置：整个应用生命周期共享一个AsyncClient，复用TCP/TLS连接
+        self.max_connections = int(os.getenv("API_MAX_CONNECTIONS", "20"))
+        self.max_keepalive_connections = int(os.getenv("API_MAX_KEEPALIVE_CONNECTIONS", "10"))
+        self.keepalive_expiry = float(os.getenv("API_KEEPALIVE_EXPIRY", "30.0"))
+        self.http2 = os.getenv("API_HTTP2", "true").lower() in ("1", "true", "yes") and _h2_available()
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._pool_requests = 0
+        self._pool_clients_created = 0
+        
+        # 响应缓存（内存LRU + SQLite）
+        self.cache = LLMCache.from_env()
+        
+        # 进程级自适应并发限流器（所有客户端实例共享）
+        self.limiter = llm_limiter
+        
+        # 进程级熔断器：上游持续故障时直接降级到离线生成器
+        self.breaker = llm_breaker
+        
+        # 相同请求的单飞合并
+        self.singleflight = SingleFlight()
+        
+        # 累计token用量（含服务端前缀缓存命中）
+        self.usage = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": 0
+        }
+        # 因请求截止时间耗尽而回退到离线生成器的调用次数
+        self.deadline_fallbacks = 0
 
         # 添加has_valid_key属性
-        self.has_valid_key = bool(self.api_key)
+        self.has_valid_key = self.router.has_credentials
         
         # 添加llm属性，用于与LangChain集成
         self.llm = DeepSeekLangChain(self)
     
+    async def start(self) -> None:
+        """打开共享的HTTP连接池（在FastAPI启动时调用）"""
+        self._get_http_client()
+        logger.info(
+            f"DeepSeek连接池已启动: http2={self.http2}, "
+            f"max_connections={self.max_connections}, "
+            f"max_keepalive={self.max_keepalive_connections}"
+        )
+    
+    async def aclose(self) -> None:
+        """关闭共享的HTTP连接池（在FastAPI关闭时调用）"""
+        if self._http_client is not None:
+            client = self._http_client
+            self._http_client = None
+            await client.aclose()
+            logger.info("DeepSeek连接池已关闭")
+        self.cache.close()
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """获取共享的AsyncClient，未启动时按需创建"""
+        if self._http_client is None or self._http_client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            )
+            self._http_client = httpx.AsyncClient(
+                limits=limits,
+                http2=self.http2,
+                **self.client_params
+            )
+            self._pool_clients_created += 1
+        return self._http_client
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """返回连接池状态，用于监控"""
+        stats: Dict[str, Any] = {
+            "open": self._http_client is not None and not self._http_client.is_closed,
+            "http2_enabled": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "keepalive_expiry": self.keepalive_expiry,
+            "clients_created": self._pool_clients_created,
+            "requests_sent": self._pool_requests,
+            "connections": 0,
+            "idle_connections": 0,
+            "active_connections": 0,
+        }
+        if not stats["open"]:
+            return stats
+        
+        # httpcore没有公开的统计接口，这里尽力读取连接池内部状态
+        try:
+            pool = self._http_client._transport._pool
+            connections = list(pool.connections)
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+            stats["active_connections"] = stats["connections"] - stats["idle_connections"]
+        except Exception:
+            pass
+        return stats
+    
     async def ainvoke(self, messages):
         """实现与LangChain兼容的接口"""
         if isinstance(messages, list):
-            # 提取消息内容
-            prompt = messages[0].content if messages else ""
+            # 保留全部消息及其角色
+            content = await self.chat(convert_messages(messages))
         else:
-            prompt = str(messages)
-            
-        # 调用generate_content方法
-        content = await self.generate_content(prompt)
+            content = await self.generate_content(str(messages))
         
         # 返回AIMessage格式的响应
         from langchain_core.messages import AIMessage
         return AIMessage(content=content)
     
-    async def generate_content(self, prompt: str, max_tokens: int = 2000) -> str:
+    async def generate_content(self, prompt: str, max_tokens: int = 2000, use_cache: bool = True) -> str:
         """生成内容
         
         Args:
             prompt: 提示词
             max_tokens: 最大生成token数量
+            use_cache: 是否使用响应缓存，False时跳过本次调用的缓存读写
             
         Returns:
             生成的文本内容
         """
-        if not self.api_key:
+        return await self.chat([{"role": "user", "content": prompt}], max_tokens=max_tokens, use_cache=use_cache)
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        use_cache: bool = True,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """以多条角色消息调用模型
+        
+        Args:
+            messages: {"role", "content"} 消息列表，未包含system消息时使用默认系统提示
+            max_tokens: 最大生成token数量
+            temperature: 采样温度
+            use_cache: 是否使用响应缓存，False时跳过本次调用的缓存读写
+            response_format: 可选的输出格式，如{"type": "json_object"}（JSON模式）
+            
+        Returns:
+            生成的文本内容
+        """
+        if not self.has_valid_key:
             print("无API密钥，使用离线备用生成器")
-            return self._offline_generate(prompt)
+            return self._offline_generate(self._offline_prompt(messages))
             
         # 准备API请求数据
-        url = f"{self.base_url}/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        data = self._build_payload(messages, max_tokens, temperature, response_format=response_format)
+        
+        # 先查缓存，相同请求直接返回
+        cache_key = make_cache_key(data["model"], data["messages"], data["temperature"], data["max_tokens"], response_format)
+        cached = await self.cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            return cached
+        
+        if self.breaker.is_open:
+            print("LLM熔断器已打开，直接使用离线备用生成器")
+            return self._offline_generate(self._offline_prompt(messages))
+        
+        # 请求设置了截止时间时，排队、重试和等待响应的总时间不超过剩余预算
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            print("请求截止时间已到，使用离线备用生成器")
+            self._record_deadline_fallback()
+            return self._offline_generate(self._offline_prompt(messages))
+        
+        # 内容完全相同的并发请求合并为一次上游调用
+        try:
+            content = await asyncio.wait_for(
+                self.singleflight.do(cache_key, lambda: self._request_completion(data)),
+                timeout=remaining
+            )
+        except asyncio.TimeoutError:
+            print(f"等待模型响应超过请求剩余时间（{remaining:.1f}秒），使用离线备用生成器")
+            self._record_deadline_fallback()
+            return self._offline_generate(self._offline_prompt(messages))
+        if content is None:
+            # 离线生成的内容不写入缓存
+            print("API请求失败，使用离线备用生成器")
+            return self._offline_generate(self._offline_prompt(messages))
+        
+        await self.cache.set(cache_key, content, bypass=not use_cache)
+        return content
+    
+    async def _request_completion(self, data: Dict[str, Any]) -> Optional[str]:
+        """调用chat/completions接口（经过路由、限流和重试），失败时返回None"""
+        retries = {"error": 0, "throttle": 0}
+        while True:
+            result = await self._hedged_attempt(data)
+            if result["content"] is not None:
+                return result["content"]
+            if result.get("fatal"):
+                return None
+            if result.get("circuit_open"):
+                print("LLM熔断器未放行请求（熔断中或半开探测名额已满），停止重试")
+                return None
+            
+            if await self._should_retry(result["status_code"], retries):
+                continue
+            
+            # 如果重试次数用尽或不需要重试
+            if result["status_code"] is None:
+                print(f"网络连接失败，重试次数已用尽")
+            return None
+    
+    async def _hedged_attempt(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """向最优端点发送请求；若超过对冲延迟仍未返回，再向另一端点发送副本，取先成功者"""
+        primary = self.router.choose()
+        if primary is None:
+            print("没有可用的LLM端点（未配置API密钥），不再重试")
+            return {"status_code": None, "content": None, "fatal": True}
+        
+        delay = self.router.hedge_delay(primary)
+        if delay is None:
+            return await self._attempt(primary, data)
+        
+        tasks = [asyncio.ensure_future(self._attempt(primary, data))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            
+            backup = self.router.choose(exclude=[primary])
+            if backup is None or not backup.is_healthy():
+                return await tasks[0]
+            
+            print(f"请求{primary.name}超过{delay:.2f}秒未返回，向{backup.name}发送对冲请求")
+            self.router.hedges_sent += 1
+            tasks.append(asyncio.ensure_future(self._attempt(backup, data)))
+            
+            pending = set(tasks)
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result["content"] is not None:
+                        if task is tasks[1]:
+                            self.router.hedges_won += 1
+                        return result
+            return result
+        finally:
+            # 取消落后的请求，释放连接和并发许可
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def _attempt(self, endpoint: LLMEndpoint, data: Dict[str, Any]) -> Dict[str, Any]:
+        """向指定端点发送一次请求，返回状态码和内容（失败时内容为None）"""
+        endpoint.in_flight += 1
+        try:
+            # 先经过熔断器，再到进程级限流器排队
+            with self.breaker.call() as breaker_call:
+                async with self.limiter.slot() as permit:
+                    client = self._get_http_client()
+                    self._pool_requests += 1
+                    started = time.monotonic()
+                    response = await client.post(endpoint.url, json=data, headers=endpoint.headers(), timeout=self.timeout)
+                    latency = time.monotonic() - started
+                    permit.record(response.status_code, response.headers.get("Retry-After"))
+                breaker_call.record(response.status_code)
+        
+        except CircuitOpenError:
+            return {"status_code": None, "content": None, "circuit_open": True}
+        
+        except httpx.TransportError as e:
+            # 连接、超时、读写和HTTP/2协议错误都属于端点故障：计入路由器的失败次数，可以重试或换端点
+            print(f"网络错误 ({type(e).__name__}): {str(e)}")
+            self.router.record_failure(endpoint)
+            return {"status_code": None, "content": None}
+        
+        except asyncio.CancelledError:
+            raise
+        
+        except Exception as e:
+            print(f"API调用时发生未知错误: {str(e)}")
+            return {"status_code": None, "content": None, "fatal": True}
+        
+        finally:
+            endpoint.in_flight -= 1
+        
+        if response.status_code == 200:
+            try:
+                result = response.json()
+                content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                # 响应体不完整或格式错误：按端点失败处理，由调用方重试或回退到离线生成器
+                print(f"API响应解析失败（{endpoint.name}）: {type(e).__name__}: {str(e)}")
+                self.router.record_failure(endpoint)
+                return {"status_code": None, "content": None}
+            self.router.record_success(endpoint, latency)
+            self._record_usage(result.get("usage"))
+            return {"status_code": 200, "content": content}
+        
+        print(f"API请求失败（{endpoint.name}），状态码: {response.status_code}, 响应: {response.text}")
+        retry_after = None
+        if response.status_code in THROTTLE_STATUS_CODES:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        self.router.record_failure(endpoint, retry_after)
+        return {"status_code": response.status_code, "content": None}
+    
+    async def _should_retry(self, status_code: Optional[int], retries: Dict[str, int]) -> bool:
+        """判断失败的请求是否需要重试，需要时先完成退避等待
+        
+        429/503属于限流：限流器已按Retry-After暂停放行，调用方只需重新排队，
+        不占用普通重试次数。网络错误（status_code为None）和5xx使用指数退避重试。
+        熔断器打开后不再重试，调用方直接降级。
+        """
+        if self.breaker.is_open:
+            return False
+        
+        if status_code in THROTTLE_STATUS_CODES:
+            if retries["throttle"] < self.max_throttle_retries:
+                retries["throttle"] += 1
+                print(f"上游限流，重新排队等待 ({retries['throttle']}/{self.max_throttle_retries})")
+                return True
+            return False
+        
+        if status_code is None or status_code in [500, 502, 504]:
+            retries["error"] += 1
+            if retries["error"] < self.max_retries:
+                # 指数退避重试
+                retry_delay = self.retry_delay * (2 ** (retries["error"] - 1)) + random.uniform(0, 1)
+                print(f"将在 {retry_delay:.2f} 秒后重试 ({retries['error']}/{self.max_retries})")
+                await asyncio.sleep(retry_delay)
+                return True
+        
+        return False
+    
+    def _build_payload(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float = 0.5,
+        stream: bool = False,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """构建chat/completions请求体
+        
+        消息原样发送，保证相同的前缀（系统提示、文档上下文）在多次请求间逐字节一致，
+        以便命中服务端的前缀缓存。
+        """
+        if not any(message["role"] == "system" for message in messages):
+            messages = [{"role": "system", "content": DEFAULT_SYSTEM_PROMPT}] + list(messages)
         data = {
             "model": self.model,
-            "messages": [
-                {"role": "system", "content": "你是一位专业的写作助手，擅长生成专业、清晰、连贯的内容。"},
-                {"role": "user", "content": prompt}
-            ],
+            "messages": messages,
             "max_tokens": max_tokens,
-            "temperature": 0.5
+            "temperature": temperature
         }
+        if response_format:
+            data["response_format"] = response_format
+        if stream:
+            data["stream"] = True
+            data["stream_options"] = {"include_usage": True}
+        return data
+    
+    def _record_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        """累计token用量，包括服务端前缀缓存命中的token数"""
+        if not usage:
+            return
+        # DeepSeek返回prompt_cache_hit_tokens，OpenAI兼容接口返回prompt_tokens_details.cached_tokens
+        cached_tokens = usage.get("prompt_cache_hit_tokens")
+        if cached_tokens is None:
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        
+        self.usage["requests"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += usage.get("completion_tokens", 0) or 0
+        self.usage["prompt_cache_hit_tokens"] += cached_tokens or 0
+        self.usage["prompt_cache_miss_tokens"] += usage.get(
+            "prompt_cache_miss_tokens", prompt_tokens - (cached_tokens or 0)
+        ) or 0
+        scope = _usage_scope.get()
+        if scope is not None:
+            scope["requests"] += 1
+            scope["prompt_tokens"] += prompt_tokens
+            scope["completion_tokens"] += usage.get("completion_tokens", 0) or 0
+        logger.info(f"LLM用量: prompt={prompt_tokens}, 前缀缓存命中={cached_tokens}, completion={usage.get('completion_tokens')}")
+    
+    def _record_deadline_fallback(self) -> None:
+        """记录一次因请求截止时间耗尽而回退到离线生成器的调用"""
+        self.deadline_fallbacks += 1
+        scope = _usage_scope.get()
+        if scope is not None:
+            scope["deadline_fallbacks"] += 1
+    
+    def usage_stats(self) -> Dict[str, Any]:
+        """返回累计token用量和前缀缓存命中率"""
+        stats = dict(self.usage)
+        prompt_tokens = stats["prompt_tokens"]
+        stats["prompt_cache_hit_rate"] = round(stats["prompt_cache_hit_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+        stats["deadline_fallbacks"] = self.deadline_fallbacks
+        return stats
+    
+    def offline_chat(self, messages: List[Dict[str, str]]) -> str:
+        """不调用模型，直接用离线生成器生成内容（剩余时间不足以完成一次调用时使用）"""
+        return self._offline_generate(self._offline_prompt(messages))
+    
+    @staticmethod
+    def _offline_prompt(messages: List[Dict[str, str]]) -> str:
+        """离线生成器只需要用户消息中的文本"""
+        return "\n".join(message["content"] for message in messages if message["role"] == "user")
+    
+    async def stream_content(self, prompt: str, max_tokens: int = 2000, use_cache: bool = True) -> AsyncIterator[str]:
+        """以流式方式生成内容，逐块返回模型输出的文本
+        
+        Args:
+            prompt: 提示词
+            max_tokens: 最大生成token数量
+            use_cache: 是否使用响应缓存，命中时一次性产出缓存内容
+            
+        Yields:
+            生成文本的增量片段
+        """
+        async for delta in self.stream_chat([{"role": "user", "content": prompt}], max_tokens=max_tokens, use_cache=use_cache):
+            yield delta
+    
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 2000,
+        temperature: float = 0.5,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """以流式方式调用模型，逐块返回输出文本
+        
+        解析 chat/completions 的SSE响应（stream=True），每收到一个增量就立即产出。
+        只有在尚未产出任何文本时才会重试；失败时回退到离线生成器并一次性产出结果。
+        
+        Args:
+            messages: {"role", "content"} 消息列表
+            max_tokens: 最大生成token数量
+            temperature: 采样温度
+            use_cache: 是否使用响应缓存，命中时一次性产出缓存内容
+            
+        Yields:
+            生成文本的增量片段
+        """
+        prompt = self._offline_prompt(messages)
+        if not self.has_valid_key:
+            print("无API密钥，使用离线备用生成器")
+            yield self._offline_generate(prompt)
+            return
         
-        # 尝试调用API，带有重试机制
-        for attempt in range(self.max_retries):
+        data = self._build_payload(messages, max_tokens, temperature, stream=True)
+        
+        # 流式与非流式请求共用同一个缓存键
+        cache_key = make_cache_key(data["model"], data["messages"], data["temperature"], data["max_tokens"])
+        cached = await self.cache.get(cache_key, bypass=not use_cache)
+        if cached is not None:
+            yield cached
+            return
+        
+        if self.breaker.is_open:
+            print("LLM熔断器已打开，直接使用离线备用生成器")
+            yield self._offline_generate(prompt)
+            return
+        
+        retries = {"error": 0, "throttle": 0}
+        while True:
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                print("请求截止时间已到，使用离线备用生成器")
+                self._record_deadline_fallback()
+                yield self._offline_generate(prompt)
+                return
+            
+            emitted = False
+            truncated = False
+            parts = []
+            status_code = None
+            # 流式请求不做对冲，只选择当前最优端点
+            endpoint = self.router.choose()
+            if endpoint is None:
+                # 与非流式调用一致：没有可用端点时不重试，直接降级
+                print("没有可用的LLM端点（未配置API密钥），使用离线备用生成器")
+                yield self._offline_generate(prompt)
+                return
             try:
-                async with httpx.AsyncClient(timeout=120.0) as client:
-                    response = await client.post(url, json=data, headers=headers, timeout=self.timeout)
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-                        return content
-                    else:
-                        print(f"API请求失败，状态码: {response.status_code}, 响应: {response.text}")
-                        
-                        # 检查是否需要重试
-                        if response.status_code in [429, 500, 502, 503, 504] and attempt < self.max_retries - 1:
-                            # 指数退避重试
-                            retry_delay = self.retry_delay * (2 ** attempt) + random.uniform(0, 1)
-                            print(f"将在 {retry_delay:.2f} 秒后重试 ({attempt+1}/{self.max_retries})")
-                            await asyncio.sleep(retry_delay)
-                            continue
-                        
-                        # 如果重试次数用尽或不需要重试，使用离线生成
-                        print("API请求失败，使用离线备用生成器")
-                        return self._offline_generate(prompt)
+                with self.breaker.call() as breaker_call:
+                    async with self.limiter.slot() as permit:
+                        client = self._get_http_client()
+                        self._pool_requests += 1
+                        started = time.monotonic()
+                        timeout = self.timeout if remaining is None else min(self.timeout, max(0.1, remaining_time()))
+                        async with client.stream("POST", endpoint.url, json=data, headers=endpoint.headers(), timeout=timeout) as response:
+                            status_code = response.status_code
+                            permit.record(response.status_code, response.headers.get("Retry-After"))
+                            if response.status_code == 200:
+                                # 以首包时间作为端点延迟样本
+                                self.router.record_success(endpoint, time.monotonic() - started)
+                                async for line in response.aiter_lines():
+                                    chunk = self._parse_stream_line(line)
+                                    if chunk is None:
+                                        continue
+                                    if chunk == "[DONE]":
+                                        break
+                                    if remaining is not None and remaining_time() <= 0:
+                                        # 截止时间已到：停止读取，保留已生成的部分
+                                        print("请求截止时间已到，停止流式读取")
+                                        truncated = True
+                                        break
+                                    # 开启include_usage后，最后一个数据块携带用量信息
+                                    self._record_usage(chunk.get("usage"))
+                                    choices = chunk.get("choices") or [{}]
+                                    delta = (choices[0].get("delta") or {}).get("content") or ""
+                                    if delta:
+                                        emitted = True
+                                        parts.append(delta)
+                                        yield delta
+                            else:
+                                body = await response.aread()
+                                print(f"流式API请求失败（{endpoint.name}），状态码: {response.status_code}, 响应: {body.decode('utf-8', 'ignore')}")
+                                retry_after = None
+                                if response.status_code in THROTTLE_STATUS_CODES:
+                                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                                self.router.record_failure(endpoint, retry_after)
+                    breaker_call.record(status_code)
                 
-            except (httpx.ConnectError, httpx.ReadTimeout, httpx.ConnectTimeout) as e:
-                print(f"网络错误 ({type(e).__name__}): {str(e)}")
+                if truncated:
+                    self._record_deadline_fallback()
+                    if not emitted:
+                        yield self._offline_generate(prompt)
+                    return
                 
-                if attempt < self.max_retries - 1:
-                    # 指数退避重试
-                    retry_delay = self.retry_delay * (2 ** attempt) + random.uniform(0, 1)
-                    print(f"将在 {retry_delay:.2f} 秒后重试 ({attempt+1}/{self.max_retries})")
-                    await asyncio.sleep(retry_delay)
-                else:
-                    print(f"网络连接失败，重试次数已用尽，使用离线备用生成器")
-                    return self._offline_generate(prompt)
-                    
-            except Exception as e:
-                print(f"API调用时发生未知错误: {str(e)}")
-                return self._offline_generate(prompt)
+                if status_code == 200:
+                    # 只缓存完整结束的流
+                    await self.cache.set(cache_key, "".join(parts), bypass=not use_cache)
+                    return
+                
+                if await self._should_retry(status_code, retries):
+                    continue
                 
-        # 如果所有重试都失败
-        return self._offline_generate(prompt)
+                print("流式API请求失败，使用离线备用生成器")
+                yield self._offline_generate(prompt)
+                return
+            
+            except CircuitOpenError:
+                print("LLM熔断器已打开，使用离线备用生成器")
+                if not emitted:
+                    yield self._offline_generate(prompt)
+                return
+            
+            except httpx.TransportError as e:
+                print(f"流式请求网络错误 ({type(e).__name__}): {str(e)}")
+                self.router.record_failure(endpoint)
+                
+                # 已经向调用方输出过内容时不能重试，否则会产生重复文本
+                if emitted:
+                    print("流式输出中断，返回已生成的部分内容")
+                    return
+                
+                if await self._should_retry(None, retries):
+                    continue
+                
+                print("网络连接失败，重试次数已用尽，使用离线备用生成器")
+                yield self._offline_generate(prompt)
+                return
+
+            except Exception as e:
+                print(f"流式API调用时发生未知错误: {str(e)}")
+                if not emitted:
+                    yield self._offline_generate(prompt)
+                return
+    
+    @staticmethod
+    def _parse_stream_line(line: str) -> Union[Dict[str, Any], str, None]:
+        """解析一行SSE数据，返回数据块、"[DONE]"或None（非数据行）"""
+        line = line.strip()
+        if not line.startswith("data:"):
+            return None
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return "[DONE]"
+        try:
+            return json.loads(payload)
+        except json.JSONDecodeError:
+            return None
     
     def _offline_generate(self, prompt: str) -> str:
         """离线内容生成器（当API不可用时的备用方案）
@@ -257,6 +797,9 @@ class DeepSeekClient:
             基于提示词生成的基本内容
         """
         print("使用离线生成器创建基本内容")
+        scope = _usage_scope.get()
+        if scope is not None:
+            scope["offline_fallbacks"] += 1
         
         # 提取关键信息
         prompt_lines = prompt.strip().split('\n')
@@ -0,0 +1,106 @@
+"""
+增量JSON数组解析器。
+LLM以流式方式输出JSON时，不必等整个文档到达：扫描指定字段（如"outline"）的数组，
+每当数组中的一个对象的右花括号到达，就立即解析并产出这个对象。
+"""
+
+import re
+import json
+from typing import Any, Dict, List, Optional
+
+class StreamingArrayParser:
+    """逐块接收文本，产出目标数组中已完整到达的对象元素
+
+    用法:
+        parser = StreamingArrayParser("outline")
+        async for delta in stream:
+            for section in parser.feed(delta):
+                ...
+    """
+
+    def __init__(self, key: Optional[str] = None):
+        """
+        Args:
+            key: 目标数组所在的字段名；为None时解析文本中出现的第一个数组
+        """
+        if key is None:
+            self._start_pattern = re.compile(r"\[")
+        else:
+            self._start_pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = -1
+        self.done = False
+        self.emitted = 0
+        self.errors = 0
+
+    @property
+    def text(self) -> str:
+        """目前收到的全部文本"""
+        return self._buffer
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """追加一段文本，返回本次新完成的对象"""
+        self._buffer += chunk
+        if self.done:
+            return []
+        if not self._in_array:
+            match = self._start_pattern.search(self._buffer, self._pos)
+            if match is None:
+                # 保留末尾可能被截断的字段名，下次从这里继续查找
+                self._pos = max(self._pos, len(self._buffer) - 64)
+                return []
+            self._in_array = True
+            self._pos = match.end()
+        return self._scan()
+
+    def _scan(self) -> List[Dict[str, Any]]:
+        completed = []
+        buffer = self._buffer
+        index = self._pos
+        while index < len(buffer):
+            char = buffer[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                # 数组层：跳过空白、逗号和非对象元素，直到对象开始或数组结束
+                if char == "{":
+                    self._depth = 1
+                    self._object_start = index
+                elif char == "]":
+                    self.done = True
+                    index += 1
+                    break
+                elif char == '"':
+                    self._in_string = True
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._decode(buffer[self._object_start:index + 1])
+                    if item is not None:
+                        completed.append(item)
+            index += 1
+        self._pos = index
+        return completed
+
+    def _decode(self, raw: str) -> Optional[Dict[str, Any]]:
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError:
+            self.errors += 1
+            return None
+        self.emitted += 1
+        return item
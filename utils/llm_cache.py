@@ -0,0 +1,258 @@
+"""
+LLM响应缓存。
+按请求内容（模型、消息、temperature、max_tokens）的哈希寻址，
+内存LRU层在前，SQLite磁盘层在后，支持TTL、容量上限和命中统计。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple
+
+# 默认缓存文件位置
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "llm_cache.sqlite3")
+
+# 当前上下文是否跳过缓存（按API请求设置）
+_cache_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+@contextmanager
+def bypass_cache(enabled: bool = True):
+    """在当前上下文（及其创建的任务）中跳过LLM缓存
+
+    用法:
+        with bypass_cache(not request.use_cache):
+            await run_document_workflow(...)
+    """
+    token = _cache_bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _cache_bypass.reset(token)
+
+def is_cache_bypassed() -> bool:
+    """当前上下文是否要求跳过缓存"""
+    return _cache_bypass.get()
+
+def make_cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    response_format: Optional[Dict[str, Any]] = None
+) -> str:
+    """根据请求参数计算内容寻址的缓存键"""
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if response_format:
+        # 只在指定输出格式时加入，普通请求的缓存键保持不变
+        request["response_format"] = response_format
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """两级LLM响应缓存：内存LRU + SQLite磁盘层"""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        memory_size: int = 256,
+        max_entries: int = 5000,
+        ttl: float = 7 * 24 * 3600,
+        enabled: bool = True
+    ):
+        """初始化缓存
+
+        Args:
+            path: SQLite文件路径
+            memory_size: 内存LRU层的最大条目数
+            max_entries: 磁盘层的最大条目数，超过后淘汰最久未访问的条目
+            ttl: 条目有效期（秒），<=0表示永不过期
+            enabled: 是否启用缓存
+        """
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMCache":
+        """根据环境变量创建缓存"""
+        return cls(
+            path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+            memory_size=int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256")),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+            enabled=os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取SQLite连接（调用方需持有锁）"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        """写入内存LRU层（调用方需持有锁）"""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._is_expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if self._is_expired(created_at, now):
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self._remember(key, value, created_at)
+            self.disk_hits += 1
+            return value
+
+    def _set_sync(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self.writes += 1
+
+            # 超出容量时淘汰过期条目和最久未访问的条目
+            count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                if self.ttl > 0:
+                    self.expired += conn.execute(
+                        "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,)
+                    ).rowcount
+                    count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    self.evictions += conn.execute(
+                        "DELETE FROM llm_cache WHERE key IN "
+                        "(SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                        (overflow,)
+                    ).rowcount
+            conn.commit()
+
+    async def get(self, key: str, bypass: bool = False) -> Optional[str]:
+        """读取缓存，未命中或被跳过时返回None"""
+        if not self.enabled:
+            return None
+        if bypass or is_cache_bypassed():
+            self.bypassed += 1
+            return None
+        try:
+            return await asyncio.to_thread(self._get_sync, key)
+        except Exception as e:
+            print(f"读取LLM缓存失败: {e}")
+            return None
+
+    async def set(self, key: str, value: str, bypass: bool = False) -> None:
+        """写入缓存"""
+        if not self.enabled or not value or bypass or is_cache_bypassed():
+            return
+        try:
+            await asyncio.to_thread(self._set_sync, key, value)
+        except Exception as e:
+            print(f"写入LLM缓存失败: {e}")
+
+    def clear(self) -> None:
+        """清空全部缓存"""
+        with self._lock:
+            self._memory.clear()
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    def close(self) -> None:
+        """关闭SQLite连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中统计"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        disk_entries = 0
+        if self.enabled:
+            try:
+                with self._lock:
+                    disk_entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            except Exception:
+                pass
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "memory_size": self.memory_size
+        }
@@ -0,0 +1,229 @@
+"""
+进程级LLM并发限流器。
+采用AIMD（加性增、乘性减）调整并发窗口：请求成功时窗口缓慢增大，
+遇到429/503时窗口减半，并按Retry-After暂停放行。超出窗口的调用方排队等待，而不是直接失败。
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Deque
+
+# 视为限流信号的状态码
+THROTTLE_STATUS_CODES = (429, 503)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After响应头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class LimiterPermit:
+    """一次获得的并发许可，用于记录请求结果"""
+
+    def __init__(self, limiter: "AdaptiveConcurrencyLimiter"):
+        self._limiter = limiter
+        self.outcome: Optional[str] = None
+        self.retry_after: Optional[float] = None
+
+    def record(self, status_code: int, retry_after: Optional[str] = None) -> None:
+        """根据HTTP状态码记录结果"""
+        if status_code < 400:
+            self.outcome = "success"
+        elif status_code in THROTTLE_STATUS_CODES:
+            self.outcome = "throttled"
+            self.retry_after = parse_retry_after(retry_after)
+        else:
+            self.outcome = "error"
+
+    async def __aenter__(self) -> "LimiterPermit":
+        await self._limiter.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            # 调用方取消不代表上游状况，不调整窗口
+            outcome = "cancelled"
+        elif exc_type is not None:
+            outcome = "error"
+        else:
+            outcome = self.outcome or "success"
+        self._limiter.release(outcome, self.retry_after)
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD自适应并发窗口"""
+
+    def __init__(
+        self,
+        initial_limit: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 16,
+        backoff_ratio: float = 0.5,
+        throttle_pause: float = 1.0,
+        decrease_cooldown: float = 1.0
+    ):
+        """初始化限流器
+
+        Args:
+            initial_limit: 初始并发窗口
+            min_limit: 窗口下限
+            max_limit: 窗口上限
+            backoff_ratio: 遇到限流时窗口的缩小比例
+            throttle_pause: 限流响应未带Retry-After时的默认暂停时长（秒）
+            decrease_cooldown: 两次缩小窗口之间的最短间隔，避免同一波429把窗口连续减半
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.throttle_pause = throttle_pause
+        self.decrease_cooldown = decrease_cooldown
+
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.max_queue_depth = 0
+
+    @classmethod
+    def from_env(cls) -> "AdaptiveConcurrencyLimiter":
+        """根据环境变量创建限流器"""
+        return cls(
+            initial_limit=float(os.getenv("LLM_CONCURRENCY_INITIAL", "4")),
+            min_limit=float(os.getenv("LLM_CONCURRENCY_MIN", "1")),
+            max_limit=float(os.getenv("LLM_CONCURRENCY_MAX", "16")),
+            throttle_pause=float(os.getenv("LLM_THROTTLE_PAUSE", "1.0"))
+        )
+
+    @property
+    def limit(self) -> int:
+        """当前允许的并发数"""
+        return max(1, int(self._limit))
+
+    def slot(self) -> LimiterPermit:
+        """获取一个并发许可（异步上下文管理器）
+
+        用法:
+            async with limiter.slot() as permit:
+                response = await client.post(...)
+                permit.record(response.status_code, response.headers.get("Retry-After"))
+        """
+        return LimiterPermit(self)
+
+    def _can_run(self) -> bool:
+        return self._in_flight < self.limit and time.monotonic() >= self._paused_until
+
+    async def acquire(self) -> None:
+        """获取并发许可，窗口已满或处于暂停期时排队等待"""
+        if not self._waiters and self._can_run():
+            self._in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        self._schedule_wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经分配到许可但调用方被取消，归还许可
+                self._in_flight -= 1
+                self._wake()
+            else:
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self, outcome: str = "success", retry_after: Optional[float] = None) -> None:
+        """归还并发许可并根据结果调整窗口
+
+        Args:
+            outcome: "success" / "throttled" / "error" / "cancelled"
+            retry_after: 上游建议的等待秒数
+        """
+        self._in_flight = max(0, self._in_flight - 1)
+        now = time.monotonic()
+
+        if outcome == "success":
+            self.successes += 1
+            # 加性增：每个窗口的请求全部成功后窗口约增加1
+            self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+        elif outcome == "throttled":
+            self.throttled += 1
+            if now - self._last_decrease >= self.decrease_cooldown:
+                self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+                self._last_decrease = now
+            pause = retry_after if retry_after is not None else self.throttle_pause
+            self._paused_until = max(self._paused_until, now + pause)
+        elif outcome == "error":
+            self.errors += 1
+        else:
+            self.cancelled += 1
+
+        self._wake()
+
+    def _wake(self) -> None:
+        """按FIFO顺序放行排队的调用方"""
+        while self._waiters and self._can_run():
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+        self._schedule_wake()
+
+    def _schedule_wake(self) -> None:
+        """处于暂停期时，在暂停结束后再次尝试放行"""
+        if not self._waiters or self._wake_handle is not None:
+            return
+        delay = self._paused_until - time.monotonic()
+        if delay <= 0:
+            return
+
+        loop = asyncio.get_running_loop()
+
+        def _on_timer():
+            self._wake_handle = None
+            self._wake()
+
+        self._wake_handle = loop.call_later(delay, _on_timer)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回限流器状态"""
+        return {
+            "window": round(self._limit, 2),
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self._in_flight,
+            "queue_depth": sum(1 for waiter in self._waiters if not waiter.done()),
+            "max_queue_depth": self.max_queue_depth,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "successes": self.successes,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "cancelled": self.cancelled
+        }
+
+# 进程内共享的限流器实例
+llm_limiter = AdaptiveConcurrencyLimiter.from_env()
@@ -0,0 +1,200 @@
+"""
+多端点LLM路由。
+支持多个OpenAI兼容端点（不同的API密钥或内部镜像），按实时延迟和错误率评分选择端点，
+连续失败的端点会被临时摘除，并可基于p95延迟对慢请求发起对冲请求。
+"""
+
+import os
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List, Deque, Iterable
+
+from utils.stats import percentile
+
+class LLMEndpoint:
+    """一个上游端点及其健康统计"""
+
+    def __init__(self, name: str, base_url: str, api_key: str, window: int = 100):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0  # 错误率的指数滑动平均
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/v1/chat/completions"
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) >= self.ejected_until
+
+    def p95(self) -> Optional[float]:
+        return percentile(self.latencies, 95)
+
+    def score(self, default_latency: float) -> float:
+        """分数越低越优先：延迟 ×（错误惩罚）×（当前负载）"""
+        latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+        return latency * (1.0 + 4.0 * self.error_rate) * (1.0 + 0.5 * self.in_flight)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        p95 = self.p95()
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "healthy": self.is_healthy(now),
+            "ejected_for": round(max(0.0, self.ejected_until - now), 2),
+            "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "failures": self.failures,
+            "ejections": self.ejections
+        }
+
+class EndpointRouter:
+    """按健康评分在多个端点间路由，并提供对冲延迟"""
+
+    def __init__(
+        self,
+        endpoints: List[LLMEndpoint],
+        eject_after: int = 3,
+        eject_seconds: float = 30.0,
+        max_eject_seconds: float = 300.0,
+        hedge_enabled: bool = False,
+        hedge_min_delay: float = 0.5,
+        hedge_default_delay: float = 10.0,
+        hedge_min_samples: int = 20
+    ):
+        """初始化路由器
+
+        Args:
+            endpoints: 端点列表
+            eject_after: 连续失败多少次后摘除端点
+            eject_seconds: 首次摘除时长（秒），再次摘除时翻倍
+            max_eject_seconds: 摘除时长上限
+            hedge_enabled: 是否启用对冲请求
+            hedge_min_delay: 对冲延迟下限（秒）
+            hedge_default_delay: 延迟样本不足时使用的对冲延迟
+            hedge_min_samples: 使用p95作为对冲延迟所需的最少样本数
+        """
+        self.endpoints = endpoints
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_samples = hedge_min_samples
+
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    @classmethod
+    def from_env(cls, default_url: str, default_key: Optional[str]) -> "EndpointRouter":
+        """根据环境变量创建路由器
+
+        DEEPSEEK_ENDPOINTS为逗号分隔的端点列表，每项格式为"URL|API_KEY"，
+        省略密钥时使用DEEPSEEK_API_KEY。未配置时只使用DEEPSEEK_API_URL一个端点。
+        """
+        endpoints = []
+        raw = os.getenv("DEEPSEEK_ENDPOINTS", "").strip()
+        for index, entry in enumerate(item.strip() for item in raw.split(",")):
+            if not entry:
+                continue
+            url, _, key = entry.partition("|")
+            endpoints.append(LLMEndpoint(f"endpoint-{index}", url.strip(), key.strip() or (default_key or "")))
+        if not endpoints:
+            endpoints.append(LLMEndpoint("default", default_url, default_key or ""))
+
+        return cls(
+            endpoints,
+            eject_after=int(os.getenv("LLM_EJECT_AFTER_FAILURES", "3")),
+            eject_seconds=float(os.getenv("LLM_EJECT_SECONDS", "30")),
+            max_eject_seconds=float(os.getenv("LLM_MAX_EJECT_SECONDS", "300")),
+            hedge_enabled=os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+            hedge_default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10.0")),
+            hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        )
+
+    @property
+    def has_credentials(self) -> bool:
+        return any(endpoint.api_key for endpoint in self.endpoints)
+
+    def choose(self, exclude: Iterable[LLMEndpoint] = ()) -> Optional[LLMEndpoint]:
+        """选择评分最优的健康端点；全部被摘除时选最早恢复的端点"""
+        excluded = {id(endpoint) for endpoint in exclude}
+        candidates = [endpoint for endpoint in self.endpoints if id(endpoint) not in excluded and endpoint.api_key]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in candidates if endpoint.is_healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda endpoint: endpoint.ejected_until)
+
+        known = [endpoint.ewma_latency for endpoint in healthy if endpoint.ewma_latency is not None]
+        # 没有延迟数据的端点按略快于已知最快延迟估计，保证新端点会被探测到
+        default_latency = min(known) * 0.9 if known else 1.0
+        return min(healthy, key=lambda endpoint: endpoint.score(default_latency))
+
+    def hedge_delay(self, endpoint: LLMEndpoint) -> Optional[float]:
+        """返回对冲前需要等待的秒数；不满足对冲条件时返回None"""
+        if not self.hedge_enabled:
+            return None
+        if not any(other is not endpoint and other.is_healthy() and other.api_key for other in self.endpoints):
+            return None
+        if len(endpoint.latencies) >= self.hedge_min_samples:
+            return max(self.hedge_min_delay, endpoint.p95())
+        return max(self.hedge_min_delay, self.hedge_default_delay)
+
+    def record_success(self, endpoint: LLMEndpoint, latency: Optional[float] = None) -> None:
+        endpoint.successes += 1
+        endpoint.consecutive_failures = 0
+        endpoint.error_rate *= 0.8
+        if latency is not None:
+            endpoint.latencies.append(latency)
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency = 0.8 * endpoint.ewma_latency + 0.2 * latency
+
+    def record_failure(self, endpoint: LLMEndpoint, retry_after: Optional[float] = None) -> None:
+        """记录一次失败；带Retry-After的限流会让端点暂停对应时长"""
+        now = time.monotonic()
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        endpoint.error_rate = 0.8 * endpoint.error_rate + 0.2
+
+        if retry_after is not None:
+            endpoint.ejected_until = max(endpoint.ejected_until, now + retry_after)
+        if endpoint.consecutive_failures >= self.eject_after:
+            duration = min(self.max_eject_seconds, self.eject_seconds * (2 ** endpoint.ejections))
+            endpoint.ejected_until = max(endpoint.ejected_until, now + duration)
+            endpoint.ejections += 1
+            endpoint.consecutive_failures = 0
+            print(f"端点{endpoint.name}连续失败，暂时摘除{duration:.0f}秒")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints]
+        }
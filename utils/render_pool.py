@@ -0,0 +1,243 @@
+"""
+文档渲染进程池。
+python-pptx / python-docx / lxml 的渲染和保存文件都是CPU密集或阻塞的操作，直接在async路由中执行会卡住整个事件循环。
+渲染任务交给独立的进程池执行：工作进程启动时预先导入渲染库，排队的渲染数有上限，单次渲染超时后回收进程池，
+并统计排队和渲染耗时。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, List, Deque
+
+from utils.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+class RenderQueueFull(Exception):
+    """等待渲染的文档数已达上限"""
+
+class RenderTimeout(Exception):
+    """单次渲染超过时间限制"""
+
+def _init_worker() -> None:
+    """工作进程初始化：预先导入渲染库，第一次渲染不再承担导入开销"""
+    import utils.document_generator  # noqa: F401
+
+def _ping() -> int:
+    return os.getpid()
+
+def render_document(
+    document_type: str,
+    title: str,
+    outline: List[Dict[str, Any]],
+    content: Dict[str, str],
+    page_limit: Optional[int],
+    file_path: str
+) -> Dict[str, Any]:
+    """在工作进程中渲染文档并保存到file_path，返回渲染和保存的耗时"""
+    from utils.document_generator import DocumentGenerator
+
+    started = time.perf_counter()
+    if document_type.lower() == "ppt":
+        document = DocumentGenerator.generate_ppt(title, outline, content, page_limit)
+    else:
+        document = DocumentGenerator.generate_word(title, outline, content)
+    rendered = time.perf_counter()
+    document.save(file_path)
+    return {
+        "file_path": file_path,
+        "render_seconds": rendered - started,
+        "save_seconds": time.perf_counter() - rendered,
+        "pid": os.getpid()
+    }
+
+class RenderPool:
+    """预热的渲染进程池
+
+    同时渲染的文档数等于工作进程数，另有最多max_queue个在排队，超出时直接拒绝（调用方返回503）。
+    排队在本进程内进行，只有空闲的工作进程数个渲染提交给进程池，超时从渲染开始时计时，排队时间不计入。
+    渲染超时后无法单独终止某个工作进程，此时整体回收进程池，其他正在进行的渲染在新进程池中重试一次。
+    workers为0时在线程中渲染（仍不阻塞事件循环），用于不支持多进程的环境。
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, timeout: float = 120.0,
+                 start_method: str = "spawn", history: int = 200):
+        """
+        Args:
+            workers: 工作进程数，0表示在线程中渲染
+            max_queue: 等待空闲工作进程的渲染数上限
+            timeout: 单次渲染的超时时间（秒，不含排队等待的时间）
+            start_method: 工作进程的启动方式（spawn / forkserver / fork）
+            history: 保留最近多少次渲染的耗时用于计算分位数
+        """
+        self.workers = max(0, workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 提交给进程池的渲染数不超过工作进程数，其余的在这里排队
+        self._slots = asyncio.Semaphore(max(1, self.workers))
+        self._pending = 0
+        self._generation = 0
+        self.renders = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.recycles = 0
+        self._wait_times: Deque[float] = deque(maxlen=history)
+        self._render_times: Deque[float] = deque(maxlen=history)
+        self._total_times: Deque[float] = deque(maxlen=history)
+
+    @classmethod
+    def from_env(cls) -> "RenderPool":
+        return cls(
+            workers=int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1)))),
+            max_queue=int(os.getenv("RENDER_MAX_QUEUE", "16")),
+            timeout=float(os.getenv("RENDER_TIMEOUT", "120")),
+            start_method=os.getenv("RENDER_START_METHOD", "spawn")
+        )
+
+    async def start(self) -> None:
+        """创建进程池并让每个工作进程都启动、完成预热（在FastAPI启动时调用）"""
+        if self.workers == 0:
+            return
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, _ping) for _ in range(self.workers)))
+        logger.info(f"文档渲染进程池已启动: {len(set(pids))}个工作进程, 预热耗时{time.perf_counter() - started:.2f}s")
+
+    def shutdown(self) -> None:
+        """关闭进程池（在FastAPI关闭时调用），排队中的渲染被取消，等待正在进行的渲染结束"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=_init_worker
+            )
+            self._generation += 1
+        return self._executor
+
+    def _recycle(self, generation: int) -> None:
+        """终止卡住的工作进程并丢弃进程池，下一次渲染时重新创建"""
+        if self._executor is None or generation != self._generation:
+            return
+        executor = self._executor
+        self._executor = None
+        self.recycles += 1
+        # ProcessPoolExecutor没有公开终止单个任务的接口，只能终止全部工作进程
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("渲染超时，已回收文档渲染进程池")
+
+    async def render(
+        self,
+        document_type: str,
+        title: str,
+        outline: List[Dict[str, Any]],
+        content: Dict[str, str],
+        page_limit: Optional[int],
+        file_path: str
+    ) -> Dict[str, Any]:
+        """渲染文档并保存到file_path
+
+        Raises:
+            RenderQueueFull: 等待渲染的文档数已达上限
+            RenderTimeout: 渲染超过timeout秒
+        """
+        capacity = max(1, self.workers) + self.max_queue
+        if self._pending >= capacity:
+            self.rejected += 1
+            raise RenderQueueFull(f"等待渲染的文档已达上限（{capacity}）")
+
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            result = await self._submit(document_type, title, outline, content, page_limit, file_path, retry=True)
+        except RenderTimeout:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self._pending -= 1
+
+        total = time.perf_counter() - started
+        self.renders += 1
+        self._total_times.append(total)
+        self._render_times.append(result["render_seconds"] + result["save_seconds"])
+        self._wait_times.append(max(0.0, total - result["render_seconds"] - result["save_seconds"]))
+        result["total_seconds"] = total
+        return result
+
+    async def _submit(self, *args: Any, retry: bool) -> Dict[str, Any]:
+        if self.workers == 0:
+            try:
+                return await asyncio.wait_for(asyncio.to_thread(render_document, *args), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                raise RenderTimeout(f"渲染超过{self.timeout:g}秒") from None
+
+        async with self._slots:
+            # 有空闲的工作进程时才提交，超时从这里开始计时
+            executor = self._get_executor()
+            generation = self._generation
+            future = executor.submit(render_document, *args)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._recycle(generation)
+                raise RenderTimeout(f"渲染超过{self.timeout:g}秒") from None
+            except asyncio.CancelledError:
+                # 调用方自身被取消时继续传播；进程池被回收时尚未开始的渲染被取消，与下面一样重试
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                self._recycle(generation)
+                error: Exception = BrokenProcessPool("进程池已被回收，渲染未开始即被取消")
+            except BrokenProcessPool as broken:
+                # 进程池因其他渲染超时被回收（或工作进程异常退出）
+                self._recycle(generation)
+                error = broken
+        # 释放名额后在新进程池中重试一次
+        if not retry:
+            raise error
+        return await self._submit(*args, retry=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = list(self._total_times)
+        render = list(self._render_times)
+        wait = list(self._wait_times)
+
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 4) if value is not None else None
+
+        return {
+            "mode": "process" if self.workers else "thread",
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "timeout": self.timeout,
+            "pending": self._pending,
+            "renders": self.renders,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "recycles": self.recycles,
+            "render_seconds": {"p50": rounded(percentile(render, 50)), "p95": rounded(percentile(render, 95)), "max": round(max(render), 4) if render else None},
+            "queue_wait_seconds": {"p50": rounded(percentile(wait, 50)), "p95": rounded(percentile(wait, 95))},
+            "total_seconds": {"p50": rounded(percentile(total, 50)), "p95": rounded(percentile(total, 95))}
+        }
+
+# 进程内共享的渲染进程池
+render_pool = RenderPool.from_env()
@@ -0,0 +1,74 @@
+"""
+单飞（single-flight）请求合并。
+同一时刻内容完全相同的LLM请求只向上游发送一次，其余调用方共享同一个结果。
+"""
+
+import asyncio
+from typing import Dict, Any, Callable, Awaitable, TypeVar, Generic
+
+T = TypeVar("T")
+
+class _Call(Generic[T]):
+    """一次进行中的上游调用"""
+
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """按键合并并发调用
+
+    每个调用方通过asyncio.shield等待共享任务，因此单个调用方被取消（如客户端断开）
+    不会影响其他调用方；只有当所有调用方都取消时才取消上游任务。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled_upstream = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """执行fn，若已有相同key的调用在进行中则等待其结果
+
+        Args:
+            key: 请求的唯一键（如缓存键）
+            fn: 发起上游调用的协程函数
+
+        Returns:
+            上游调用的结果
+        """
+        call = self._calls.get(key)
+        if call is None or call.task.done():
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task, key=key, call=call: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                # 最后一个等待者也离开了，没有必要继续上游调用
+                call.task.cancel()
+                self._forget(key, call)
+                self.cancelled_upstream += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """返回合并统计：leaders为实际上游调用数，coalesced为节省的调用数"""
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "cancelled_upstream": self.cancelled_upstream
+        }
@@ -0,0 +1,14 @@
+"""
+延迟统计的公共函数。
+"""
+
+import math
+from typing import Iterable, Optional
+
+def percentile(values: Iterable[float], percentile: float) -> Optional[float]:
+    """计算百分位数（最近邻法：排序后第ceil(p/100 × n)个值），没有数据时返回None"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered), max(1, math.ceil(percentile * len(ordered) / 100.0))) - 1
+    return ordered[index]